@@ -1,13 +1,41 @@
 # This script calls the other preprocessing scripts to create the preprocessed data
 # The individual scripts will save their outputs in the Logs folder
+# Users whose raw files, threshold and preprocessing code did not change since the last run are not processed again
 
 import preprocess_actigraph as pra
 import preprocess_rr as prr
+import function_code.artifacts as artifacts
 import utilities.library as lib
+import utilities.pipeline as pipeline
 
 if __name__=="__main__":
+    workers = None  # Number of processes used to preprocess the users in parallel, None uses all the cores and 1 runs them one at a time
+    max_hr_at_rest = 100    # Threshold used for the anomalies in the Actigraph-processed files
+    artifact_rules = artifacts.PREPROCESS_RULES     # Beats deleted from the RR files, e.g. artifacts.PREPROCESS_RULES._replace(max_change=0.2)
+    chunk_size = None   # Rows read at a time from the RR and Actigraph files (e.g. 500000 for recordings of several days), None reads them whole
+    sweep_thresholds = []   # Thresholds to compare (e.g. list(range(80, 125, 5))), the table can then be used by create_datasets
+
     path, users = lib.get_path_and_users("RR")
+    state = pipeline.load_state()
+
     print("Preprocessing Actigraph data...\n")
-    pra.preprocessing(path, users, 100)
+    digests, done_logs = pipeline.check_users(state, "actigraph", users,
+                                              lambda user: [path + user + "/Actigraph.csv", "preprocess_actigraph.py", "function_code/open_data.py"],
+                                              {"threshold": max_hr_at_rest},
+                                              lambda user: [path + user + "/Actigraph-processed.csv"])
+    logs = pra.preprocessing(path, users, max_hr_at_rest, workers, done_logs, chunk_size)
+    pipeline.mark_users_done(state, "actigraph", digests, logs)
+
+    if len(sweep_thresholds) > 0:
+        print("\n\nComputing the anomalies for the threshold sweep...")
+        pipeline.run_stage(state, "anomalies_sweep", [path + user + "/Actigraph.csv" for user in users] + ["preprocess_actigraph.py", "function_code/open_data.py"],
+                           {"users": users, "thresholds": sweep_thresholds}, [pra.SWEEP_FILE],
+                           pra.sweep_thresholds, path, users, sweep_thresholds, workers, chunk_size)
+
     print("\n\nPreprocessing RR data...")
-    prr.preprocessing(path, users)
+    digests, done_logs = pipeline.check_users(state, "rr", users,
+                                              lambda user: [path + user + "/RR.csv", "preprocess_rr.py", "function_code/open_data.py", "function_code/artifacts.py"],
+                                              {"artifact_rules": artifact_rules._asdict()},
+                                              lambda user: [path + user + "/RR-processed.csv"])
+    logs = prr.preprocessing(path, users, workers, done_logs, chunk_size, artifact_rules)
+    pipeline.mark_users_done(state, "rr", digests, logs)
@@ -1,24 +1,69 @@
 # This script will create the train sets used for testing
+# Each step only computes the users whose input files, parameters and code changed since the last run
 
 import extract_sleep_features as esf
 import create_datasets as cd
+import feature_store as fs
 import utilities.library as lib
+import utilities.pipeline as pipeline
 import create_dataset_variants as cdv
+import preprocess_actigraph as pra
+import function_code.HRV_analysis as HRV_analysis
+import function_code.artifacts as artifacts
+
+
+# Code files used by create_datasets, a change in any of them invalidates the datasets
+FEATURES_CODE = fs.FEATURES_CODE + ["feature_store.py"]
 
 
 if __name__=="__main__":
+    anomalies_threshold = None  # Set to a threshold of the sweep in 1_Preprocess_all to take the anomalies from its table
+    freq_method = HRV_analysis.WELCH_METHOD     # Or HRV_analysis.LOMB_METHOD to compute the frequency features without interpolation
+    fill_policy = esf.NEIGHBOURS_FILL   # Or esf.LINEAR_FILL to interpolate the hours without data of the sleep features
+    workers = None  # Number of processes used to compute the features of the users in parallel, None uses all the cores
+    artifact_rules = artifacts.ECTOPIC_RULES    # Ectopic beats of the RR features, e.g. artifacts.ECTOPIC_RULES._replace(max_change=0.2, correct=True)
+    chunk_size = None   # Rows read at a time from the Actigraph-processed and RR files (e.g. 500000 for recordings of several days), None reads them whole
+
     path, users = lib.get_path_and_users("Actigraph", "Actigraph-processed", "RR", "RR-processed")
+    state = pipeline.load_state()
+
+    def user_files(user, *file_names):
+        return [path + user + "/" + file_name + ".csv" for file_name in file_names]
+
+    # Every stage is checked user by user: only the users whose files changed are computed again, the others keep their
+    # rows of the outputs. A change of the code or of the parameters of a stage updates all of its users
+    anomalies_files = [pra.SWEEP_FILE] if anomalies_threshold is not None else []
+    anomalies_file_names = [] if anomalies_threshold is not None else ["Actigraph-processed"]
 
     # Note: the sleep features are also extracted from unprocessed rr and actigraph data
     print("\nExtracting sleep features...")
-    esf.extract_features(path)
+    digests, done_logs = pipeline.check_users(state, "sleep_features", esf.get_users(path),
+                                              lambda user: user_files(user, "sleep", "questionnaire", "RR", "Actigraph") + ["extract_sleep_features.py", "function_code/open_data.py", "function_code/artifacts.py"],
+                                              {"fill_policy": fill_policy},
+                                              lambda user: ["Datasets/sleep_features.csv"])
+    logs = esf.extract_features(path, fill_policy, done_logs)
+    pipeline.mark_users_done(state, "sleep_features", digests, logs)
 
+    # The sleep features are joined to the store and the train sets are materialized again at every run, which is quick
     print("\nCreating first 4 datasets with unprocessed data...")
-    cd.create_dataset(path, users, False, [1, 2, 3, 4])
+    digests, done_logs = pipeline.check_users(state, "datasets_unprocessed", users,
+                                              lambda user: user_files(user, "RR", "questionnaire", "Actigraph-processed") + FEATURES_CODE,
+                                              {"versions": [1, 2, 3, 4], "processed": False, "freq_method": freq_method, "artifact_rules": artifact_rules._asdict()},
+                                              lambda user: [fs.STORE_FILE])
+    logs = cd.create_dataset(path, users, False, [1, 2, 3, 4], None, freq_method, workers, chunk_size, artifact_rules, done_logs)
+    pipeline.mark_users_done(state, "datasets_unprocessed", digests, logs)
 
     print("\nCreating datasets v4, v5 and v6 with processed data...")
-    cd.create_dataset(path, users, True, [4, 5, 6])
-    
-    print("\nCreating datasets variants with every questionnaire...")
-    cdv.create_variants(path, users)
-    
\ No newline at end of file
+    digests, done_logs = pipeline.check_users(state, "datasets_processed", users,
+                                              lambda user: user_files(user, "RR-processed", "questionnaire", *anomalies_file_names) + anomalies_files + FEATURES_CODE,
+                                              {"versions": [4, 5, 6], "processed": True, "threshold": anomalies_threshold, "freq_method": freq_method, "artifact_rules": artifact_rules._asdict()},
+                                              lambda user: [fs.STORE_FILE])
+    logs = cd.create_dataset(path, users, True, [4, 5, 6], anomalies_threshold, freq_method, workers, chunk_size, artifact_rules, done_logs)
+    pipeline.mark_users_done(state, "datasets_processed", digests, logs)
+
+    print("\nCreating the targets table with every questionnaire...")
+    digests, done_logs = pipeline.check_users(state, "targets", users,
+                                              lambda user: user_files(user, "questionnaire") + ["create_dataset_variants.py", "function_code/open_data.py"],
+                                              {}, lambda user: [cdv.TARGETS_FILE])
+    logs = cdv.create_targets(path, users, done_logs)
+    pipeline.mark_users_done(state, "targets", digests, logs)
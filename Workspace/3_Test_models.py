@@ -12,9 +12,14 @@ from sklearn.neighbors import KNeighborsClassifier
 from sklearn.naive_bayes import GaussianNB
 
 import os
+import numpy as np
 import pandas as pd
 import compute_metrics
-import models_testing as models_testing
+import evaluation
+import results_store
+import create_dataset_variants as cdv
+import models_testing
+import utilities.parallel as parallel
 import warnings
 warnings.filterwarnings('ignore')   # otherwise lasso spams warnings because it doesn't converge
 
@@ -62,89 +67,94 @@ def chooseModel():
     return choice
 
 
-def runTest(data, user_choice, X, y):
-    # Loop for running the tests
-    i = 0
-    predictions = []
-    faulty_iterations = []  # List containing the loops where no features were obtained with feature selection
-    
-    while i < len(data):    # Run the test on user i
-        # Split between training and test set
-        train = {
-            "X": X.loc[~X.index.isin([i])],
-            "Y": y.loc[~y.index.isin([i])]
-        }
-        test = {
-            "X": pd.DataFrame(X.loc[i]).transpose(),
-            "Y": y.loc[i]
-        }
-        # Execute the model selected by the user
-        model = models[user_choice][1]
-        do_feat_selection = models[user_choice][2]
-        # If no features are selected because the threshold is too high
-        # (in case of advanced feature selection) the user is skipped
-        try:
-            prediction, num_features = models_testing.fit_and_predict(model, do_feat_selection, train, test)
-            global NUM_OF_FEATURES
-            if NUM_OF_FEATURES == 0:
-                NUM_OF_FEATURES = num_features
-            else:
-                NUM_OF_FEATURES = (NUM_OF_FEATURES + num_features) / 2
-            predictions.append(prediction)
-        except ValueError:      # beware, the same exception occurs if the feature vector is not unidimensional (e.g. f_regression gives two vectors, not one)
-            faulty_iterations.append(i)
-        i += 1
-
-    if len(faulty_iterations) > 0:
-        print(f"No features selected in iterations {faulty_iterations}, threshold too high?")
-    # If feature selection never found features to train the model, return an empty dataframe
-    if len(predictions) == 0:
-        return pd.DataFrame()
-        
+# Running average of the number of features selected in the folds of the models, printed at the end
+def count_features(fold_results):
+    global NUM_OF_FEATURES
+    for fold_result in fold_results:
+        if fold_result is None:
+            continue
+        num_features = fold_result[1]
+        if NUM_OF_FEATURES == 0:
+            NUM_OF_FEATURES = num_features
+        else:
+            NUM_OF_FEATURES = (NUM_OF_FEATURES + num_features) / 2
+
+
+# Computes the metrics of a model from the results of its folds (see evaluation.score_model)
+# If fold_results is None the folds are run here, on WORKERS processes
+def runTest(questionnaire, user_choice, X, y, fold_results=None):
+    if fold_results is None:
+        fold_results = evaluation.evaluate({questionnaire: (X, y)}, {user_choice: models[user_choice]}, WORKERS)[(questionnaire, user_choice)]
+    count_features(fold_results)
+
     # After the execution, calculate the metrics and print them to the terminal
-    results, results_text = compute_metrics.calculate_metrics(predictions, QUESTIONNAIRE, y.min(), y.max())
-    print("\n" + results_text + "\n")
-    
-    # This part is only used when testing all models, to concatenate it to the dataframe that will be saved to file
-    df_results = pd.DataFrame(results, index=[0])
-    df_results["MODEL"] = models_names[user_choice]
-    df_results = df_results.set_index("MODEL", drop=True)
+    df_results, results_text = evaluation.score_model(fold_results, questionnaire, y.min(), y.max(), models_names[user_choice])
+    if results_text is not None:
+        print("\n" + results_text + "\n")
     return df_results
 
 
-# The main part of the code, separated from main to automate the test on all questionnaires
-def main_loop(user_choice, datasets_path):
-    # Read the dataset corresponding to the set questionnaire
-    dataset_path = os.path.join(datasets_path, QUESTIONNAIRE, DATASET_NAME + ".csv")
-    data = pd.read_csv(dataset_path).dropna()
+def load_dataset(datasets_path, questionnaire):
+    # Read the train set with the scores of the questionnaire from the targets table
+    dataset_path = os.path.join(datasets_path, DATASET_NAME + ".csv")
+    data = cdv.load_train_set(dataset_path, questionnaire, os.path.join(datasets_path, os.path.basename(cdv.TARGETS_FILE))).dropna()
     
     # Extract dependent and independent variables
-    X = data[data.columns.difference(['user', QUESTIONNAIRE])]
-    y = data[QUESTIONNAIRE]     # The value to predict is the questionnaire score
+    X = data[data.columns.difference(['user', questionnaire])]
+    y = data[questionnaire]     # The value to predict is the questionnaire score
+    return data, X, y
+
+
+# The main part of the code, separated from main to automate the test on all questionnaires
+# It does not read or write the results store: the models are always tested again and only the results files are written
+def main_loop(user_choice, datasets_path):
+    data, X, y = load_dataset(datasets_path, QUESTIONNAIRE)
     
     # If you choose to test only one model, print the results (inside runTest) and end there
     if user_choice != 0:
         print("\nModel:", models[user_choice][0])
-        runTest(data, user_choice, X, y)
+        runTest(QUESTIONNAIRE, user_choice, X, y)
         exit(0)
     
-    # If all models are tested, the results will be saved in csv and excel files within the respective folders
-    results_columns = ["MODEL", "mean_error", "max_error", "min_error", "std_dev", "correct_labels_total", "wrong_labels_total", "very_wrong_labels_total"]
-    df_results = pd.DataFrame(columns=results_columns)    # Initialize an empty dataset to save the results for each iteration
-    df_results = df_results.set_index("MODEL", drop=True)   # Once the columns are set, set the model name used as the index
-    
-    # Each model is tested and its results appended as a row to the results dataframe
+    # If all models are tested, the folds of every model are run in parallel, then the predictions of all the models are
+    # scored at once: a row for each model and a column for each fold, nan for the folds without a prediction
+    results = evaluation.evaluate({QUESTIONNAIRE: (X, y)}, models, WORKERS)
+    model_names, true_values, predictions, integer_models = [], [], [], []
     for model in models.keys():
-        print("\nModel:", models[model][0])
-        df_partial = runTest(data, model, X, y)
-        df_results = pd.concat([df_results, df_partial], axis=0, join='outer', ignore_index=False, keys=None)
-
+        count_features(results[(QUESTIONNAIRE, model)])
+        fold_predictions = evaluation.get_predictions(results[(QUESTIONNAIRE, model)])
+        pairs = [prediction for prediction in fold_predictions if prediction is not None]
+        # The models for which feature selection never found features are left out of the results
+        if len(pairs) == 0:
+            continue
+        model_names.append(models_names[model])
+        true_values.append([np.nan if prediction is None else prediction[0] for prediction in fold_predictions])
+        predictions.append([np.nan if prediction is None else prediction[1] for prediction in fold_predictions])
+        if compute_metrics.has_integer_errors([pair[0] for pair in pairs], [pair[1] for pair in pairs]):
+            integer_models.append(models_names[model])
+
+    if len(model_names) == 0:
+        df_results = pd.DataFrame(columns=results_store.METRICS_COLUMNS, index=pd.Index([], name="MODEL"))
+    else:
+        df_results = compute_metrics.batch_metrics(true_values, predictions, QUESTIONNAIRE, y.min(), y.max(), index=pd.Index(model_names, name="MODEL"))
+    # Columns in the order of the results files, object so that the errors of the classifiers stay integers
+    df_results = df_results[results_store.METRICS_COLUMNS].astype(object)
+    for model_name in model_names:
+        if model_name in integer_models:
+            df_results.at[model_name, "max_error"] = int(df_results.at[model_name, "max_error"])
+            df_results.at[model_name, "min_error"] = int(df_results.at[model_name, "min_error"])
+        print("\nModel:", model_name + "\n" + compute_metrics.metrics_text(df_results.loc[model_name], QUESTIONNAIRE) + "\n")
+    save_results(df_results, QUESTIONNAIRE)
+
+
+# The results will be saved in csv and excel files within the respective folders
+def save_results(df_results, questionnaire):
     # If the questionnaire cannot be split into three classes, the following columns do not matter:
     if df_results["correct_labels_total"].any() == "not_available":
         df_results = df_results.drop(columns=["correct_labels_total", "wrong_labels_total", "very_wrong_labels_total"])
         
     os.makedirs("Results/" + DATASET_NAME, exist_ok=True)
-    results_file = os.path.join(os.getcwd(), "Results", DATASET_NAME, QUESTIONNAIRE)
+    results_file = os.path.join(os.getcwd(), "Results", DATASET_NAME, questionnaire)
     with open(results_file + ".csv", "w") as f:
         df_results.to_csv(f)
     with open(results_file + ".xlsx", "wb") as f:
@@ -157,8 +167,8 @@ def main():
     do_all_questionnaires = True        # Set to true to test all questionnaires (only works if you choose to test all models)
     
     datasets_path = os.path.join(os.getcwd(), "Datasets")
-    # All the names of the questionnaires available in the datasets folder
-    questionnaires = [entry for entry in os.listdir(datasets_path) if os.path.isdir(os.path.join(datasets_path, entry))]
+    # All the names of the questionnaires available in the targets table
+    questionnaires = list(pd.read_csv(os.path.join(datasets_path, os.path.basename(cdv.TARGETS_FILE)), index_col="user").columns)
     #questionnaires = ["BISBAS_bis", "BISBAS_drive", "BISBAS_fun", "BISBAS_reward", "Daily_stress", "MEQ", "Pittsburgh", "panas_pos_mean", "panas_neg_mean", "STAI1", "STAI2"]
     
     # Choose the model to use
@@ -169,12 +179,54 @@ def main():
     print("\nDataset:", DATASET_NAME)
     
     if do_all_questionnaires and user_choice == 0:
+        # The results are kept in the results store, the models already tested with the same dataset, parameters,
+        # feature selection and code are skipped, so an interrupted run starts again from where it stopped
+        # The code version only covers the code of the tests and of the metrics: the models and the settings of this
+        # script (e.g. WORKERS) can change without testing again the models whose parameters did not change
+        connection = results_store.connect()
+        code_version = results_store.code_version(["evaluation.py", "models_testing.py", "compute_metrics.py"])
+        model_params = {models_names[model]: str(models[model][1]) for model in models}
+
+        # The data version hashes the train set and the targets table, so the results of other data (e.g. of the old
+        # per-questionnaire copies of the train sets, or of a changed questionnaire) are never matched
+        def store_key(questionnaire):
+            return {"dataset": DATASET_NAME,
+                    "data_version": results_store.files_version([os.path.join(datasets_path, DATASET_NAME + ".csv"),
+                                                                              os.path.join(datasets_path, os.path.basename(cdv.TARGETS_FILE))]),
+                    "questionnaire": questionnaire,
+                    "feature_selection": "r_regression > {}".format(models_testing.FEATURE_THRESHOLD),
+                    "code_version": code_version}
+
+        datasets = {}
+        pending = set()
+        for questionnaire in questionnaires:
+            tested = results_store.tested_models(connection, store_key(questionnaire), model_params)
+            for model in models:
+                if models_names[model] not in tested:
+                    pending.add((questionnaire, model))
+            if any(key[0] == questionnaire for key in pending):
+                _, X, y = load_dataset(datasets_path, questionnaire)
+                datasets[questionnaire] = (X, y)
+
+        # Each model is saved as soon as all its folds are done
+        def save_model(key, fold_results):
+            questionnaire, model = key
+            print("\nQuestionnaire:", questionnaire, "- Model:", models[model][0])
+            df_partial = runTest(questionnaire, model, datasets[questionnaire][0], datasets[questionnaire][1], fold_results)
+            num_features = [fold_result[1] for fold_result in fold_results if fold_result is not None]
+            results_store.add_result(connection, dict(store_key(questionnaire), model=models_names[model], model_params=model_params[models_names[model]]),
+                                     df_partial, sum(num_features) / len(num_features) if num_features else None)
+
+        # The folds of every model on every questionnaire still to test are run together on the pool of processes
+        print("Running {} tests of {} questionnaires on {} processes...".format(len(pending), len(datasets), parallel.get_workers(WORKERS)))
+        evaluation.evaluate(datasets, models, WORKERS, pending=pending, callback=save_model)
+
         for questionnaire in questionnaires:
             print("\n\nQuestionnaire:", questionnaire + "\n")
-            global QUESTIONNAIRE
-            QUESTIONNAIRE = questionnaire
-            main_loop(user_choice, datasets_path)
+            save_results(results_store.query_results(connection, store_key(questionnaire), model_params), questionnaire)
+        connection.close()
     else:
+        # A single questionnaire is tested without the results store, its models are always run again
         print("\n\nQuestionnaire:", QUESTIONNAIRE + "\n")
         main_loop(user_choice, datasets_path)
     
@@ -185,5 +237,6 @@ if __name__ == "__main__":
     DATASET_NAME = "train_set_v6_clean" # The dataset name without extension, used throughout the code
     QUESTIONNAIRE = "STAI2"             # If the option below is False, set the questionnaire here
     NUM_OF_FEATURES = 0                 # Used to average the number of features depending on the threshold in models_testing
+    WORKERS = None                      # Number of processes for the tests, None uses all the cores
     main()
     print("Average number of features selected during iterations:", NUM_OF_FEATURES)
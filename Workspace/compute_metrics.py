@@ -1,7 +1,9 @@
 # This script takes an array of couples as input (true value, predicted value),
 # computes the metrics and returns them with the output to be printed
+# batch_metrics does the same for a whole matrix of predictions at once
 
 import numpy as np
+import pandas as pd
 
 # Thresholds indicating different ranges of the questionnaire results (e.g., 30, 50 means up to 30 class 1, up to 50 class 2, and above 3)
 tresholds = {
@@ -26,84 +28,91 @@ questionnaire_ranges = {
     "STAI2": [20, 80]
 }
 
-def calculate_metrics(results, questionnaire, min_quest_value, max_quest_value):
-    # Iterate through the results updating max, min errors, also calculating the mean
-    max_error = 0
-    min_error = 1000
-    mean_error = 0
-
-    correct_labels = 0
-    wrong_labels = 0
-    very_wrong_labels = 0
-    
-    # The score range of the test users' values
-    data_range = max_quest_value - min_quest_value
-
-    deviations = []
-    for pair in results:        # The pairs are true value, predicted value
-        true_value = pair[0]
-        predicted_value = pair[1]
-        
-        # First, make the predicted value fall within the range of the questionnaire
-        min_value = questionnaire_ranges[questionnaire][0]
-        max_value = questionnaire_ranges[questionnaire][1]
-        if predicted_value < min_value:
-            predicted_value = min_value
-        if predicted_value > max_value:
-            predicted_value = max_value
-        
-        deviation = abs(true_value - predicted_value)
-        if deviation < min_error: min_error = deviation
-        if deviation > max_error: max_error = deviation
-        mean_error += deviation
-        deviations.append(deviation)
-        
-        # If the questionnaire can be split into three ranges, also count the number of correctly or incorrectly labeled instances
-        if questionnaire in tresholds.keys():
-            treshold_list = tresholds[questionnaire]
-            # Check if the predicted label belongs to the same range as the correct one
-            true_class = 1 if true_value < treshold_list[0] else (2 if true_value < treshold_list[1] else 3)
-            predicted_class = 1 if predicted_value < treshold_list[0] else (2 if predicted_value < treshold_list[1] else 3)
-            class_difference = abs(predicted_class - true_class)
-
-            if class_difference == 0:
-                correct_labels += 1
-            elif class_difference == 1:
-                wrong_labels += 1
-            elif class_difference == 2:
-                very_wrong_labels += 1
-
-    mean_error /= len(results)
-    
+METRICS_COLUMNS = ["mean_error", "max_error", "min_error", "std_dev", "error_ratio",
+                   "correct_labels_total", "wrong_labels_total", "very_wrong_labels_total"]
+
+
+# Class of each score: 1 up to the first threshold, 2 up to the second one, 3 above
+def get_classes(values, treshold_list):
+    return 1 + (values >= treshold_list[0]).astype(int) + (values >= treshold_list[1]).astype(int)
+
+
+def batch_metrics(true_values, predictions, questionnaire, min_quest_value, max_quest_value, index=None):
+    """
+    Computes the metrics of many sets of predictions at once (e.g. every model, or every configuration of a sweep).
+
+    Args:
+        true_values: array with the true value of each fold, or a matrix with the same shape as predictions.
+        predictions: matrix with a row for each set of predictions and a column for each fold, nan for the folds without a prediction.
+        questionnaire: name of the questionnaire, for its range and classes.
+        min_quest_value, max_quest_value: range of the scores of the users, for the error ratio.
+        index: names of the rows of the results.
+
+    Returns:
+        A dataframe with a row for each set of predictions and the columns of METRICS_COLUMNS, as calculate_metrics.
+    """
+
+    predictions = np.atleast_2d(np.asarray(predictions, dtype=float))
+    true_values = np.broadcast_to(np.asarray(true_values, dtype=float), predictions.shape)
+    valid = ~np.isnan(predictions)
+    count = valid.sum(axis=1)
+
+    # First, make the predicted values fall within the range of the questionnaire
+    min_value, max_value = questionnaire_ranges[questionnaire]
+    predictions = np.clip(predictions, min_value, max_value)
+    deviations = np.abs(true_values - predictions)
+
+    # The errors are summed in the order of the folds, as the loop they replaced
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_error = np.cumsum(np.where(valid, deviations, 0), axis=1)[:, -1] / count
+        max_error = np.where(valid, deviations, -np.inf).max(axis=1)
+        min_error = np.where(valid, deviations, np.inf).min(axis=1)
+        std_dev = np.sqrt((np.where(valid, deviations - mean_error[:, np.newaxis], 0) ** 2).sum(axis=1) / count)
     # The percentage of the mean error relative to the users' value range
-    error_ratio = (mean_error / data_range) * 100
+    error_ratio = (mean_error / (max_quest_value - min_quest_value)) * 100
 
-    std_dev = np.std(deviations)
-    
-    results = {
-        "mean_error": round(mean_error, 2),
-        "max_error": round(max_error, 2),
-        "min_error": round(min_error, 2),
-        "std_dev": round(std_dev, 2),
-        "error_ratio": round(error_ratio, 2),
-        # If the label count is available, it will be set later
-        "correct_labels_total": "not_available",
-        "wrong_labels_total": "not_available",
-        "very_wrong_labels_total": "not_available"
-    }
-
-    # Create a string to return to the test function for printing and saving
+    df_metrics = pd.DataFrame({"mean_error": np.round(mean_error, 2), "max_error": np.round(max_error, 2),
+                               "min_error": np.round(min_error, 2), "std_dev": np.round(std_dev, 2),
+                               "error_ratio": np.round(error_ratio, 2)}, index=index)
+
+    # If the questionnaire can be split into three ranges, also count the number of correctly or incorrectly labeled instances
+    if questionnaire in tresholds.keys():
+        class_difference = np.abs(get_classes(predictions, tresholds[questionnaire]) - get_classes(true_values, tresholds[questionnaire]))
+        for column, difference in [("correct_labels_total", 0), ("wrong_labels_total", 1), ("very_wrong_labels_total", 2)]:
+            labels = ((class_difference == difference) & valid).sum(axis=1)
+            df_metrics[column] = [str(label) + "/" + str(total) for label, total in zip(labels, count)]
+    else:
+        for column in METRICS_COLUMNS[5:]:
+            df_metrics[column] = "not_available"
+    return df_metrics
+
+
+# Metrics of a single list of couples (true value, predicted value), with the text to print
+def calculate_metrics(results, questionnaire, min_quest_value, max_quest_value):
+    true_values = [pair[0] for pair in results]
+    predictions = [pair[1] for pair in results]
+    results = batch_metrics(true_values, [predictions], questionnaire, min_quest_value, max_quest_value).iloc[0].to_dict()
+    if has_integer_errors(true_values, predictions):
+        results["max_error"] = int(results["max_error"])
+        results["min_error"] = int(results["min_error"])
+    return results, metrics_text(results, questionnaire)
+
+
+# The errors of integer predictions (e.g. of the classifiers) are integers
+def has_integer_errors(true_values, predictions):
+    return np.asarray(true_values).dtype.kind in "iu" and np.asarray(predictions).dtype.kind in "iu"
+
+
+# Text of the metrics of a set of predictions (a row of batch_metrics), to print
+def metrics_text(results, questionnaire):
     results_text = ("Mean error: " + str(results["mean_error"])
      + "\nMax error: " + str(results["max_error"])
      + "\nMin error: " + str(results["min_error"])
      + "\nStandard deviation: " + str(results["std_dev"]))
     
     if questionnaire in tresholds.keys():
-        results["correct_labels_total"] = str(correct_labels) + "/" + str(len(results))
-        results["wrong_labels_total"] = str(wrong_labels) + "/" + str(len(results))
-        results["very_wrong_labels_total"] = str(very_wrong_labels) + "/" + str(len(results))
         results_text += ("\nCorrectly labeled instances: " + results["correct_labels_total"]
          + "\nIncorrectly labeled instances: " + results["wrong_labels_total"]
          + "\nVery incorrectly labeled instances: " + results["very_wrong_labels_total"])
     
-    return results, results_text
+    return results_text
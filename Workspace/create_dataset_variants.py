@@ -1,5 +1,6 @@
-# Script to be executed after all train sets with the STAI2 values have been created, it allows
-# to change the metric with those of the others questionnaires to test them separately
+# Script to be executed after the train sets have been created, it saves the scores of every questionnaire
+# in a single targets table, so that each questionnaire can be tested separately on the same train sets
+# The train sets are not copied, 3_Test_models joins the target to the features by user when it loads them
 
 import function_code.open_data as open_data
 import utilities.library as lib
@@ -7,52 +8,62 @@ import pandas as pd
 import os
 
 
-def save_to_csv(datasets_path, column, dataset, df_dataset):
-    # Each dataset variant gets its own folder
-    os.makedirs(datasets_path + column, exist_ok=True)
-    df_dataset.to_csv(datasets_path + column + "/" + dataset)
-    
+TARGETS_FILE = "Datasets/targets.csv"
+
 
-def create_variants(questionnaire_path, users):
-    # Setting the paths and datasets to be changed
-    datasets_path = os.getcwd() + "/Datasets/"
-    datasets_to_change = ["train_set_v5_clean.csv", "train_set_v6_clean.csv"]
+# Table with a row for each user and a column for each questionnaire that can be used as target
+def get_targets(questionnaire_path, users):
     panas_pos_columns = ["panas_pos_10", "panas_pos_14", "panas_pos_18", "panas_pos_22", "panas_pos_9+1"]
     panas_neg_columns = ["panas_neg_10", "panas_neg_14", "panas_neg_18", "panas_neg_22", "panas_neg_9+1"]
     
     # Saving questionnaire data to dataframe
-    df_questionnaire = open_data.create_dataset(questionnaire_path, users, 'questionnaire').reset_index()
+    df_questionnaire = open_data.create_dataset(questionnaire_path, users, 'questionnaire')
     
-    # For each dataset, create corresponding variants where the STAI2 column
-    # is replaced by another questionnaire column
-    for dataset in datasets_to_change:
-        df_dataset = pd.read_csv(datasets_path + dataset).drop(columns=["STAI2"])
-        for column in df_questionnaire.columns:
-            
-            if column == "panas_pos_10":
-                df_panas_pos = df_questionnaire[panas_pos_columns]
-                # Calculate the mean of panas values for each row
-                df_dataset["panas_pos_mean"] = round(df_panas_pos.mean(axis=1), 0)
-                save_to_csv(datasets_path, "panas_pos_mean", dataset, df_dataset)
-                df_dataset = df_dataset.drop(columns=["panas_pos_mean"])
-                
-            if column == "panas_neg_10":
-                df_panas_neg = df_questionnaire[panas_neg_columns]
-                # Calculate the mean of panas values for each row
-                df_dataset["panas_neg_mean"] = round(df_panas_neg.mean(axis=1), 0)
-                save_to_csv(datasets_path, "panas_neg_mean", dataset, df_dataset)
-                df_dataset = df_dataset.drop(columns=["panas_neg_mean"])
-            
-            if column != "user" and not column.startswith("panas"):
-                # Yes, we also create a folder for STAI2 for when we test everything together
-                df_dataset[column] = df_questionnaire[column]
-                save_to_csv(datasets_path, column, dataset, df_dataset)
-                df_dataset = df_dataset.drop(columns=[column])
-                
+    df_targets = pd.DataFrame(index=df_questionnaire.index)
+    for column in df_questionnaire.columns:
+        if column == "panas_pos_10":
+            # Calculate the mean of panas values for each row
+            df_targets["panas_pos_mean"] = round(df_questionnaire[panas_pos_columns].mean(axis=1), 0)
+        if column == "panas_neg_10":
+            df_targets["panas_neg_mean"] = round(df_questionnaire[panas_neg_columns].mean(axis=1), 0)
+        if not column.startswith("panas"):
+            df_targets[column] = df_questionnaire[column]
+    return df_targets.sort_index()
+
+
+# done_logs maps the users that are already up to date to their logs, they keep their row of the previous table
+# Returns the log of every user, the questionnaires that it has
+def create_targets(questionnaire_path, users, done_logs=None):
+    os.makedirs(os.path.join(os.getcwd(), "Datasets"), exist_ok=True)
+    targets_path = os.path.join(os.getcwd(), TARGETS_FILE)
+
+    frames = []
+    if done_logs and os.path.isfile(targets_path):
+        # round_trip parsing gives back exactly the values that were saved
+        df_done = pd.read_csv(targets_path, index_col="user", float_precision="round_trip")
+        frames.append(df_done[df_done.index.isin([user for user in users if user in done_logs])])
+    users_to_update = [user for user in users if not any(user in frame.index for frame in frames)]
+    if len(users) > len(users_to_update):
+        print("Skipping {} users that are already up to date".format(len(users) - len(users_to_update)))
+    if len(users_to_update) > 0:
+        frames.append(get_targets(questionnaire_path, users_to_update))
+
+    df_targets = pd.concat([frame for frame in frames if len(frame) > 0], sort=False).sort_index()
+    df_targets.to_csv(targets_path)
     print("Done!")
+    return {user: list(df_targets.columns[df_targets.loc[user].notna()]) if user in df_targets.index else [] for user in users}
+
+
+# Train set with the features of dataset_file and the scores of the questionnaire as last column
+# The target columns already in the train set (e.g. STAI2) are replaced, the users are matched by name
+def load_train_set(dataset_file, questionnaire, targets_file=TARGETS_FILE):
+    df_targets = pd.read_csv(targets_file, index_col="user")
+    df_dataset = pd.read_csv(dataset_file)
+    df_dataset = df_dataset.drop(columns=[column for column in df_targets.columns if column in df_dataset.columns])
+    df_dataset[questionnaire] = df_dataset["user"].map(df_targets[questionnaire])
+    return df_dataset
 
 
 if __name__=="__main__":
     questionnaire_path, users = lib.get_path_and_users("questionnaire")
-    create_variants(questionnaire_path, users)
-    
\ No newline at end of file
+    create_targets(questionnaire_path, users)
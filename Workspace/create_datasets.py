@@ -3,18 +3,21 @@
 import os
 import numpy as np
 import pandas as pd
-import functools
 import function_code.open_data as open_data
 import function_code.HRV_analysis as HRV_analysis
+import function_code.artifacts as artifacts
 import function_code.circadian as circadian
+import function_code.rr_store as rr_store
 import utilities.library as lib
+import utilities.parallel as parallel
+import preprocess_actigraph
+import feature_store
 import warnings
 warnings.filterwarnings("ignore")
 
 
-def compute_rmssd(group):
-    # Calculate successive differences
-    diff = group['ibi_s'].diff().dropna()   # Removes NaN elements
+def compute_rmssd(diff):
+    # diff contains the successive differences of the intervals, without the NaN elements
     # Square each difference
     diff_squared = diff ** 2
     # Calculate the mean of squared differences
@@ -24,23 +27,21 @@ def compute_rmssd(group):
     return rmssd
 
 
-def compute_ratio(group):
-    # Calculate successive differences
-    diff = group['ibi_s'].diff().dropna()   # Removes NaN elements
+def compute_ratio(diff, total_IBIs):
     # Find differences greater than 50 ms
     diff_greater_than_50 = diff[abs(diff) > 0.05]
-    # Calculate the total number of IBI
-    total_IBIs = len(group)
     # Calculate the number of successive IBI pairs that differ by more than 50 ms
     num_pairs_diff_greater_than_50 = len(diff_greater_than_50)
-    # Calculate the required ratio
+    # Calculate the required ratio over the total number of IBI
     ratio = num_pairs_diff_greater_than_50 / total_IBIs
     return ratio
 
 
-def compute_freq(group):
-    nn_intervals = list(1000 * group['ibi_s'].dropna().values)
-    freq, psd = HRV_analysis._get_freq_psd_from_nn_intervals(nn_intervals=nn_intervals, sampling_frequency = 7)
+# method is HRV_analysis.WELCH_METHOD (interpolation at 7 Hz) or HRV_analysis.LOMB_METHOD (directly on the beats)
+# timestamps are the times of the intervals in seconds, only used by the Lomb method so that the gaps are not filled
+def compute_freq(nn_intervals, timestamps=None, method=HRV_analysis.WELCH_METHOD):
+    freq, psd = HRV_analysis._get_freq_psd_from_nn_intervals(nn_intervals=nn_intervals, method=method, sampling_frequency = 7,
+                                                             timestamps=timestamps)
 
     vlf_indexes = np.logical_and(freq >= 0.003, freq < 0.04)
     lf_indexes = np.logical_and(freq >= 0.04, freq < 0.15)
@@ -54,169 +55,182 @@ def compute_freq(group):
     return {"vlf": vlf_power, "lf": lf_power, "hf": hf_power, "total_power": total_power}
 
 
-def compute_sd(group):
-    nn_intervals = list(1000 * group['ibi_s'].dropna().values)
+def compute_sd(nn_intervals):
     diff_nn_intervals = np.diff(nn_intervals)
     sd1 = np.sqrt(np.std(diff_nn_intervals, ddof=1) ** 2 * 0.5)
     sd2 = np.sqrt(2 * np.std(nn_intervals, ddof=1) ** 2 - 0.5 * np.std(diff_nn_intervals, ddof=1) ** 2)
     return {"SD1": sd1, "SD2": sd2, "SD1/SD2": (sd1/sd2)*10}
 
 
-def compute_anomalies_percentage(group):
+# Number of anomalies and of rows spent sitting or lying down, summed over the chunks when the files are streamed
+def count_anomalies(group):
     n_anomalies = len(group[group["Anomaly"] == True].index)
     cond_inclinometer_1 = group['Inclinometer Sitting'] == 1.0
     cond_inclinometer_2 = group['Inclinometer Lying'] == 1.0
     rows_while_sitting_or_lying = len(group[cond_inclinometer_1 | cond_inclinometer_2].index)
+    return n_anomalies, rows_while_sitting_or_lying
+
+
+def compute_anomalies_percentage(group):
+    n_anomalies, rows_while_sitting_or_lying = count_anomalies(group)
     anomalies_percentage = round((n_anomalies / rows_while_sitting_or_lying) * 100, 2)
     return anomalies_percentage
 
 
+# Same percentages as compute_anomalies_percentage, reading the Actigraph-processed files chunk_size rows at a time
+def stream_anomalies_percentage(path, users, chunk_size):
+    counts = {}
+    for user, df in open_data.iter_dataset(path, users, 'Actigraph-processed', chunk_size,
+                                           columns=['Anomaly', 'Inclinometer Sitting', 'Inclinometer Lying']):
+        n_anomalies, rows_while_sitting_or_lying = count_anomalies(df)
+        previous = counts.get(user, (0, 0))
+        counts[user] = (previous[0] + n_anomalies, previous[1] + rows_while_sitting_or_lying)
+    percentages = {user: round((n_anomalies / rows) * 100, 2) for user, (n_anomalies, rows) in counts.items()}
+    return pd.Series(percentages, name='Anomalies').rename_axis('user').sort_index()
+
+
+# Reads the anomalies percentages of the chosen threshold from the table written by preprocess_actigraph.sweep_thresholds
+def read_anomalies_sweep(threshold):
+    df_sweep = pd.read_csv(os.getcwd() + "/" + preprocess_actigraph.SWEEP_FILE, index_col="user")
+    return df_sweep[str(threshold)].rename('Anomalies')
+
+
 def compute_mesor(group):
     # Calculate MESOR using the formula MESOR = offset + (amplitude * cos(phase))
     return group['offset'] + (group['amp'] + np.cos(group['phase']))
 
-def time_to_seconds(time, day):
-    seconds = float(time.split(':')[0])*60*60 + float(time.split(':')[1])*60 + float(time.split(':')[2])
-    if (day != 1):
-        seconds += 24*60*60
-    return seconds
 
-def compute_sinusoid_data(group):
-    # Transform Time format in seconds. 0 refers to 12 AM, while positive and negative values refer to pre and post midnight, respectively.
-    group['timestamp'] = [time_to_seconds(time, day) for time, day in zip(group['time'], group['day'])]
+# Fits the cosinor curve of the heart rate, timestamps are in seconds and 0 refers to 12 AM of the first day
+def compute_sinusoid_data(timestamps, hr):
+    # Fit single component cosinor curves on the rolling mean of the heart rate
+    hr_rolling = pd.Series(hr).rolling(60, min_periods=1).mean()
+    res = circadian.fit_sin(timestamps, hr_rolling)
 
-    # Compute Heart Rate values from ibi
-    group['hr'] = [60/ibi for ibi in group['ibi_s']]
-    group = group.dropna()
-    
-    # Fit single component cosinor curves
-    res = circadian.fit_sin(group['timestamp'], group['hr'].rolling(60, min_periods=1).mean())
-    # res2 = circadian.fit_multi(group['timestamp'], group['hr'].rolling(60,min_periods=1).mean(), plot=True)
-    
     del res["r2"]
     del res["tt"]
     del res["ff"]
-    
+
     return res
 
 
+# Computes every RR feature of a user in a single pass: the data of the user is read once and the successive
+# differences, heart rate and power spectral density are shared by the features that need them
+# Runs in the worker processes of create_dataset, so it takes the beats from the RR store instead of receiving the data
+def compute_user_features(user, rr_dataset, freq_method=HRV_analysis.WELCH_METHOD):
+    # Intervals with the ectopic beats filtered out (NaN) or corrected, as cleaned by the store (see create_dataset)
+    ibi, timestamps = rr_store.open_store(rr_dataset).get_clean(user)
+    valid = ~np.isnan(ibi)
+
+    # Shared intermediates: differences of consecutive rows (a filtered beat removes both of its differences),
+    # intervals in ms and times of the valid beats
+    diff = np.diff(ibi)
+    diff = diff[~np.isnan(diff)]
+    nn_intervals = 1000 * ibi[valid]
+    timestamps = timestamps[valid]
+
+    features = {"HR_mean": np.mean(60 / ibi[valid] * 10),   # The *10 is to have the data as in the paper
+                "RMSSD": compute_rmssd(diff) * 1000,
+                "SDNN": np.std(ibi[valid], ddof=1) * 1000,
+                "PNN50": compute_ratio(diff, len(ibi)) * 100}
+    features.update(compute_freq(nn_intervals, timestamps if freq_method == HRV_analysis.LOMB_METHOD else None, freq_method))
+    features.update(compute_sd(nn_intervals))
+
+    sinusoid = compute_sinusoid_data(timestamps, 60 / ibi[valid])
+    features.update({"amp": sinusoid["amp"], "APhase": sinusoid["APhase"], "MESOR": compute_mesor(sinusoid)})
+    return features
+
+
+# Percentage of anomalies of each user, read from the threshold sweep table if anomalies_threshold is set
+def get_anomalies(path, users, anomalies_threshold=None, chunk_size=None):
+    if anomalies_threshold is not None:
+        print("Reading anomalies for threshold {}...".format(anomalies_threshold))
+        return read_anomalies_sweep(anomalies_threshold)
+    if chunk_size is not None:
+        print("Counting anomalies...")
+        return stream_anomalies_percentage(path, users, chunk_size)
+    print("Loading actigraph data...")
+    df_actigraph = open_data.create_dataset(path, users, 'Actigraph-processed',
+                                            columns=['Anomaly', 'Inclinometer Sitting', 'Inclinometer Lying']).reset_index()
+    print("Counting anomalies...")
+    return df_actigraph.groupby("user").apply(compute_anomalies_percentage).rename('Anomalies')
+
+
 # Dataset versions is a list that contains the versions of the dataset to create
-def create_dataset(path, users, use_processed_data, dataset_versions):
+# If anomalies_threshold is set, the anomalies are taken from the threshold sweep table instead of Actigraph-processed
+# freq_method is the method used for the power spectral density of the frequency features (see compute_freq)
+# workers is the number of processes used to compute the features of the users in parallel (None uses all the cores)
+# chunk_size is the number of rows read at a time from the Actigraph-processed and RR files, None reads them whole
+# artifact_rules are the rules of the ectopic beats, by default the intervals outside (0.3, 2) seconds are filtered out
+# done_logs maps the users that are already up to date to their logs, their features are taken from the feature store
+# Returns the log of every user, the artifact counts of its beats
+def create_dataset(path, users, use_processed_data, dataset_versions, anomalies_threshold=None, freq_method=HRV_analysis.WELCH_METHOD,
+                   workers=1, chunk_size=None, artifact_rules=artifacts.ECTOPIC_RULES, done_logs=None):
     os.makedirs(os.getcwd() + "/Datasets", exist_ok=True)
 
     count_anomalies = False
     if 4 in dataset_versions or 5 in dataset_versions or 6 in dataset_versions:
         count_anomalies = True
-    
-    if count_anomalies:     # Set first to crash immediately if the script is not executed
-        print("Loading actigraph data...")
-        df_actigraph = open_data.create_dataset(path, users, 'Actigraph-processed').reset_index()
-        print("Counting anomalies...")
-        df_anomalies = df_actigraph.groupby("user").apply(compute_anomalies_percentage).rename('Anomalies')
-        # print(df_anomalies)
-    
-    # It is better to have cleaned the data beforehand
 
-    print("Loading RR data...")
-    
     rr_dataset = 'RR-processed' if use_processed_data else 'RR'
-    df_rr = open_data.create_dataset(path, users, rr_dataset).reset_index()
-    
-    df_rr = df_rr[['user', 'ibi_s', 'time', 'day']]
-    
-    # Filter ectopic beats (those with a distance < 0.3 / > 2 seconds from the previous one)
-    df_rr['ibi_s'] = [x if x<2 else np.nan for x in df_rr['ibi_s']]
-    df_rr['ibi_s'] = [x if x>0.3 else np.nan for x in df_rr['ibi_s']]
-    
-    
-    print("Calculating HR_mean...")
-    dr_hr = df_rr.copy()
-    dr_hr['ibi_s'] = 60 / dr_hr["ibi_s"] * 10   # The *10 is to have the data as in the paper
-    df_hr_mean = dr_hr.groupby("user").mean().rename(columns={"ibi_s": "HR_mean"})
-    # print(df_hr_mean)
-    
-    
-    print("Calculating RMSSD...")
-    df_rmssd = df_rr.groupby('user').apply(compute_rmssd).rename('RMSSD') * 1000
-    # print(df_rmssd)
-    
-
-    print("Calculating SDNN...")
-    df_std = df_rr.groupby("user").std().rename(columns={"ibi_s": "SDNN"}) * 1000
-    # print(df_std)
-    
-
-    print("Calculating PNN50...")
-    df_pnn50 = df_rr.groupby('user').apply(compute_ratio).rename('PNN50') * 100
-    # print(df_pnn50)
-    
+    groups = {group: columns for group, columns in feature_store.FEATURE_GROUPS.items() if group != "anomalies" or count_anomalies}
+    # The users that are up to date keep their rows of the store, only the features of the others are computed
+    df_stored, stored_members = feature_store.load_rows(rr_dataset, [user for user in users if user in (done_logs or {})], list(groups))
+    users_to_update = [user for user in users if user not in df_stored.index]
+    if len(df_stored) > 0:
+        print("Skipping {} users that are already up to date".format(len(df_stored)))
 
-    print("Calculating frequencies...")
-    freq_data = df_rr.groupby("user").apply(compute_freq)
-    df_freq = pd.DataFrame(freq_data.tolist(), index=freq_data.index)
-    # print(df_freq)
+    if count_anomalies and len(users_to_update) > 0:     # Set first to crash immediately if the script is not executed
+        df_anomalies = get_anomalies(path, users_to_update, anomalies_threshold, chunk_size)
     
+    # It is better to have cleaned the data beforehand
 
-    print("Calculating SD1 and SD2...")
-    SD_data = df_rr.groupby('user').apply(compute_sd)
-    df_SD = pd.DataFrame(SD_data.tolist(), index=SD_data.index)
-    # print(df_SD)
-
-
-    print("Calculating sinusoid data...")
-    df_sinusoid = df_rr.copy()
-    sinusoid_data = df_sinusoid.groupby('user').apply(compute_sinusoid_data)
-    df_sinusoid = pd.DataFrame(sinusoid_data.tolist(), index=sinusoid_data.index)
-    # print(df_sinusoid)
-    df_sinusoid['MESOR'] = df_sinusoid.apply(compute_mesor, axis=1).rename('MESOR')
-    del df_sinusoid['phase']
-    del df_sinusoid['offset']
-    # print(df_sinusoid)
-    
-    
-    if 6 in dataset_versions:   # only train_set_v6 has the sleep features
+    print("Calculating the RR features of {} users...".format(len(users_to_update)))
+    # The store is built again only for the users whose RR files changed, so the beats are cleaned only once
+    store = rr_store.load_store(path, users, rr_dataset, chunk_size, artifact_rules)
+    os.makedirs(os.getcwd() + "/Outputs", exist_ok=True)
+    store.artifact_report().to_csv(os.getcwd() + "/Outputs/{} artifacts.csv".format(rr_dataset))
+
+    # The users without a questionnaire or anomalies are not in the train sets that use them
+    new_members = {}
+    df_features = df_stored
+    if len(users_to_update) > 0:
+        results = parallel.run_per_user(compute_user_features, users_to_update, (rr_dataset, freq_method), workers)
+        df_new = pd.DataFrame(list(results), index=users_to_update)
+        df_new.index.name = "user"
+
+        if count_anomalies:
+            df_new = df_new.join(df_anomalies)
+            new_members["anomalies"] = [user for user in df_anomalies.index if user in users_to_update]
+        # print(df_new)
+
+        print("Retrieving STAI2 values...")
+        df_stai2 = open_data.create_dataset(path, users_to_update, 'questionnaire', columns=["STAI2"])
+        df_new = df_new.join(df_stai2["STAI2"])
+        new_members["target"] = list(df_stai2.index)
+        # print(df_stai2)
+
+        df_features = pd.concat([df_stored, df_new], sort=False) if len(df_stored) > 0 else df_new
+    df_features = df_features.sort_index()
+    members = {group: stored_members.get(group, []) + new_members.get(group, users_to_update) for group in groups}
+
+    sleep_file = os.getcwd() + "/Datasets/sleep_features.csv"
+    if 6 in dataset_versions or os.path.isfile(sleep_file):   # only train_set_v6 has the sleep features
         print("Retrieving sleep features...")
-        df_sleep = pd.read_csv(os.getcwd() + "/Datasets/sleep_features.csv").drop(columns=["STAI2"])
+        df_sleep = pd.read_csv(sleep_file).drop(columns=["STAI2"]).set_index("user")
+        df_features = df_features.join(df_sleep)
+        groups["sleep"] = list(df_sleep.columns)
+        members["sleep"] = list(df_sleep.index)
         # print(df_sleep)
 
+    print("Saving the features to the feature store...")
+    provenance = {"anomalies_threshold": anomalies_threshold, "freq_method": freq_method, "code_version": feature_store.code_version()}
+    feature_store.update_store(df_features, rr_dataset, groups, provenance, members)
 
-    print("Retrieving STAI2 values...")
-    df_stai2 = open_data.create_dataset(path, users, 'questionnaire').reset_index()[['user',"STAI2"]]
-    # print(df_stai2)
-
-
-    print("Merging dataframes and saving to file...")
-    dfs1 = [df_hr_mean, df_rmssd, df_std, df_pnn50, df_stai2]
-    dfs2 = [df_hr_mean, df_rmssd, df_std, df_pnn50, df_freq, df_SD, df_stai2]
-    dfs3 = [df_hr_mean, df_rmssd, df_std, df_pnn50, df_freq, df_stai2]
-    datasets = [dfs1, dfs2, dfs3]
-    if count_anomalies:
-        dfs4 = [df_hr_mean, df_rmssd, df_std, df_pnn50, df_freq, df_SD, df_anomalies, df_sinusoid, df_stai2]
-        datasets.append(dfs4)
-        dfs5 = dfs4     # Set 5 will remove users 4 and 7
-        datasets.append(dfs5)
-        if 6 in dataset_versions:
-            dfs6 = [df_hr_mean, df_rmssd, df_std, df_pnn50, df_freq, df_SD, df_anomalies, df_sinusoid, df_stai2, df_sleep]
-            datasets.append(dfs6)
-
-    for version in dataset_versions:        # Take each dataset to create from the list passed before
-        df_merged = functools.reduce(lambda left, right: pd.merge(left, right, on=['user']), datasets[version - 1])
-        del df_merged["day_x"]
-        del df_merged["day_y"]
-        # print(df_merged)
-        df_merged = df_merged.round(2).set_index("user")
-        if use_processed_data:
-            print("Creating train_set_v{}_clean.csv".format(version))
-            if version == 5 or version == 6:
-                df_merged2 = df_merged.drop("user_4").dropna()
-                df_merged2.to_csv(os.getcwd() + "/Datasets/train_set_v{}_clean.csv".format(version))
-            else:
-                df_merged.to_csv(os.getcwd() + "/Datasets/train_set_v{}_clean.csv".format(version))
-        else:
-            print("Creating train_set_v{}.csv".format(version))
-            df_merged.to_csv(os.getcwd() + "/Datasets/train_set_v{}.csv".format(version))
+    # The train sets are projections of the store, see feature_store.DATASET_VERSIONS
+    feature_store.materialize(dataset_versions, use_processed_data)
 
     print("Done!")
+    return {user: store.index["artifacts"][user] for user in users}
 
 
 
@@ -0,0 +1,152 @@
+# Parallel leave-one-subject-out evaluation of the models of 3_Test_models
+# Every (questionnaire, model, fold) is an independent task: the tasks are run on a pool of processes, each one
+# on a fresh clone of the model, so the results do not depend on the number of workers or on the order of the tasks
+# The models without a fixed random_state get a seed derived from the questionnaire, the model and the fold
+# LinearRegression and Ridge with the same selected features in every fold skip the tasks, their leave-one-out
+# predictions come from a single fit (see models_testing.looLinearPredictions)
+# The metrics of a model are computed from the results of its folds by score_model, which is the code versioned by
+# the results store together with the tests themselves
+
+import zlib
+from collections import Counter
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.base import clone
+import models_testing
+import compute_metrics
+import utilities.parallel as parallel
+
+
+# Seed of a task, the same for every run with the same base seed
+def task_seed(seed, questionnaire, model_key, fold):
+    sequence = np.random.SeedSequence([seed, zlib.crc32(questionnaire.encode()), model_key, fold])
+    return int(sequence.generate_state(1)[0])
+
+
+# Fresh copy of the model for a task, the random_state set in the models dict is kept
+def clone_model(model, seed):
+    model = clone(model)
+    if "random_state" in model.get_params() and model.get_params()["random_state"] is None:
+        model.set_params(random_state=seed)
+    return model
+
+
+# Trains the model on every user but one and predicts the remaining one
+# features are the features selected for the fold, if None they are selected by fit_and_predict
+# Returns ((true value, prediction), number of features), or None if no features were selected
+def run_fold(X, y, fold, model, do_feat_selection, seed, features=None):
+    train = {
+        "X": X.loc[~X.index.isin([fold])],
+        "Y": y.loc[~y.index.isin([fold])]
+    }
+    test = {
+        "X": pd.DataFrame(X.loc[fold]).transpose(),
+        "Y": y.loc[fold]
+    }
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")     # otherwise lasso spams warnings because it doesn't converge
+        try:
+            return models_testing.fit_and_predict(clone_model(model, seed), do_feat_selection, train, test, features)
+        except ValueError:      # no features selected, see get_predictions
+            return None
+
+
+def _run_task(task):
+    return run_fold(*task)
+
+
+def _run_tasks(tasks, workers):
+    # Yields the results of the tasks in their order, as soon as they are available
+    workers = min(parallel.get_workers(workers), len(tasks))
+    if workers <= 1:
+        for task in tasks:
+            yield _run_task(task)
+        return
+    # The tasks are sent in chunks, a single fit on 22 users is shorter than the time needed to send it
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(_run_task, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+            yield result
+
+
+def evaluate(datasets, models, workers=1, seed=0, threshold=models_testing.FEATURE_THRESHOLD, pending=None, callback=None):
+    """
+    Runs the leave-one-subject-out tests of every model on every dataset.
+
+    Args:
+        datasets: dict from the questionnaire to the (X, y) of its dataset.
+        models: dict from the model key to (name, sklearn model, whether it supports feature selection).
+        workers: number of processes, None uses all the cores.
+        seed: base seed of the tasks.
+        threshold: minimum correlation of the features selected in each fold.
+        pending: set of the (questionnaire, model key) to test, all of them if None.
+        callback: function called with the (questionnaire, model key) and the list of its fold results as soon as
+            all the folds of a model are done, e.g. to save them before the others finish.
+
+    Returns:
+        A dict from (questionnaire, model key) to the list of the results of run_fold, one for each fold in order.
+    """
+
+    tasks = []
+    keys = []
+    results = {}
+    for questionnaire, (X, y) in datasets.items():
+        # The features of every fold are selected once for all the models
+        masks = models_testing.looFeatSelection(X, y, threshold)
+        fold_features = [list(X.columns[masks[X.index.get_loc(fold)]]) for fold in range(len(X))]
+        for model_key, (_, model, do_feat_selection) in models.items():
+            if pending is not None and (questionnaire, model_key) not in pending:
+                continue
+            # Linear models with the same features in every fold get all their predictions from one fit
+            if models_testing.supportsLooFastPath(model) and fold_features[0] and all(features == fold_features[0] for features in fold_features):
+                predictions = models_testing.looLinearPredictions(model, X[fold_features[0]], y)
+                if predictions is not None:
+                    results[(questionnaire, model_key)] = [((y.loc[fold], predictions[X.index.get_loc(fold)]), len(fold_features[0]))
+                                                           for fold in range(len(X))]
+                    if callback is not None:
+                        callback((questionnaire, model_key), results[(questionnaire, model_key)])
+                    continue
+            for fold in range(len(X)):
+                tasks.append((X, y, fold, model, do_feat_selection, task_seed(seed, questionnaire, model_key, fold), fold_features[fold]))
+                keys.append((questionnaire, model_key))
+
+    folds = Counter(keys)
+    for key, fold_result in zip(keys, _run_tasks(tasks, workers)):
+        results.setdefault(key, []).append(fold_result)
+        if callback is not None and len(results[key]) == folds[key]:
+            callback(key, results[key])
+    return results
+
+
+# The couples (true value, predicted value) of the folds of a model, from their results (see run_fold)
+# The folds where no features were selected have None instead
+def get_predictions(fold_results):
+    predictions = []
+    faulty_iterations = []  # List containing the loops where no features were obtained with feature selection
+    for i, fold_result in enumerate(fold_results):
+        # If no features are selected because the threshold is too high
+        # (in case of advanced feature selection) the user is skipped
+        if fold_result is None:
+            faulty_iterations.append(i)
+            predictions.append(None)
+            continue
+        predictions.append(fold_result[0])
+
+    if len(faulty_iterations) > 0:
+        print(f"No features selected in iterations {faulty_iterations}, threshold too high?")
+    return predictions
+
+
+# Computes the metrics of a model from the results of its folds, as a row named model_name, with the text to print
+# If feature selection never found features to train the model, the row is an empty dataframe and the text is None
+def score_model(fold_results, questionnaire, min_quest_value, max_quest_value, model_name):
+    predictions = [prediction for prediction in get_predictions(fold_results) if prediction is not None]
+    if len(predictions) == 0:
+        return pd.DataFrame(), None
+
+    results, results_text = compute_metrics.calculate_metrics(predictions, questionnaire, min_quest_value, max_quest_value)
+    df_results = pd.DataFrame(results, index=[0])
+    df_results["MODEL"] = model_name
+    df_results = df_results.set_index("MODEL", drop=True)
+    return df_results, results_text
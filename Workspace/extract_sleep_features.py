@@ -1,262 +1,259 @@
 # Script that extracts numerous sleep features from sleep, actigraph, and rr datasets
 
 import os
+import numpy as np
 import pandas as pd
-from scipy.stats import kurtosis, skew, entropy
-
-
-def get_feature_vectors(path_directory):
-    # Initialize an empty list to contain the feature vectors
+import function_code.artifacts as artifacts
+import function_code.open_data as open_data
+import utilities.time_parsing as time_parsing
+
+
+# Hours of the hourly features, from 9 AM of day 1 to 9 AM of day 2, as (day, hour)
+HOUR_GRID = [(1, hour) for hour in range(9, 24)] + [(2, hour) for hour in range(0, 10)]
+
+# Statistics of each hour, the first ones from RR.csv and the others from Actigraph.csv
+RR_STATS = ['Mean', 'DvSt', 'Kurtosis', 'Skew', 'Entropy']
+ACTIGRAPH_STATS = ['Steps', 'Mean_HR', 'DvSt_HR', 'Mean_VM', 'DvSt_VM']
+HOURLY_STATS = RR_STATS + ACTIGRAPH_STATS
+
+# Methods to fill the hours without data
+NEIGHBOURS_FILL = "neighbours"
+LINEAR_FILL = "linear"
+
+SLEEP_COLUMNS = ['In Bed Time', 'Out Bed Time', 'Onset Time', 'Latency', 'Total Sleep Time (TST)',
+                 'Total Minutes in Bed', 'Efficiency', 'Wake After Sleep Onset (WASO)',
+                 'Number of Awakenings', 'Average Awakening Length', 'Movement Index',
+                 'Fragmentation Index', 'Sleep Fragmentation Index']
+
+
+# Users with all the files needed by the features
+def get_users(path_directory):
+    users = []
+    for directory in os.listdir(path_directory):
+        # User 7 is not used by the train_set_v6, which is the only one that needs these features, user 11 did not complete the questionnaires
+        if directory.startswith('user') and directory != 'user_11' and directory != 'user_7':
+            if all(os.path.exists(os.path.join(path_directory, directory, file_name + ".csv")) for file_name in ["sleep", "questionnaire", "RR", "Actigraph"]):
+                users.append(directory)
+    return users
+
+
+def get_sleep_vector(df_sleep, user):
+    # Extract the first row as a feature vector from the sleep.csv file
+    feature_vector_sleep = df_sleep[SLEEP_COLUMNS].iloc[0]
+
+    # User 1 has two rows unlike other users
+    if (user == "user_1"):
+        feature_vector_sleep['Out Bed Time'] = df_sleep['Out Bed Time'].iloc[1]
+        feature_vector_sleep['Total Sleep Time (TST)'] = df_sleep['Total Sleep Time (TST)'].sum()
+        feature_vector_sleep['Total Minutes in Bed'] = df_sleep['Total Minutes in Bed'].sum()
+        feature_vector_sleep['Efficiency'] = df_sleep['Efficiency'].mean()
+        feature_vector_sleep['Wake After Sleep Onset (WASO)'] = df_sleep['Wake After Sleep Onset (WASO)'].sum()
+        feature_vector_sleep['Number of Awakenings'] = df_sleep['Number of Awakenings'].sum()
+        feature_vector_sleep['Average Awakening Length'] = df_sleep['Average Awakening Length'].mean()
+        feature_vector_sleep['Movement Index'] = df_sleep['Movement Index'].mean()
+        feature_vector_sleep['Fragmentation Index'] = df_sleep['Fragmentation Index'].mean()
+        feature_vector_sleep['Sleep Fragmentation Index'] = df_sleep['Sleep Fragmentation Index'].mean()
+
+    # Convert 'In Bed Time', 'Out Bed Time', 'Onset Time' columns to minutes past noon
+    time_columns = ['In Bed Time', 'Out Bed Time', 'Onset Time']
+    for col in time_columns:
+        orario = pd.to_datetime(feature_vector_sleep[col], format='%H:%M')
+        if orario.hour == 00:
+            feature_vector_sleep[col] = (12) * 60 + orario.minute
+        elif orario.hour <= 23 and orario.hour >= 12:
+            feature_vector_sleep[col] = (orario.hour - 12) * 60 + orario.minute
+        else:
+            feature_vector_sleep[col] = (orario.hour + 12) * 60 + orario.minute
+
+    return feature_vector_sleep
+
+
+# Reads a file of every user in a single dataframe, with the position of the user and of the hour of each row in the grid
+# The rows outside the grid are dropped
+def read_hourly_data(path_directory, users, file_name, columns, grid=HOUR_GRID):
+    frames = []
+    for i, user in enumerate(users):
+        df = open_data.load_user_file(path_directory, user, file_name, columns + ['day', 'time'])
+        df['user'] = i
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+
+    # Each (day, hour) is identified by the hours from midnight before day 1, the days -29 of users 8 and 9 are day 2
+    hours = time_parsing.fix_day(df['day'].values) * 24 + time_parsing.time_to_hour(df['time'])
+    df['hour'] = pd.Index([day * 24 + hour for day, hour in grid]).get_indexer(hours)
+    return df[df['hour'] >= 0].drop(columns=['day', 'time'])
+
+
+# Kurtosis, skewness (as scipy.stats with the default bias) and entropy of the values of each group
+# groups are consecutive integers from 0, mean and count are the mean and number of values of each group
+def group_shape_statistics(values, groups, mean, count):
+    deviation = values - mean[groups]
+    square = deviation * deviation
+    m2 = np.bincount(groups, weights=square, minlength=len(count)) / count
+    m3 = np.bincount(groups, weights=square * deviation, minlength=len(count)) / count
+    m4 = np.bincount(groups, weights=square * square, minlength=len(count)) / count
+
+    # Constant groups have skewness 0 and kurtosis -3, as in scipy.stats
+    zero = m2 <= (np.finfo(np.float64).resolution * mean) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        skewness = np.where(zero, 0, m3 / m2 ** 1.5)
+        kurtosis = np.where(zero, 0, m4 / m2 ** 2) - 3
+
+        # Entropy of the values normalized to sum to one in each group, as scipy.stats.entropy
+        probability = values / np.bincount(groups, weights=values, minlength=len(count))[groups]
+        entropy = -np.bincount(groups, weights=np.where(probability > 0, probability * np.log(probability), 0), minlength=len(count))
+    return kurtosis, skewness, entropy
+
+
+# Computes the hourly statistics of every user at once, in an array of shape (users, hours of the grid, HOURLY_STATS)
+# The hours without data have all their statistics set to 0 (see fill_holes)
+def build_hourly_tensor(path_directory, users, grid=HOUR_GRID):
+    tensor = np.zeros((len(users), len(grid), len(HOURLY_STATS)))
+
+    df_rr = read_hourly_data(path_directory, users, "RR", ['ibi_s'], grid)
+    # Removes the artifacts of the rr data, the rows with ibi above 3 seconds
+    df_rr = df_rr[artifacts.find_artifacts(df_rr['ibi_s'].values, artifacts.SLEEP_RULES, groups=df_rr['user'].values) == 0]
+    rr_stats = df_rr.groupby(['user', 'hour'])['ibi_s'].agg(['mean', 'std', 'count'])
+    groups = rr_stats.index.get_indexer(pd.MultiIndex.from_arrays([df_rr['user'], df_rr['hour']]))
+    kurtosis, skewness, entropy = group_shape_statistics(df_rr['ibi_s'].values, groups, rr_stats['mean'].values, rr_stats['count'].values)
+    user, hour = rr_stats.index.get_level_values('user'), rr_stats.index.get_level_values('hour')
+    tensor[user, hour, :len(RR_STATS)] = np.column_stack([rr_stats['mean'], rr_stats['std'], kurtosis, skewness, entropy])
+
+    df_actigraph = read_hourly_data(path_directory, users, "Actigraph", ['Steps', 'HR', 'Vector Magnitude'], grid)
+    actigraph_stats = df_actigraph.groupby(['user', 'hour']).agg({'Steps': 'sum', 'HR': ['mean', 'std'], 'Vector Magnitude': ['mean', 'std']})
+    user, hour = actigraph_stats.index.get_level_values('user'), actigraph_stats.index.get_level_values('hour')
+    tensor[user, hour, len(RR_STATS):] = actigraph_stats.values
+    return tensor
+
+
+# Names of the columns of the flattened tensor: the RR statistics of every hour, then the Actigraph statistics of every hour
+def hourly_columns(grid=HOUR_GRID):
+    return ([f'{stat}_{day}_{hour}' for day, hour in grid for stat in RR_STATS] +
+            [f'{stat}_{day}_{hour}' for day, hour in grid for stat in ACTIGRAPH_STATS])
+
+
+# Dataframe with a row for each user and a column for each statistic of each hour
+def flatten_hourly_tensor(tensor, users, grid=HOUR_GRID):
+    n_rr = len(RR_STATS)
+    values = np.concatenate([tensor[:, :, :n_rr].reshape(len(users), -1), tensor[:, :, n_rr:].reshape(len(users), -1)], axis=1)
+    return steps_as_integers(pd.DataFrame(values, index=users, columns=hourly_columns(grid)), grid)
+
+
+# The steps are counts, they are saved as integers when no hour was filled with an average
+def steps_as_integers(df, grid=HOUR_GRID):
+    for column in [f'Steps_{day}_{hour}' for day, hour in grid]:
+        if (df[column] % 1 == 0).all():
+            df[column] = df[column].astype(np.int64)
+    return df
+
+
+# fill_policy is the method used to fill the hours without data (see fill_holes)
+# users are the users whose features are computed, by default every user of get_users
+# Returns the features with the user in the first column and the number of hours filled for each user
+def get_feature_vectors(path_directory, fill_policy=NEIGHBOURS_FILL, users=None):
+    if users is None:
+        users = get_users(path_directory)
+
+    # Sleep features and class of each user
     feature_vectors = []
-
-    # Loop through the user directories
-    for root, dirs, files in os.walk(path_directory):
-        for directory in dirs:
-            # User 7 is not used by the train_set_v6, which is the only one that needs these features, user 11 did not complete the questionnaires
-            if directory.startswith('user') and directory != 'user_11' and directory != 'user_7':
-                # Create paths for the files
-                sleep_file_path = os.path.join(path_directory, directory, "sleep.csv")
-                questionnaire_file_path = os.path.join(path_directory, directory, "questionnaire.csv")
-                rr_file_path = os.path.join(path_directory, directory, "RR.csv")
-                actigraph_file_path = os.path.join(path_directory, directory, "Actigraph.csv")
-
-                # Check if sleep.csv, questionnaire.csv, and RR.csv files exist in the user folder
-                if os.path.exists(sleep_file_path) and os.path.exists(questionnaire_file_path) and os.path.exists(rr_file_path) and os.path.exists(actigraph_file_path):
-                    print("Processing", directory)
-
-                    df_sleep = pd.read_csv(sleep_file_path)
-                    df_questionnaire = pd.read_csv(questionnaire_file_path)
-                    df_rr = pd.read_csv(rr_file_path)
-                    df_actigraph = pd.read_csv(actigraph_file_path)
-
-                    # DATA CORRECTION
-                    df_rr = df_rr.drop(df_rr[(df_rr['ibi_s'] > 3)].index).reset_index(drop=True)  # Removes rows with ibi above 3 seconds in rr data
-                    df_rr['day'] = df_rr['day'].replace(-29, 2)  # Fix data for users 8 and 9
-                    df_actigraph['day'] = df_actigraph['day'].replace(-29, 2)  # Fix data for users 8 and 9
-
-                    # WORKING ON df_sleep DATAFRAME
-                    # Select the desired columns from the sleep.csv file
-                    selected_sleep_columns = ['In Bed Time', 'Out Bed Time', 'Onset Time', 'Latency', 'Total Sleep Time (TST)',
-                                    'Total Minutes in Bed', 'Efficiency', 'Wake After Sleep Onset (WASO)',
-                                    'Number of Awakenings', 'Average Awakening Length', 'Movement Index',
-                                    'Fragmentation Index', 'Sleep Fragmentation Index']
-
-                    # Extract the first row as a feature vector from the sleep.csv file
-                    feature_vector_sleep = df_sleep[selected_sleep_columns].iloc[0]
-
-                    # User 1 has two rows unlike other users
-                    if (directory == "user_1"):
-                        feature_vector_sleep['Out Bed Time'] = df_sleep['Out Bed Time'].iloc[1]
-                        feature_vector_sleep['Total Sleep Time (TST)'] = df_sleep['Total Sleep Time (TST)'].sum()
-                        feature_vector_sleep['Total Minutes in Bed'] = df_sleep['Total Minutes in Bed'].sum()
-                        feature_vector_sleep['Efficiency'] = df_sleep['Efficiency'].mean()
-                        feature_vector_sleep['Wake After Sleep Onset (WASO)'] = df_sleep['Wake After Sleep Onset (WASO)'].sum()
-                        feature_vector_sleep['Number of Awakenings'] = df_sleep['Number of Awakenings'].sum()
-                        feature_vector_sleep['Average Awakening Length'] = df_sleep['Average Awakening Length'].mean()
-                        feature_vector_sleep['Movement Index'] = df_sleep['Movement Index'].mean()
-                        feature_vector_sleep['Fragmentation Index'] = df_sleep['Fragmentation Index'].mean()
-                        feature_vector_sleep['Sleep Fragmentation Index'] = df_sleep['Sleep Fragmentation Index'].mean()
-
-                    # Convert 'In Bed Time', 'Out Bed Time', 'Onset Time' columns to minutes past noon
-                    time_columns = ['In Bed Time', 'Out Bed Time', 'Onset Time']
-                    for col in time_columns:
-                        orario = pd.to_datetime(feature_vector_sleep[col], format='%H:%M')
-                        if orario.hour == 00:
-                            feature_vector_sleep[col] = (12) * 60 + orario.minute
-                        elif orario.hour <= 23 and orario.hour >= 12:
-                            feature_vector_sleep[col] = (orario.hour - 12) * 60 + orario.minute
-                        else:
-                            feature_vector_sleep[col] = (orario.hour + 12) * 60 + orario.minute
-
-                    # WORKING ON df_rr DATAFRAME
-                    # Convert 'time' column to datetime format and extract the hour
-                    df_rr['time'] = pd.to_datetime(df_rr['time'], format='%H:%M:%S').dt.hour
-                    # Convert 'day' column values to string type
-                    df_rr['day'] = df_rr['day'].astype(str)
-
-                    # Calculate new features from RR.csv
-                    rr_hourly_stats = df_rr.groupby(['day', 'time'])['ibi_s'].agg(['mean', 'std', kurtosis, skew, entropy])
-
-                    actual_time = 9
-                    for (day, time), stats in rr_hourly_stats.iterrows():
-                        # we need to go up to 9 AM on day 2
-                        if actual_time != 34:
-                            while time != actual_time and time != actual_time - 24:
-                                if actual_time >= 24:
-                                    time_hole = actual_time - 24
-                                else:
-                                    time_hole = actual_time
-                                feature_vector_sleep[f'Mean_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'DvSt_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'Kurtosis_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'Skew_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'Entropy_{day}_{time_hole}'] = 0
-                                actual_time += 1
-                            feature_vector_sleep[f'Mean_{day}_{time}'] = stats['mean']
-                            feature_vector_sleep[f'DvSt_{day}_{time}'] = stats['std']
-                            feature_vector_sleep[f'Kurtosis_{day}_{time}'] = stats['kurtosis']
-                            feature_vector_sleep[f'Skew_{day}_{time}'] = stats['skew']
-                            feature_vector_sleep[f'Entropy_{day}_{time}'] = stats['entropy']
-                            actual_time += 1
-
-                    # we need to go up to 9 AM on day 2, if not present, fill with 0
-                    while actual_time != 34:
-                        if actual_time >= 24:
-                            time_hole = actual_time - 24
-                        else:
-                            time_hole = actual_time
-                        feature_vector_sleep[f'Mean_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'DvSt_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'Kurtosis_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'Skew_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'Entropy_{day}_{time_hole}'] = 0
-                        actual_time += 1
-
-                    # WORKING ON df_actigraph DATAFRAME
-                    # Convert 'time' column to datetime format and extract the hour
-                    df_actigraph['time'] = pd.to_datetime(df_actigraph['time'], format='%H:%M:%S').dt.hour
-                    # Convert 'day' column values to string type
-                    df_actigraph['day'] = df_actigraph['day'].astype(str)
-
-                    # Calculate new features from Actigraph.csv
-                    hourly_steps = df_actigraph.groupby(['day', 'time'])['Steps'].sum()
-                    hr_hourly_stats = df_actigraph.groupby(['day', 'time'])['HR'].agg(['mean', 'std'])
-                    vm_hourly_stats = df_actigraph.groupby(['day', 'time'])['Vector Magnitude'].agg(['mean', 'std'])
-
-                    actual_time = 9
-                    for (day, time), hr_stats in hr_hourly_stats.iterrows():
-                        vm_stats = vm_hourly_stats.loc[(day, time)]
-                        if actual_time != 34:
-                            while time != actual_time and time != actual_time - 24:
-                                if actual_time >= 24:
-                                    time_hole = actual_time - 24
-                                else:
-                                    time_hole = actual_time
-                                feature_vector_sleep[f'Steps_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'Mean_HR_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'DvSt_HR_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'Mean_VM_{day}_{time_hole}'] = 0
-                                feature_vector_sleep[f'DvSt_VM_{day}_{time_hole}'] = 0
-                                actual_time += 1
-                            feature_vector_sleep[f'Steps_{day}_{time}'] = hourly_steps.get((day, time), 0)
-                            feature_vector_sleep[f'Mean_HR_{day}_{time}'] = hr_stats['mean']
-                            feature_vector_sleep[f'DvSt_HR_{day}_{time}'] = hr_stats['std']
-                            feature_vector_sleep[f'Mean_VM_{day}_{time}'] = vm_stats['mean']
-                            feature_vector_sleep[f'DvSt_VM_{day}_{time}'] = vm_stats['std']
-                            actual_time += 1
-
-                    # we need to go up to 9 AM on day 2, if not present, fill with 0
-                    while actual_time != 34:
-                        if actual_time >= 24:
-                            time_hole = actual_time - 24
-                        else:
-                            time_hole = actual_time
-                        feature_vector_sleep[f'Steps_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'Mean_HR_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'DvSt_HR_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'Mean_VM_{day}_{time_hole}'] = 0
-                        feature_vector_sleep[f'DvSt_VM_{day}_{time_hole}'] = 0
-                        actual_time += 1
-
-
-                    # WORK ON DATAFRAME df_questionnaire
-
-                    stai_class = df_questionnaire['STAI2'].iloc[0]
-                    
-                    '''
-                    # Assign "low" or "high" labels based on bisbas_class value
-                    #if bisbas_class < 18.2:
-                    #if bisbas_class < 14.6:
-                    #if bisbas_class < 10.6:
-                    #if bisbas_class < 9.5:
-                    if bisbas_class < 9.5:
-                        bisbas_label = "low"
-                    else:
-                        bisbas_label = "high"
-                    '''
-
-                    # Add user to feature vector
-                    feature_vector_sleep['user'] = directory
-                    # Add the new class to the feature vector
-                    feature_vector_sleep['STAI2'] = stai_class
-                    # Add the feature vector to the list
-                    feature_vectors.append(feature_vector_sleep)
-    
-    return feature_vectors
-
-
-
-def fill_holes(data):
-    filled_data = data.copy()
-    stats = ['Mean', 'DvSt', 'Kurtosis', 'Skew', 'Entropy', 'Steps', 'Mean_HR', 'DvSt_HR', 'Mean_VM', 'DvSt_VM']
-    
-    # For each row in the DataFrame
-    for index, row in filled_data.iterrows():
-        # Iterate over all days and hours in the file
-        for day in ['1', '2']:
-            if day == '1':
-                hours = range(9, 24)  # Hours from 9 to 23 for day 1
-            else:
-                hours = range(0, 10)  # Hours from 0 to 9 for day 2
-
-            for hour in hours:
-                str_hour = str(hour)
-                hour_prefix = f'{day}_{str_hour}'
-                current_stats = [f'{stat}_{hour_prefix}' for stat in stats if f'{stat}_{hour_prefix}' in filled_data.columns]
-                
-                # Check if current hour is empty
-                if all(filled_data.at[index, stat] == 0 for stat in current_stats):
-                    print(f"Empty hour found: Day {day}, Hour {hour} ({row['user']})")
-
-                    # Calculation of replacement hour
-                    if hour == 9 and day == '1':
-                        replacement_hour = '1_10'
-                    elif hour == 9 and day == '2':
-                        replacement_hour = '2_8'
-                    else:
-                        prev_hour = 23 if hour == 0 else hour - 1
-                        next_hour = 0 if hour == 23 else hour + 1
-                        prev_day = '1' if day == '1' or hour == 0 else '2'
-                        next_day = '1' if day == '1' and hour < 23 else '2'
-                        
-                        prev_hour_prefix = f'{prev_day}_{prev_hour}'
-                        next_hour_prefix = f'{next_day}_{next_hour}'
-                        replacement_hour = None
-
-                    # Value replacement
-                    if replacement_hour:
-                        replacement_stats = [f'{stat}_{replacement_hour}' for stat in stats if f'{stat}_{replacement_hour}' in filled_data.columns]
-                        for stat, repl_stat in zip(current_stats, replacement_stats):
-                            filled_data.at[index, stat] = row[repl_stat]
-                    else:
-                        prev_stats = [f'{stat}_{prev_hour_prefix}' for stat in stats if f'{stat}_{prev_hour_prefix}' in filled_data.columns]
-                        next_stats = [f'{stat}_{next_hour_prefix}' for stat in stats if f'{stat}_{next_hour_prefix}' in filled_data.columns]
-                        for stat, prev_stat, next_stat in zip(current_stats, prev_stats, next_stats):
-                            if prev_stat in filled_data.columns and next_stat in filled_data.columns:
-                                filled_data.at[index, stat] = (row[prev_stat] + row[next_stat]) / 2
-    
-    return filled_data
-
-
-
-def extract_features(path_directory):
+    stai_classes = []
+    for user in users:
+        print("Processing", user)
+        df_sleep = open_data.load_user_file(path_directory, user, "sleep")
+        feature_vectors.append(get_sleep_vector(df_sleep, user))
+        stai_classes.append(open_data.load_user_file(path_directory, user, "questionnaire", ['STAI2'])['STAI2'].iloc[0])
+
+    print("Computing the hourly features...")
+    tensor = build_hourly_tensor(path_directory, users)
+    filled_hours = dict(zip(users, (tensor == 0).all(axis=2).sum(axis=1).tolist()))
+    # Fill temporal gaps
+    df_hourly = flatten_hourly_tensor(fill_holes(tensor, users, fill_policy), users)
+
+    all_data = pd.DataFrame(feature_vectors, index=users).join(df_hourly)
+    all_data['STAI2'] = stai_classes
+    all_data.index.name = 'user'
+    return all_data.reset_index(), filled_hours
+
+
+
+# Fills the hours of the tensor without data, i.e. with all their statistics at 0, and returns the filled tensor
+# NEIGHBOURS_FILL sets each of them to the average of the hour before and the hour after, the first and last hour
+# of the grid take the value of the only hour next to them. Like the row by row version it replaced, the values of the
+# neighbours are the ones before the filling, so a hole next to another one is averaged with 0
+# LINEAR_FILL interpolates each hole between the nearest hours with data on both sides, also across runs of several
+# empty hours, the holes at the start or at the end of the grid take the value of the nearest hour with data
+def fill_holes(tensor, users, policy=NEIGHBOURS_FILL, grid=HOUR_GRID):
+    empty = (tensor == 0).all(axis=2)
+    for user, hour in np.argwhere(empty):
+        day, clock_hour = grid[hour]
+        print(f"Empty hour found: Day {day}, Hour {clock_hour} ({users[user]})")
+
+    filled = tensor.copy()
+    if policy == NEIGHBOURS_FILL:
+        neighbours = np.empty_like(tensor)
+        neighbours[:, 0] = tensor[:, 1]
+        neighbours[:, -1] = tensor[:, -2]
+        neighbours[:, 1:-1] = (tensor[:, :-2] + tensor[:, 2:]) / 2
+    elif policy == LINEAR_FILL:
+        # Position of the nearest hour with data before and after each hour, -1 and len(grid) if there is none
+        position = np.arange(len(grid))
+        previous = np.maximum.accumulate(np.where(empty, -1, position), axis=1)
+        following = np.minimum.accumulate(np.where(empty, len(grid), position)[:, ::-1], axis=1)[:, ::-1]
+        has_previous = previous >= 0
+        has_following = following < len(grid)
+        previous = np.where(has_previous, previous, following)
+        following = np.where(has_following, following, previous)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(following > previous, (position - previous) / (following - previous), 0)[:, :, np.newaxis]
+        user = np.arange(len(tensor))[:, np.newaxis]
+        previous = np.clip(previous, 0, len(grid) - 1)
+        following = np.clip(following, 0, len(grid) - 1)
+        neighbours = tensor[user, previous] * (1 - weight) + tensor[user, following] * weight
+        # A user without any hour of data keeps the zeros
+        neighbours[~(has_previous | has_following)] = 0
+    else:
+        raise ValueError("Not a valid fill policy. Choose between '{}' and '{}'".format(NEIGHBOURS_FILL, LINEAR_FILL))
+
+    filled[empty] = neighbours[empty]
+    return filled
+
+
+
+# done_logs maps the users that are already up to date to their logs, they keep their row of the previous file
+# The features of every user only depend on its own files, so only the other users are computed again
+# Returns the log of every user, the number of hours without data that were filled
+def extract_features(path_directory, fill_policy=NEIGHBOURS_FILL, done_logs=None):
     # Creating dataset folder if it does not exist
     os.makedirs(os.getcwd() + "/Datasets", exist_ok=True)
-    
-    feature_vectors = get_feature_vectors(path_directory)
+    output_file_path = os.path.join('Datasets', 'sleep_features.csv')
 
-    # Create a DataFrame from feature vectors
-    all_data = pd.DataFrame(feature_vectors)
-    # Move the user column to the beginning of the dataframe
-    all_data = all_data[['user'] + [col for col in all_data.columns if col != 'user']].reset_index(drop=True)
-    # Fill temporal gaps
-    filled_data = fill_holes(all_data)
+    users = get_users(path_directory)
+    user_logs = {}
+    frames = []
+    if done_logs and os.path.isfile(output_file_path):
+        # round_trip parsing gives back exactly the values that were saved
+        df_done = pd.read_csv(output_file_path, float_precision="round_trip")
+        df_done = df_done[df_done['user'].isin([user for user in users if user in done_logs])]
+        user_logs = {user: done_logs[user] for user in df_done['user']}
+        frames.append(df_done)
+    users_to_update = [user for user in users if user not in user_logs]
+    if len(user_logs) > 0:
+        print("Skipping {} users that are already up to date".format(len(user_logs)))
+
+    if len(users_to_update) > 0:
+        df_new, filled_hours = get_feature_vectors(path_directory, fill_policy, users_to_update)
+        user_logs.update(filled_hours)
+        frames.append(df_new)
+    # Rows in the order of get_users, the steps of the previous rows can be integers again with the new ones
+    filled_data = pd.concat(frames, ignore_index=True, sort=False).set_index('user').loc[users]
+    filled_data = steps_as_integers(filled_data).reset_index()
 
     # Save feature vectors to a csv file
-    output_file_path = os.path.join('Datasets', 'sleep_features.csv')
     filled_data.to_csv(output_file_path, index=False)
 
     print(f"Feature vectors saved to {output_file_path}")
+    return user_logs
 
 
 if __name__=="__main__":
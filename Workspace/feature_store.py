@@ -0,0 +1,170 @@
+# Persistent store of the features of every user, from which the train sets are materialized
+# The store is a single table keyed by the RR data the features come from ("RR" or "RR-processed") and by the user,
+# with the columns of every feature group and the provenance of the rows (anomalies threshold, psd method and
+# version of the feature code). Each train set is a projection of some feature groups plus a row filter,
+# so a new dataset version only needs a new entry in DATASET_VERSIONS and no feature is computed again
+
+import os
+import json
+import hashlib
+import pandas as pd
+
+
+STORE_FILE = "Datasets/feature_store.csv"
+METADATA_FILE = "Datasets/feature_store.json"   # Columns of each feature group, groups and members of each RR data and types of the columns
+
+# Code files that compute the features, their hash is saved as code_version in the provenance columns
+FEATURES_CODE = ["create_datasets.py", "function_code/open_data.py", "function_code/HRV_analysis.py", "function_code/circadian.py",
+                 "function_code/rr_store.py", "function_code/artifacts.py"]
+PROVENANCE_COLUMNS = ["anomalies_threshold", "freq_method", "code_version"]
+
+# Feature groups with fixed columns, the "sleep" group takes the columns of Datasets/sleep_features.csv
+FEATURE_GROUPS = {
+    "time_domain": ["HR_mean", "RMSSD", "SDNN", "PNN50"],
+    "frequency": ["vlf", "lf", "hf", "total_power"],
+    "poincare": ["SD1", "SD2", "SD1/SD2"],
+    "anomalies": ["Anomalies"],
+    "sinusoid": ["amp", "APhase", "MESOR"],
+    "target": ["STAI2"],
+}
+
+# Every train set: the feature groups in the order of the columns, the users to remove and whether the
+# users with missing values are removed
+DATASET_VERSIONS = {
+    1: {"groups": ["time_domain", "target"]},
+    2: {"groups": ["time_domain", "frequency", "poincare", "target"]},
+    3: {"groups": ["time_domain", "frequency", "target"]},
+    4: {"groups": ["time_domain", "frequency", "poincare", "anomalies", "sinusoid", "target"]},
+    5: {"groups": ["time_domain", "frequency", "poincare", "anomalies", "sinusoid", "target"],
+        "drop_users": ["user_4"], "dropna": True},
+    6: {"groups": ["time_domain", "frequency", "poincare", "anomalies", "sinusoid", "target", "sleep"],
+        "drop_users": ["user_4"], "dropna": True},
+}
+
+
+# Short hash of the feature code files, to know which version of the code computed a row of the store
+def code_version():
+    sha = hashlib.sha1()
+    for file_name in FEATURES_CODE:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name), "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+def get_rr_data(use_processed_data):
+    return 'RR-processed' if use_processed_data else 'RR'
+
+
+# Name of the csv file of a train set, the ones made from processed data end with _clean
+def get_dataset_file(version, use_processed_data):
+    return "Datasets/train_set_v{}{}.csv".format(version, "_clean" if use_processed_data else "")
+
+
+def load_store():
+    store_path = os.path.join(os.getcwd(), STORE_FILE)
+    metadata_path = os.path.join(os.getcwd(), METADATA_FILE)
+    if not os.path.isfile(store_path) or not os.path.isfile(metadata_path):
+        return pd.DataFrame(index=pd.MultiIndex.from_tuples([], names=["rr_data", "user"])), {"groups": {}, "sources": {}, "members": {}, "dtypes": {}}
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    # round_trip parsing gives back exactly the values that were saved
+    store = pd.read_csv(store_path, index_col=["rr_data", "user"], float_precision="round_trip")
+    return store, metadata
+
+
+# Replaces the rows computed from rr_data with the new features, a dataframe indexed by user
+# groups maps every feature group in df_features to its columns, provenance contains the values of PROVENANCE_COLUMNS
+# members maps a feature group to the users that have it (e.g. the users with a questionnaire file), by default every user
+# of df_features: a user that is not a member has no values of the group, while a member can have missing values
+def update_store(df_features, rr_data, groups, provenance, members=None):
+    store, metadata = load_store()
+
+    df_features = df_features.copy()
+    for column in PROVENANCE_COLUMNS:
+        df_features[column] = provenance.get(column)
+    df_features["rr_data"] = rr_data
+    df_features = df_features.reset_index().set_index(["rr_data", "user"]).sort_index()
+
+    # The types are saved before the rows are joined, a column of integers with missing values becomes float
+    for column in df_features.columns:
+        metadata["dtypes"][column] = str(df_features[column].dtype)
+    metadata["groups"].update(groups)
+    metadata["sources"][rr_data] = list(groups)
+    members = members or {}
+    metadata.setdefault("members", {})[rr_data] = {group: sorted(members.get(group, df_features.index.get_level_values("user")))
+                                                   for group in groups}
+
+    if len(store) > 0:
+        store = store.drop(index=rr_data, level="rr_data", errors="ignore")
+    store = pd.concat([store, df_features], sort=False)
+
+    os.makedirs(os.path.join(os.getcwd(), "Datasets"), exist_ok=True)
+    store.to_csv(os.path.join(os.getcwd(), STORE_FILE))
+    with open(os.path.join(os.getcwd(), METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=1)
+    return store
+
+
+# Integer columns read back as float because of missing values of other users get their type back
+def _restore_dtypes(df, metadata):
+    for column in df.columns:
+        if metadata["dtypes"].get(column, "").startswith("int") and df[column].notna().all():
+            df[column] = df[column].astype(metadata["dtypes"][column])
+    return df
+
+
+# Rows of the users computed from rr_data as they were given to update_store, with the columns of the groups
+# and the members of each group among the users, used to update only the users whose data changed
+def load_rows(rr_data, users, groups):
+    store, metadata = load_store()
+    columns = [column for group in groups for column in metadata["groups"].get(group, [])]
+    if rr_data not in metadata["sources"] or any(group not in metadata["sources"][rr_data] for group in groups):
+        return pd.DataFrame(columns=columns, index=pd.Index([], name="user")), {}
+    # The columns keep the order of the store, which is the order in which they were computed
+    df = store.loc[rr_data, [column for column in store.columns if column in columns]]
+    df = _restore_dtypes(df[df.index.isin(users)].copy(), metadata)
+    members = metadata.get("members", {}).get(rr_data, {})
+    return df, {group: [user for user in members.get(group, df.index) if user in df.index] for group in groups}
+
+
+# Builds a train set from the store: the columns of its feature groups and its row filter
+def project(store, metadata, version, rr_data):
+    definition = DATASET_VERSIONS[version]
+    columns = []
+    for group in definition["groups"]:
+        if group not in metadata["sources"].get(rr_data, []):
+            raise KeyError("The feature group {} of the {} data is not in the feature store, create the features that it needs first".format(group, rr_data))
+        columns += metadata["groups"][group]
+
+    df = store.loc[rr_data, columns]
+    # Only the members of every group are in the train set (e.g. not the users without the sleep features), as an inner
+    # join of the groups: a member with missing values (e.g. without STAI2) is kept, unless the version asks for dropna
+    members = metadata.get("members", {}).get(rr_data, {})
+    for group in definition["groups"]:
+        if group in members:
+            df = df[df.index.isin(members[group])]
+    df = df.drop(index=definition.get("drop_users", []), errors="ignore")
+    if definition.get("dropna", False):
+        df = df.dropna()
+
+    return _restore_dtypes(df, metadata).round(2)
+
+
+# Writes the csv files of the train sets from the store, without computing any feature
+def materialize(dataset_versions, use_processed_data):
+    store, metadata = load_store()
+    rr_data = get_rr_data(use_processed_data)
+    for version in dataset_versions:
+        dataset_file = get_dataset_file(version, use_processed_data)
+        print("Creating " + os.path.basename(dataset_file))
+        project(store, metadata, version, rr_data).to_csv(os.path.join(os.getcwd(), dataset_file))
+
+
+
+if __name__=="__main__":
+    # Materializes every train set whose features are in the store
+    store, metadata = load_store()
+    for rr_data in store.index.get_level_values("rr_data").unique():
+        for version in DATASET_VERSIONS:
+            if all(group in metadata["sources"][rr_data] for group in DATASET_VERSIONS[version]["groups"]):
+                materialize([version], rr_data == get_rr_data(True))
@@ -45,16 +45,254 @@ def _create_interpolated_timestamp_list(nn_intervals, sampling_frequency = 7):
 from collections import namedtuple
 
 WELCH_METHOD = "welch"
+LOMB_METHOD = "lomb"
+WELCH_CHUNK_SIZE = 10000    # Intervals resampled at a time by the Welch method
 VlfBand = namedtuple("Vlf_band", ["low", "high"])
 LfBand = namedtuple("Lf_band", ["low", "high"])
 HfBand = namedtuple("Hf_band", ["low", "high"])
 
 
+def _extirpolate(x, y, N, M = 4):
+    """
+    Spreads the values y, placed at the non integer positions x, on a regular grid of N points so that
+    their sum with any smooth function of the position is preserved (Press & Rybicki, 1989).
+    Parameters
+    ---------
+    x : array
+        Positions of the values on the grid, between 0 and N.
+    y : array
+        Values to spread.
+    N : int
+        Length of the grid.
+    M : int
+        Number of grid points used for each value.
+    Returns
+    ---------
+    grid : array
+        The values on the regular grid.
+    """
+    grid = np.zeros(N, dtype=y.dtype)
+
+    # Values that fall exactly on a grid point are simply added to it
+    integers = x % 1 == 0
+    np.add.at(grid, x[integers].astype(int), y[integers])
+    x, y = x[~integers], y[~integers]
+
+    # The other ones are spread over the M points around them with Lagrange polynomial weights
+    ilo = np.clip((x - M // 2).astype(int), 0, N - M)
+    numerator = y * np.prod(x - ilo - np.arange(M)[:, np.newaxis], 0)
+    denominator = float(np.prod(np.arange(1, M)))
+    for j in range(M):
+        if j > 0:
+            denominator *= j / (j - M)
+        index = ilo + (M - 1 - j)
+        np.add.at(grid, index, numerator / (denominator * (x - index)))
+    return grid
+
+
+def _trig_sum(t, h, df, N, f0 = 0, freq_factor = 1, oversampling = 5, M = 4):
+    """
+    Computes the sums of h * sin(2 pi f t) and h * cos(2 pi f t) for the N frequencies f0 + df * k (multiplied by
+    freq_factor) with a single FFT of the extirpolated values, in O(N log N) instead of O(N * len(t)).
+    Returns
+    ---------
+    S, C : array
+        Sums with the sine and the cosine for each frequency.
+    """
+    df *= freq_factor
+    f0 *= freq_factor
+
+    # The FFT length is the power of 2 above the oversampled number of frequencies
+    n_fft = 1 << int(N * oversampling - 1).bit_length()
+    t0 = t.min()
+    if f0 > 0:
+        h = h * np.exp(2j * np.pi * f0 * (t - t0))
+    t_norm = ((t - t0) * n_fft * df) % n_fft
+    grid = _extirpolate(t_norm, h, n_fft, M)
+    fft_grid = np.fft.ifft(grid)[:N]
+    if t0 != 0:
+        fft_grid *= np.exp(2j * np.pi * t0 * (f0 + df * np.arange(N)))
+    return n_fft * fft_grid.imag, n_fft * fft_grid.real
+
+
+def _lomb_scargle(timestamps, nn_intervals, minimum_frequency, maximum_frequency, samples_per_peak = 5):
+    """
+    Lomb-Scargle periodogram of the unevenly sampled intervals, with the fast method of Press & Rybicki
+    and a floating mean (generalized periodogram of Zechmeister & Kurster), normalized as a psd.
+    Parameters
+    ---------
+    timestamps : array
+        Time of each interval in seconds, the gaps in the recording are simply left as they are.
+    nn_intervals : array
+        Normal to Normal Intervals.
+    minimum_frequency, maximum_frequency : float
+        Range of the frequencies to compute.
+    samples_per_peak : int
+        Frequencies for each peak width (1 / length of the recording).
+    Returns
+    ---------
+    freq : array
+        Frequencies, evenly spaced from minimum_frequency.
+    psd : array
+        Power spectral density at each frequency.
+    """
+    t = np.asarray(timestamps, dtype=float)
+    y = np.asarray(nn_intervals, dtype=float)
+
+    # Frequency grid with the same spacing used by astropy's autopower
+    df = 1.0 / (t.max() - t.min()) / samples_per_peak
+    n_freq = 1 + int(np.round((maximum_frequency - minimum_frequency) / df))
+    freq = minimum_frequency + df * np.arange(n_freq)
+
+    # Equal weights for all the intervals
+    w = np.full(len(t), 1.0 / len(t))
+    y = y - np.dot(w, y)
+
+    # Sums that give the time shift tau at each frequency
+    Sh, Ch = _trig_sum(t, w * y, df, n_freq, minimum_frequency)
+    S2, C2 = _trig_sum(t, w, df, n_freq, minimum_frequency, freq_factor=2)
+    S, C = _trig_sum(t, w, df, n_freq, minimum_frequency)
+    tan_2omega_tau = (S2 - 2 * S * C) / (C2 - (C * C - S * S))
+
+    # Sine and cosine of omega * tau and of its double, from the tangent with trigonometric identities
+    S2w = tan_2omega_tau / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+    C2w = 1 / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+    Cw = np.sqrt(0.5) * np.sqrt(1 + C2w)
+    Sw = np.sqrt(0.5) * np.sign(S2w) * np.sqrt(1 - C2w)
+
+    YC = Ch * Cw + Sh * Sw
+    YS = Sh * Cw - Ch * Sw
+    CC = 0.5 * (1 + C2 * C2w + S2 * S2w) - (C * Cw + S * Sw) ** 2
+    SS = 0.5 * (1 - C2 * C2w - S2 * S2w) - (S * Cw - C * Sw) ** 2
+
+    psd = 0.5 * len(t) * (YC * YC / CC + YS * YS / SS)
+    return freq, psd
+
+
+class WelchAccumulator:
+    """
+    Welch's power spectral density of the linearly interpolated NN intervals, computed while the intervals
+    arrive in chunks. Each chunk is resampled on the fly and the windowed periodograms of the complete
+    segments are summed, so only the samples of the last incomplete segment are kept between two chunks
+    and the memory does not depend on the length of the recording.
+    The result is the same of signal.welch(x, fs=sampling_frequency, window='hann', nfft=nfft) on the
+    whole resampled recording, up to floating point rounding.
+    Parameters
+    ---------
+    sampling_frequency : int
+        Frequency at which the signal is resampled.
+    nperseg : int
+        Length of each segment, 256 samples as in signal.welch.
+    noverlap : int
+        Samples shared by two consecutive segments, by default half a segment.
+    nfft : int
+        Length of the FFT of each segment.
+    """
+
+    def __init__(self, sampling_frequency = 4, nperseg = 256, noverlap = None, nfft = 4096):
+        self.sampling_frequency = sampling_frequency
+        self.nperseg = nperseg
+        self.step = nperseg - (nperseg // 2 if noverlap is None else noverlap)
+        self.nfft = nfft
+
+        self.psd_sum = np.zeros(nfft // 2 + 1)
+        self.n_segments = 0
+        self.samples = np.empty(0)      # Resampled values not yet used by a complete segment
+        self.n_samples = 0              # Samples taken so far, the next one is at n_samples / sampling_frequency
+        self.cumulative_ms = None       # Sum of the intervals so far and time of the first one
+        self.first_time = None
+        self.last_time = None           # Last interval so far, the interpolation continues from it
+        self.last_interval = None
+
+    def update(self, nn_intervals):
+        """
+        Adds the next chunk of NN intervals (in ms) of the recording.
+        """
+        nn_intervals = np.asarray(nn_intervals, dtype=float)
+        if len(nn_intervals) == 0:
+            return
+
+        # Times as in _create_timestamp_list, the cumulative sum continues from the previous chunk
+        if self.cumulative_ms is None:
+            cumulative = np.cumsum(nn_intervals)
+        else:
+            cumulative = np.cumsum(np.concatenate(([self.cumulative_ms], nn_intervals)))[1:]
+        self.cumulative_ms = cumulative[-1]
+        times = cumulative / 1000
+        if self.first_time is None:
+            self.first_time = times[0]
+        times = times - self.first_time
+
+        if self.last_time is not None:
+            times = np.concatenate(([self.last_time], times))
+            nn_intervals = np.concatenate(([self.last_interval], nn_intervals))
+        self.last_time = times[-1]
+        self.last_interval = nn_intervals[-1]
+
+        # Grid of np.arange(0, last time, 1 / sampling_frequency), up to the last interval seen so far
+        step = 1 / float(self.sampling_frequency)
+        end = int(np.ceil(times[-1] / step))
+        while end > 0 and (end - 1) * step >= times[-1]:
+            end -= 1
+        while end * step < times[-1]:
+            end += 1
+        if end <= self.n_samples:
+            return
+        sample_times = np.arange(self.n_samples, end) * step
+        self.n_samples = end
+
+        self.samples = np.concatenate((self.samples, np.interp(sample_times, times, nn_intervals)))
+        self._add_segments()
+
+    def _add_segments(self, block = 64):
+        # Periodograms of the complete segments, computed a block of segments at a time
+        n_segments = (len(self.samples) - self.nperseg) // self.step + 1 if len(self.samples) >= self.nperseg else 0
+        if n_segments == 0:
+            return
+        window = signal.get_window('hann', self.nperseg)
+        scale = 1.0 / (self.sampling_frequency * (window * window).sum())
+        for first in range(0, n_segments, block):
+            starts = np.arange(first, min(first + block, n_segments)) * self.step
+            segments = self.samples[starts[:, np.newaxis] + np.arange(self.nperseg)]
+            self.psd_sum += self._periodograms(segments, window, scale).sum(axis=0)
+        self.n_segments += n_segments
+        self.samples = self.samples[n_segments * self.step:]
+
+    def _periodograms(self, segments, window, scale):
+        # Constant detrend of each segment, as signal.welch does, then the windowed FFT
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        spectrum = np.fft.rfft(window * segments, n=self.nfft)
+        return (np.conjugate(spectrum) * spectrum).real * scale
+
+    def result(self):
+        """
+        Returns the frequencies and the power spectral density of the intervals added so far.
+        """
+        freq = np.fft.rfftfreq(self.nfft, 1 / self.sampling_frequency)
+        if self.n_segments > 0:
+            psd = self.psd_sum / self.n_segments
+        elif len(self.samples) > 0:
+            # Recording shorter than a segment: a single segment as long as the recording, like signal.welch
+            window = signal.get_window('hann', len(self.samples))
+            psd = self._periodograms(self.samples[np.newaxis, :], window,
+                                     1.0 / (self.sampling_frequency * (window * window).sum()))[0]
+        else:
+            psd = np.zeros(len(freq))
+
+        # One-sided spectrum: the power of the negative frequencies is added to the positive ones
+        if self.nfft % 2:
+            psd[1:] *= 2
+        else:
+            psd[1:-1] *= 2
+        return freq, psd
+
+
 def _get_freq_psd_from_nn_intervals(nn_intervals, method = WELCH_METHOD,
                                     sampling_frequency = 4,
                                     interpolation_method = "linear",
                                     vlf_band = VlfBand(0.003, 0.04),
-                                    hf_band = HfBand(0.15, 0.40)):
+                                    hf_band = HfBand(0.15, 0.40),
+                                    timestamps = None):
     """
     Returns the frequency and power of the signal.
     Parameters
@@ -73,6 +311,9 @@ def _get_freq_psd_from_nn_intervals(nn_intervals, method = WELCH_METHOD,
         Very low frequency bands for features extraction from power spectral density.
     hf_band : tuple
         High frequency bands for features extraction from power spectral density.
+    timestamps : array
+        Time of each interval in seconds, only used by the Lomb method. By default the intervals
+        are taken as contiguous, passing the real times keeps the gaps of the recording.
     Returns
     ---------
     freq : list
@@ -83,7 +324,14 @@ def _get_freq_psd_from_nn_intervals(nn_intervals, method = WELCH_METHOD,
 
     timestamp_list = _create_timestamp_list(nn_intervals)
 
-    if method == WELCH_METHOD:
+    if method == WELCH_METHOD and interpolation_method == "linear":
+        # ---------- Interpolation and PSD one chunk at a time ---------- #
+        welch = WelchAccumulator(sampling_frequency=sampling_frequency, nfft=4096)
+        for start in range(0, len(nn_intervals), WELCH_CHUNK_SIZE):
+            welch.update(nn_intervals[start:start + WELCH_CHUNK_SIZE])
+        freq, psd = welch.result()
+
+    elif method == WELCH_METHOD:
         # ---------- Interpolation of signal ---------- #
         funct = interpolate.interp1d(x=timestamp_list, y=nn_intervals, kind=interpolation_method)
 
@@ -98,9 +346,11 @@ def _get_freq_psd_from_nn_intervals(nn_intervals, method = WELCH_METHOD,
                                  nfft=4096)
 
     elif method == LOMB_METHOD:
-        freq, psd = LombScargle(timestamp_list, nn_intervals,
-                                normalization='psd').autopower(minimum_frequency=vlf_band[0],
-                                                               maximum_frequency=hf_band[1])
+        # No interpolation, the periodogram is computed directly on the unevenly sampled intervals
+        if timestamps is None:
+            timestamps = timestamp_list
+        freq, psd = _lomb_scargle(timestamps, nn_intervals, minimum_frequency=vlf_band[0],
+                                  maximum_frequency=hf_band[1])
     else:
         raise ValueError("Not a valid method. Choose between 'lomb' and 'welch'")
 
@@ -267,6 +517,7 @@ def get_poincare_plot_features(nn_intervals):
     .. [4] Pre-ictal heart rate variability assessment of epileptic seizures by means of linear \
     and non- linear analyses, Soroor Behbahani, Nader Jafarnia Dabanloo et al - 2013
     """
+    nn_intervals = np.asarray(nn_intervals, dtype=float)
     diff_nn_intervals = np.diff(nn_intervals)
     # measures the width of poincare cloud
     sd1 = np.sqrt(np.std(diff_nn_intervals, ddof=1) ** 2 * 0.5)
@@ -329,18 +580,19 @@ def get_time_domain_features(nn_intervals):
     of Pacing and Electrophysiology, 1996
     """
 
+    nn_intervals = np.asarray(nn_intervals, dtype=float)
     diff_nni = np.diff(nn_intervals)
     length_int = len(nn_intervals)
 
     # Basic statistics
     mean_nni = np.mean(nn_intervals)
     median_nni = np.median(nn_intervals)
-    range_nni = max(nn_intervals) - min(nn_intervals)
+    range_nni = np.max(nn_intervals) - np.min(nn_intervals)
 
     sdsd = np.std(diff_nni)
     rmssd = np.sqrt(np.mean(diff_nni ** 2))
 
-    nni_50 = sum(np.abs(diff_nni) > 50)
+    nni_50 = np.sum(np.abs(diff_nni) > 50)
     pnni_50 = 100 * nni_50 / length_int
 
 
@@ -350,8 +602,8 @@ def get_time_domain_features(nn_intervals):
     # Heart Rate equivalent features
     heart_rate_list = np.divide(60000, nn_intervals)
     mean_hr = np.mean(heart_rate_list)
-    min_hr = min(heart_rate_list)
-    max_hr = max(heart_rate_list)
+    min_hr = np.min(heart_rate_list)
+    max_hr = np.max(heart_rate_list)
     std_hr = np.std(heart_rate_list)
 
     time_domain_features = {
@@ -374,7 +626,8 @@ def get_frequency_domain_features(nn_intervals, method = WELCH_METHOD,
                                   sampling_frequency = 4, interpolation_method = "linear",
                                   vlf_band = VlfBand(0.003, 0.04),
                                   lf_band = LfBand(0.04, 0.15),
-                                  hf_band = HfBand(0.15, 0.40)):
+                                  hf_band = HfBand(0.15, 0.40),
+                                  timestamps = None):
     """
     Returns a dictionary containing frequency domain features for HRV analyses.
     To our knowledge, you might use this function on short term recordings, from 2 to 5 minutes  \
@@ -397,6 +650,8 @@ def get_frequency_domain_features(nn_intervals, method = WELCH_METHOD,
         Low frequency bands for features extraction from power spectral density.
     hf_band : tuple
         High frequency bands for features extraction from power spectral density.
+    timestamps : array
+        Time of each interval in seconds, only used by the Lomb method (see _get_freq_psd_from_nn_intervals).
     Returns
     ---------
     frequency_domain_features : dict
@@ -433,7 +688,8 @@ def get_frequency_domain_features(nn_intervals, method = WELCH_METHOD,
     freq, psd = _get_freq_psd_from_nn_intervals(nn_intervals=nn_intervals, method=method,
                                                 sampling_frequency=sampling_frequency,
                                                 interpolation_method=interpolation_method,
-                                                vlf_band=vlf_band, hf_band=hf_band)
+                                                vlf_band=vlf_band, hf_band=hf_band,
+                                                timestamps=timestamps)
 
     # ---------- Features calculation ---------- #
     freqency_domain_features = _get_features_from_psd(freq=freq, psd=psd,
@@ -498,6 +754,168 @@ def _get_features_from_psd(freq, psd,
 
     return freqency_domain_features
 
+
+# Names of the columns returned by get_batch_features, in order
+BATCH_TIME_DOMAIN_FEATURES = ["mean_nni", "sdnn", "pnni_50", "rmssd", "median_nni", "range_nni",
+                              "mean_hr", "max_hr", "min_hr", "std_hr"]
+BATCH_POINCARE_FEATURES = ["sd1", "sd2", "ratio_sd2_sd1"]
+
+
+def get_window_boundaries(timestamps, window_length = 300, step = None, groups = None):
+    """
+    Returns the boundaries of fixed length time windows over a recording, to be used with get_batch_features.
+    Parameters
+    ---------
+    timestamps : array
+        Time of each interval in seconds, increasing within each group.
+    window_length : float
+        Length of the windows in seconds, by default 5 minutes.
+    step : float
+        Distance in seconds between the start of two consecutive windows. By default it is equal to
+        window_length (adjacent windows), a smaller step gives sliding windows.
+    groups : array
+        Optional label of each interval (e.g. the user), the windows never contain intervals of two groups.
+        The intervals of each group must be contiguous.
+    Returns
+    ---------
+    starts, ends : array
+        Index of the first interval of each window and of the one after its last interval.
+    window_times : array
+        Start time in seconds of each window.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    step = window_length if step is None else step
+    if groups is None:
+        group_starts = np.array([0])
+    else:
+        groups = np.asarray(groups)
+        group_starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+    group_ends = np.append(group_starts[1:], len(timestamps))
+
+    starts, ends, window_times = [], [], []
+    for group_start, group_end in zip(group_starts, group_ends):
+        group_timestamps = timestamps[group_start:group_end]
+        if len(group_timestamps) == 0:
+            continue
+        # Windows starting from the first interval of the group, all at once with searchsorted
+        times = np.arange(group_timestamps[0], group_timestamps[-1], step) if group_end - group_start > 1 else group_timestamps[:1]
+        starts.append(group_start + np.searchsorted(group_timestamps, times, side="left"))
+        ends.append(group_start + np.searchsorted(group_timestamps, times + window_length, side="left"))
+        window_times.append(times)
+
+    if len(starts) == 0:
+        return np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([])
+    return np.concatenate(starts), np.concatenate(ends), np.concatenate(window_times)
+
+
+def _window_reduce(ufunc, values, starts, ends):
+    """
+    Applies the reduction ufunc to values[start:end] for every window with a single reduceat call.
+    The windows can overlap: the starts and ends are interleaved and only the start to end segments are kept.
+    The result is meaningless for empty windows, which must be masked by the caller.
+    """
+    indices = np.empty(2 * len(starts), dtype=np.intp)
+    indices[0::2] = starts
+    indices[1::2] = ends
+    # One more element, so that the windows can end after the last value
+    padded = np.append(values, values[-1:] if len(values) > 0 else 0)
+    indices = np.minimum(indices, len(padded) - 1)
+    return ufunc.reduceat(padded, indices)[0::2]
+
+
+def _window_median(values, starts, ends):
+    """
+    Median of values[start:end] for every window, sorting the values of all the windows together.
+    """
+    lengths = ends - starts
+    window = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    window_values = values[np.repeat(starts, lengths) + positions]
+    # Sorted by window and then by value, the median is in the middle of each window
+    sorted_values = window_values[np.lexsort((window_values, window))]
+    offsets = np.cumsum(lengths) - lengths
+    low = offsets + np.maximum(lengths - 1, 0) // 2
+    high = offsets + lengths // 2
+    median = np.full(len(starts), np.nan)
+    valid = lengths > 0
+    median[valid] = (sorted_values[low[valid]] + sorted_values[np.minimum(high[valid], len(sorted_values) - 1)]) / 2
+    return median
+
+
+def get_batch_features(nn_intervals, starts, ends):
+    """
+    Computes the time domain and Poincaré plot features of many windows of intervals at once.
+    The features are the same of get_time_domain_features and get_poincare_plot_features, computed with
+    segment reductions over the whole array instead of a call for each window.
+    Parameters
+    ---------
+    nn_intervals : array
+        Normal to Normal Intervals of all the windows (e.g. a whole day of every user), in ms.
+    starts, ends : array
+        Index of the first interval of each window and of the one after its last interval, as returned
+        by get_window_boundaries. The windows can overlap.
+    Returns
+    ---------
+    features : array
+        Matrix with a row for each window and a column for each feature, NaN for windows with less than
+        two intervals.
+    feature_names : list
+        Name of each column, BATCH_TIME_DOMAIN_FEATURES followed by BATCH_POINCARE_FEATURES.
+    """
+    nn_intervals = np.asarray(nn_intervals, dtype=float)
+    starts = np.asarray(starts, dtype=np.intp)
+    ends = np.asarray(ends, dtype=np.intp)
+    n = (ends - starts).astype(float)
+    n_diff = n - 1
+
+    # The sums are computed on the values minus their global mean, which avoids cancellation in the variances
+    offset = np.mean(nn_intervals) if len(nn_intervals) > 0 else 0.0
+    centered = nn_intervals - offset
+    sum_nni = _window_reduce(np.add, centered, starts, ends)
+    sum_nni_squared = _window_reduce(np.add, centered ** 2, starts, ends)
+
+    # The differences inside a window are the ones from its first interval to the one before its last
+    diff_nni = np.diff(nn_intervals)
+    diff_ends = np.maximum(ends - 1, starts)
+    sum_diff = _window_reduce(np.add, diff_nni, starts, diff_ends)
+    sum_diff_squared = _window_reduce(np.add, diff_nni ** 2, starts, diff_ends)
+    nni_50 = _window_reduce(np.add, (np.abs(diff_nni) > 50).astype(float), starts, diff_ends)
+
+    heart_rate = np.divide(60000, nn_intervals)
+    sum_hr = _window_reduce(np.add, heart_rate, starts, ends)
+    sum_hr_squared = _window_reduce(np.add, heart_rate ** 2, starts, ends)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_nni = sum_nni / n + offset
+        variance_nni = np.maximum(sum_nni_squared - sum_nni ** 2 / n, 0) / (n - 1)
+        sdnn = np.sqrt(variance_nni)
+        rmssd = np.sqrt(sum_diff_squared / n_diff)
+        variance_diff = np.maximum(sum_diff_squared - sum_diff ** 2 / n_diff, 0) / (n_diff - 1)
+        mean_hr = sum_hr / n
+        std_hr = np.sqrt(np.maximum(sum_hr_squared / n - mean_hr ** 2, 0))
+
+        sd1 = np.sqrt(variance_diff * 0.5)
+        sd2 = np.sqrt(2 * variance_nni - 0.5 * variance_diff)
+
+        features = np.column_stack([
+            mean_nni,
+            sdnn,
+            100 * nni_50 / n,
+            rmssd,
+            _window_median(nn_intervals, starts, ends),
+            _window_reduce(np.maximum, nn_intervals, starts, ends) - _window_reduce(np.minimum, nn_intervals, starts, ends),
+            mean_hr,
+            _window_reduce(np.maximum, heart_rate, starts, ends),
+            _window_reduce(np.minimum, heart_rate, starts, ends),
+            std_hr,
+            sd1,
+            sd2,
+            sd2 / sd1])
+
+    features[n < 2] = np.nan
+    return features, BATCH_TIME_DOMAIN_FEATURES + BATCH_POINCARE_FEATURES
+
+
 def plot_HRV(df_window):
     
     """
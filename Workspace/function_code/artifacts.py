@@ -0,0 +1,119 @@
+import warnings
+from collections import namedtuple
+
+import numpy
+
+
+# Rules of the artifact rejection:
+# low, high: range of the valid intervals in seconds (None for no bound), inclusive tells if the bounds are valid
+# max_change: maximum change from the previous beat as a fraction of it (e.g. 0.2), None to skip the rule
+# correct: replace the rejected beats with the median of the window of beats around them instead of removing them
+# window: number of beats of the median used by the correction
+ArtifactRules = namedtuple("ArtifactRules", ["low", "high", "inclusive", "max_change", "correct", "window"],
+                           defaults=(None, None, True, None, False, 5))
+
+# Rules of each step, they keep the bounds that each one always used
+ECTOPIC_RULES = ArtifactRules(low=0.3, high=2, inclusive=False)     # Features of create_datasets and RR_visualization
+PREPROCESS_RULES = ArtifactRules(low=0.3, high=2, inclusive=True)   # Rows deleted by preprocess_rr
+SLEEP_RULES = ArtifactRules(high=3)                                 # Hourly RR statistics of extract_sleep_features
+
+# Flags of each beat, a corrected beat also keeps the flag of the rule that rejected it
+OUT_OF_RANGE = 1
+SUDDEN_CHANGE = 2
+CORRECTED = 4
+
+
+def find_artifacts(ibi, rules, previous=None, groups=None):
+    """
+    Flags the beats rejected by the range and successive change rules, in one pass over the intervals.
+    Missing intervals are always out of range. A beat is compared with the one before only if that one is in range.
+    Parameters
+    ---------
+    ibi : array
+        Inter-beat intervals in seconds.
+    rules : ArtifactRules
+        Rules to apply.
+    previous : float
+        Interval before the first one (e.g. the last of the previous chunk of a file), None if there is none.
+    groups : array
+        Label of each beat (e.g. the user), the beats of different groups are never compared.
+    Returns
+    ---------
+    flags : array
+        OUT_OF_RANGE or SUDDEN_CHANGE for the rejected beats, 0 for the others.
+    """
+
+    ibi = numpy.asarray(ibi, dtype=numpy.float64)
+    if previous is not None:
+        ibi = numpy.concatenate(([previous], ibi))
+
+    in_range = ~numpy.isnan(ibi)
+    with numpy.errstate(invalid='ignore'):
+        if rules.low is not None:
+            in_range &= (ibi >= rules.low) if rules.inclusive else (ibi > rules.low)
+        if rules.high is not None:
+            in_range &= (ibi <= rules.high) if rules.inclusive else (ibi < rules.high)
+    flags = numpy.where(in_range, 0, OUT_OF_RANGE).astype(numpy.int8)
+
+    if rules.max_change is not None and len(ibi) > 1:
+        reference = numpy.where(in_range, ibi, numpy.nan)[:-1]
+        if groups is not None:
+            groups = numpy.asarray(groups)
+            first = groups[1:] != groups[:-1] if previous is None else numpy.concatenate(([False], groups[1:] != groups[:-1]))
+            reference = numpy.where(first, numpy.nan, reference)
+        with numpy.errstate(invalid='ignore'):
+            sudden_change = in_range[1:] & (numpy.abs(ibi[1:] - reference) > rules.max_change * reference)
+        flags[1:][sudden_change] = SUDDEN_CHANGE
+
+    return flags[1:] if previous is not None else flags
+
+
+def rolling_median(values, window, groups=None):
+    """
+    Median of the window of values centered on each one, ignoring the missing values and the values of other groups.
+    The windows are strided views of the padded values, so they are all computed at once without copying them in a loop.
+    """
+
+    values = numpy.asarray(values, dtype=numpy.float64)
+    before, after = window // 2, window - 1 - window // 2
+    padded = numpy.concatenate((numpy.full(before, numpy.nan), values, numpy.full(after, numpy.nan)))
+    windows = numpy.lib.stride_tricks.sliding_window_view(padded, window)
+    if groups is not None:
+        groups = numpy.asarray(groups)
+        padded_groups = numpy.concatenate((numpy.repeat(groups[:1], before), groups, numpy.repeat(groups[-1:], after)))
+        same_group = numpy.lib.stride_tricks.sliding_window_view(padded_groups, window) == groups[:, numpy.newaxis]
+        windows = numpy.where(same_group, windows, numpy.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")     # windows without values give NaN
+        return numpy.nanmedian(windows, axis=1) if len(values) > 0 else values.copy()
+
+
+def clean_beats(ibi, rules, groups=None):
+    """
+    Applies the artifact rules to the intervals, keeping every beat in its position.
+    Returns
+    ---------
+    clean : array
+        The intervals with NaN in place of the rejected beats, or with the median of their window if rules.correct
+        (the beats whose window has no valid value stay NaN).
+    flags : array
+        Flags of each beat, see find_artifacts, with CORRECTED added to the corrected beats.
+    """
+
+    ibi = numpy.asarray(ibi, dtype=numpy.float64)
+    flags = find_artifacts(ibi, rules, groups=groups)
+    clean = numpy.where(flags == 0, ibi, numpy.nan)
+    if rules.correct:
+        median = rolling_median(clean, rules.window, groups)
+        corrected = (flags != 0) & ~numpy.isnan(median)
+        clean[corrected] = median[corrected]
+        flags[corrected] |= CORRECTED
+    return clean, flags
+
+
+# Number of beats, of rejected beats by rule and of corrected beats, for the report of each user
+def count_artifacts(flags):
+    return {"beats": len(flags),
+            "out_of_range": int(numpy.count_nonzero(flags & OUT_OF_RANGE)),
+            "sudden_change": int(numpy.count_nonzero(flags & SUDDEN_CHANGE)),
+            "corrected": int(numpy.count_nonzero(flags & CORRECTED))}
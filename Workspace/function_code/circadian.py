@@ -1,7 +1,86 @@
+import numpy
+
+
+PERIOD = 24*3600 # period of the circadian rhythm (24h in seconds)
+
+
+def fit_sin_batch(tt, yy, groups):
+
+    '''
+    Fit the 24h cosinor model yy = A * sin(2*pi*tt/PERIOD + p) + c to the time sequence of every group at once.
+    With the period fixed the model is linear in the sine and cosine of the time, A*cos(p)*sin + A*sin(p)*cos + c,
+    so the coefficients are the least squares solution of a 3x3 system for each group, with no iterative fit.
+    Parameters
+    ---------
+    tt : list
+        List of timestamp expressed in seconds
+    yy: list
+        List of values to fit circadian rhythm (e.g., Heart Rate, intra-beats intervals).
+    groups: list
+        Label of each value (e.g., the user), a separate curve is fitted for each label.
+    Returns
+    ---------
+    results : dictionaire
+        For each label, the dictionaire of fit_sin with the fitting parameters.
+    '''
+
+    tt = numpy.asarray(tt, dtype=float)
+    yy = numpy.asarray(yy, dtype=float)
+    labels, inverse, counts = numpy.unique(numpy.asarray(groups), return_inverse=True, return_counts=True)
+
+    def group_sum(values):
+        return numpy.bincount(inverse, weights=values, minlength=len(labels))
+
+    # The values are centered on the mean of their group, which keeps the system well conditioned
+    mean = group_sum(yy) / counts
+    yc = yy - mean[inverse]
+    sin = numpy.sin(tt/PERIOD*2*numpy.pi)
+    cos = numpy.cos(tt/PERIOD*2*numpy.pi)
+
+    # Normal equations of each group for the regressors sin, cos and 1
+    normal = numpy.empty((len(labels), 3, 3))
+    normal[:, 0, 0] = group_sum(sin*sin)
+    normal[:, 0, 1] = normal[:, 1, 0] = group_sum(sin*cos)
+    normal[:, 1, 1] = group_sum(cos*cos)
+    normal[:, 0, 2] = normal[:, 2, 0] = group_sum(sin)
+    normal[:, 1, 2] = normal[:, 2, 1] = group_sum(cos)
+    normal[:, 2, 2] = counts
+    rhs = numpy.stack([group_sum(sin*yc), group_sum(cos*yc), group_sum(yc)], axis=1)
+    beta_sin, beta_cos, beta_offset = numpy.linalg.solve(normal, rhs[:, :, numpy.newaxis])[:, :, 0].T
+
+    amp = numpy.hypot(beta_sin, beta_cos)
+    phase = numpy.arctan2(beta_cos, beta_sin)
+    offset = beta_offset + mean
+    ff = beta_sin[inverse]*sin + beta_cos[inverse]*cos + offset[inverse]
+
+    # Coefficient of determination, as sklearn's r2_score
+    ss_res = group_sum((yy - ff)**2)
+    ss_tot = group_sum(yc**2)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        r2 = numpy.where(ss_tot > 0, 1 - ss_res/ss_tot, numpy.where(ss_res == 0, 1.0, 0.0))
+
+    # Acrophase: first timestamp of each group where the fitted curve is at its maximum
+    order = numpy.lexsort((numpy.arange(len(tt)), -ff, inverse))
+    first = numpy.cumsum(counts) - counts
+    acrophase = tt[order[first]]
+
+    # Values of each group in their original order
+    by_group = numpy.argsort(inverse, kind='stable')
+    tt_groups = numpy.split(tt[by_group], first[1:])
+    ff_groups = numpy.split(ff[by_group], first[1:])
+
+    results = {}
+    for i, label in enumerate(labels):
+        results[label] = {"amp": amp[i], "phase": phase[i], "APhase": acrophase[i], "offset": offset[i], "r2": r2[i],
+                          "tt": tt_groups[i], 'ff': ff_groups[i]}
+    return results
+
+
 def fit_sin(tt, yy,plot=False):
-  
+
     '''
-    Fit sin to the input time sequence, and return fitting parameters "amp", "omega", "phase", "offset", "freq", "period"
+    Fit sin to the input time sequence, and return fitting parameters "amp", "phase", "APhase", "offset", "r2"
+    and the fitted values, using the linear cosinor of fit_sin_batch
     Parameters
     ---------
     tt : list
@@ -13,41 +92,20 @@ def fit_sin(tt, yy,plot=False):
     res : dictionaire
         dictionaires cotaining fitting parmeters.
     '''
-    
-    import scipy
-    import numpy
-    from sklearn.metrics import r2_score
-    import pandas as pd
+
     import matplotlib.pyplot as plt
 
     tt = numpy.array(tt)
     yy = numpy.array(yy)
-    freq = 24*3600 # dayly frequency (24h in seconds)
-    guess_amp = numpy.std(yy) * 2.**0.5
-    guess_offset = numpy.mean(yy)
-    guess = numpy.array([guess_amp, 2.*numpy.pi*freq, 0., guess_offset])
-
-    def sinfunc(t, A, w, p, c):  return  A * numpy.sin((t/(freq))*2*numpy.pi + p) + c 
-
-    popt, pcov = scipy.optimize.curve_fit(sinfunc, tt, yy, p0=guess)
-    A, w, p, c = popt
-    f = w/(2.*numpy.pi)
-
-    fitfunc = lambda t: A * numpy.sin((t/freq)*2*numpy.pi + p) + c
-
-    coefficient_of_dermination = r2_score(yy, fitfunc(tt))
-    acrophase_time = pd.DataFrame([[x,y] for x,y in zip(tt,fitfunc(tt))],columns=['t','val']).set_index('t')
-    acrophase_timestamp = acrophase_time[acrophase_time.val == acrophase_time.max().values[0]].index[0]
+    res = fit_sin_batch(tt, yy, numpy.zeros(len(tt)))[0]
 
-    res = {"amp": abs(A), "phase": p, "APhase": acrophase_timestamp, "offset": c, "r2":coefficient_of_dermination,"tt":tt,'ff':fitfunc(tt)}
-    
     if plot==True:
         fig,ax = plt.subplots(figsize=(6,5))
         ax.plot(tt, yy, "-k", linewidth=1, alpha=0.3)
-        ax.plot(tt, fitfunc(tt), "r-", label="circadian rhythm", linewidth=1)
+        ax.plot(tt, res['ff'], "r-", label="circadian rhythm", linewidth=1)
         plt.xticks(numpy.arange(130000)[::20000][2:],['11AM day 1','5:30PM day 1','10PM day 1', '3:30AM day 2', '9AM day 2'],rotation=90)
         plt.legend()
         fig.tight_layout()
         plt.show()
 
-    return res
\ No newline at end of file
+    return res
@@ -1,34 +1,206 @@
-def create_dataset(path,users,file_name,replace_na=True):
-    
+import os
+import json
+
+import numpy
+import pandas
+
+
+CACHE_FOLDER = ".cache"
+MANIFEST_NAME = "manifest.json"
+
+
+def _source_signature(file_path):
+    """
+    Returns the values used to decide whether a cached file is still valid.
+    Parameters
+    ---------
+    file_path : str
+        Path of the source csv file.
+    Returns
+    ---------
+    signature : dict
+        Absolute path, modification time (ns) and size of the source file.
+    """
+    stat = os.stat(file_path)
+    return {"source": os.path.abspath(file_path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _write_cache(df, cache_dir, signature):
+    """
+    Saves every column of df as a typed .npy file inside cache_dir.
+    String columns are saved as fixed width unicode arrays plus a mask of the missing values,
+    so that no pickling is needed to read them back.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column].values
+        entry = {"name": column, "file": "col_%d.npy" % i}
+        if values.dtype == object:
+            mask = pandas.isna(values)
+            strings = numpy.where(mask, "", values).astype(str)
+            numpy.save(os.path.join(cache_dir, "col_%d.mask.npy" % i), mask)
+            values = strings
+            entry["kind"] = "string"
+        else:
+            entry["kind"] = "numeric"
+        numpy.save(os.path.join(cache_dir, entry["file"]), values, allow_pickle=False)
+        columns.append(entry)
+
+    # The manifest is written last, a cache without it is considered incomplete and rebuilt
+    with open(os.path.join(cache_dir, MANIFEST_NAME), "w") as f:
+        json.dump({"signature": signature, "rows": len(df), "columns": columns}, f)
+
+
+def _read_cache(cache_dir, signature, columns=None):
+    """
+    Loads the requested columns from cache_dir, returns None if the cache is missing or stale.
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest["signature"] != signature:
+        return None
+
+    entries = {entry["name"]: entry for entry in manifest["columns"]}
+    names = [entry["name"] for entry in manifest["columns"]] if columns is None else columns
+    data = {}
+    for name in names:
+        entry = entries[name]   # KeyError if the column does not exist, like a wrong column name in pandas
+        values = numpy.load(os.path.join(cache_dir, entry["file"]))
+        if entry["kind"] == "string":
+            mask = numpy.load(os.path.join(cache_dir, entry["file"].replace(".npy", ".mask.npy")))
+            values = values.astype(object)
+            values[mask] = numpy.nan
+        data[name] = values
+    return pandas.DataFrame(data, columns=names)
+
+
+def load_user_file(path, user, file_name, columns=None, use_cache=True):
+    """
+    Returns the dataframe of a single user file, going through the columnar cache.
+    The first read of DataPaper/<user>/<file_name>.csv converts it to one .npy file per column
+    in DataPaper/<user>/.cache/<file_name>/, later reads only load the requested columns.
+    The cache is rebuilt when the path, modification time or size of the csv changes.
+    Parameters
+    ---------
+    path : str
+        Path of the folder containing the users' folders.
+    user : str
+        Name of the user folder.
+    file_name : str
+        Name of the csv file without extension.
+    columns : list
+        Columns to load, all of them if None.
+    use_cache : bool
+        If False the csv is always parsed and the cache is left untouched.
+    Returns
+    ---------
+    df : pandas.DataFrame
+        Content of the file.
+    """
+    file_path = os.path.join(path, user, file_name + ".csv")
+    if not use_cache:
+        return pandas.read_csv(file_path, usecols=columns)
+
+    signature = _source_signature(file_path)
+    cache_dir = os.path.join(path, user, CACHE_FOLDER, file_name)
+    df = _read_cache(cache_dir, signature, columns)
+    if df is None:
+        df = pandas.read_csv(file_path)
+        try:
+            _write_cache(df, cache_dir, signature)
+        except OSError:
+            # e.g. a read-only data folder or a full disk, the csv just parsed is used without the cache
+            print("Could not write the cache of %s/%s, reading the csv file" % (user, file_name))
+        if columns is not None:
+            df = df[columns].copy()
+    return df
+
+
+def read_chunks(file_path, chunk_size=None, columns=None):
+    """
+    Reads a csv file chunk_size rows at a time, so that a long recording never needs to be in memory at once.
+    The rows of every chunk keep their position in the file as index, the csv index column is dropped.
+    Parameters
+    ---------
+    file_path : str
+        Path of the csv file.
+    chunk_size : int
+        Number of rows of each chunk, if None the whole file is a single chunk.
+    columns : list
+        Columns to load, all of them if None.
+    Returns
+    ---------
+    chunks : generator
+        The chunks of the file as dataframes, in the order of the file.
+    """
+    chunks = [pandas.read_csv(file_path, usecols=columns)] if chunk_size is None else pandas.read_csv(file_path, usecols=columns, chunksize=chunk_size)
+    for df in chunks:
+        yield df.drop(columns=['Unnamed: 0'], errors='ignore')
+
+
+def iter_dataset(path, users, file_name, chunk_size, replace_na=True, columns=None):
+    """
+    Streaming version of create_dataset: yields the data of every user one chunk at a time, without the cache.
+    Returns
+    ---------
+    chunks : generator
+        (user, chunk) for every chunk of every user, in the order of the users.
+    """
+    for user in users:
+        file_path = os.path.join(path, user, file_name + ".csv")
+        if not os.path.isfile(file_path):
+            print('NO data for %s'%user)
+            continue
+        for df in read_chunks(file_path, chunk_size, columns):
+            if replace_na == True:
+                df = df.replace(0,numpy.nan)
+            yield user, df
+
+
+def create_dataset(path,users,file_name,replace_na=True,columns=None,use_cache=True):
+
     """
     Returns MMASH datafarame.
     Parameters
     ---------
-    nn_intervals : list
-        List of Normal to Normal Interval.
+    path : str
+        Path of the folder containing the users' folders.
+    users : list
+        List of the users to load.
+    file_name : str
+        Name of the csv file to load for each user, without extension.
+    replace_na : bool
+        Replace zeros with NaN.
+    columns : list
+        Columns to load, by default all of them (the csv index column is always dropped).
+    use_cache : bool
+        Read the files through the per-user columnar cache (see load_user_file).
     Returns
     ---------
-    nni_tmstp : list
-        list of time intervals between first NN-interval and final NN-interval.
+    df_concat : pandas.DataFrame
+        Data of all the users, indexed by user.
     """
-    
-    import pandas
-    import numpy
-    
-    df_concat = pandas.DataFrame()
+
+    frames = []
     for user in users:
         try:
-            df = pandas.read_csv(path + '%s/%s.csv' %(user,file_name))
+            df = load_user_file(path, user, file_name, columns, use_cache)
             df['user'] = user
-            df_concat = pandas.concat([df_concat,df])
-        except:
+            frames.append(df)
+        except FileNotFoundError:   # any other error (e.g. a wrong column name) is raised
             print('NO data for %s'%user)
             pass
-    
-    del df_concat['Unnamed: 0']
+
+    # A single concat at the end, concatenating inside the loop copies the data once per user
+    df_concat = pandas.concat(frames) if len(frames) > 0 else pandas.DataFrame(columns=['user'])
+    df_concat = df_concat.drop(columns=['Unnamed: 0'], errors='ignore')
     df_concat = df_concat.set_index('user')
 
     if replace_na == True:
         df_concat = df_concat.replace(0,numpy.nan)
 
-    return(df_concat)
\ No newline at end of file
+    return(df_concat)
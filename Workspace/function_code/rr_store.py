@@ -0,0 +1,211 @@
+import os
+import json
+import shutil
+
+import numpy
+import pandas
+
+import function_code.artifacts as artifacts
+import function_code.open_data as open_data
+import utilities.time_parsing as time_parsing
+
+
+STORE_FOLDER = "Outputs/rr_store"
+INDEX_NAME = "index.json"
+COLUMNS = ["ibi_s", "timestamp"]    # One flat float64 file for each column, with the beats of every user one after the other
+CLEAN_COLUMN = "ibi_clean"          # Intervals after the artifact rules of the store (see artifacts.clean_beats)
+
+
+class RRStore:
+
+    """
+    Read only view of the RR data of the whole cohort, stored in CSR form: the inter-beat intervals and their
+    timestamps are two flat memory-mapped arrays, and the index gives the [start, end) rows of each user.
+    store[user] returns the (ibi_s, timestamp) arrays of the user as slices of the memory map, nothing is
+    copied or read from the disk until the values are used, so the cohort does not need to fit in memory.
+    The slices are numpy arrays and can be passed directly to the functions of HRV_analysis.
+    store.get_clean(user) returns the intervals after the artifact rules instead, they are computed once when the
+    store is built and the number of beats rejected for each user is kept in the index (see artifact_report).
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, INDEX_NAME)) as f:
+            self.index = json.load(f)
+        self.offsets = {user: tuple(offsets) for user, offsets in self.index["users"].items()}
+        self.arrays = {}
+        for column in COLUMNS + [CLEAN_COLUMN]:
+            if self.index["rows"] > 0:
+                self.arrays[column] = numpy.memmap(os.path.join(store_dir, column + ".bin"), dtype=numpy.float64, mode="r",
+                                                   shape=(self.index["rows"],))
+            else:   # an empty file cannot be memory-mapped
+                self.arrays[column] = numpy.empty(0)
+
+    @property
+    def users(self):
+        return list(self.offsets)
+
+    def __contains__(self, user):
+        return user in self.offsets
+
+    def __len__(self):
+        return self.index["rows"]
+
+    def __getitem__(self, user):
+        start, end = self.offsets[user]
+        # asarray gives plain arrays that still share the memory of the map
+        return tuple(numpy.asarray(self.arrays[column][start:end]) for column in COLUMNS)
+
+    def get_clean(self, user):
+        start, end = self.offsets[user]
+        return numpy.asarray(self.arrays[CLEAN_COLUMN][start:end]), numpy.asarray(self.arrays["timestamp"][start:end])
+
+    # Dataframe with the counts of artifacts.count_artifacts for each user
+    def artifact_report(self):
+        df = pandas.DataFrame.from_dict(self.index["artifacts"], orient="index")
+        df.index.name = "user"
+        return df
+
+
+def get_store_dir(file_name):
+    return os.path.join(os.getcwd(), STORE_FOLDER, file_name)
+
+
+def _signatures(path, users, file_name):
+    return {user: open_data._source_signature(os.path.join(path, user, file_name + ".csv")) for user in users}
+
+
+# Store written by the last run and the users that can be copied from it, whose csv file did not change since then
+# Nothing can be copied if the store is incomplete or was cleaned with other artifact rules
+def _previous_store(store_dir, signatures, rules):
+    if not os.path.isfile(os.path.join(store_dir, INDEX_NAME)):
+        return None, set()
+    previous = RRStore(store_dir)
+    if previous.index.get("rules") != rules._asdict():
+        return None, set()
+    return previous, {user for user in previous.users if previous.index["signatures"].get(user) == signatures.get(user)}
+
+
+# Writes the intervals after the artifact rules, chunk_size beats at a time (each user at once if None)
+# Every block is cleaned with the beats around it, the rules only look at the neighbours within half a window
+# The reused users are copied from the previous store with their counts
+# Returns the artifact counts of each user
+def _write_clean(store_dir, offsets, rows, rules, chunk_size=None, previous=None, reused=()):
+    counts = {}
+    halo = rules.window // 2 + 1
+    ibi = numpy.memmap(os.path.join(store_dir, "ibi_s.bin"), dtype=numpy.float64, mode="r", shape=(rows,)) if rows > 0 else numpy.empty(0)
+    with open(os.path.join(store_dir, CLEAN_COLUMN + ".bin"), "wb") as f:
+        for user, (start, end) in offsets.items():
+            if user in reused:
+                old_start, old_end = previous.offsets[user]
+                numpy.asarray(previous.arrays[CLEAN_COLUMN][old_start:old_end]).tofile(f)
+                counts[user] = previous.index["artifacts"][user]
+                continue
+            block = chunk_size or max(end - start, 1)
+            flags = []
+            for block_start in range(start, end, block):
+                block_end = min(block_start + block, end)
+                low, high = max(start, block_start - halo), min(end, block_end + halo)
+                clean, block_flags = artifacts.clean_beats(ibi[low:high], rules)
+                clean[block_start - low:block_end - low].tofile(f)
+                flags.append(block_flags[block_start - low:block_end - low])
+            counts[user] = artifacts.count_artifacts(numpy.concatenate(flags) if flags else numpy.empty(0, dtype=numpy.int8))
+    return counts
+
+
+def build_store(path, users, file_name="RR", chunk_size=None, rules=artifacts.ECTOPIC_RULES):
+    """
+    Writes the RR store of file_name for the users, reading one user at a time (chunk_size rows at a time if set).
+    The users whose csv file did not change since the store was last written with the same rules are copied
+    from it, so that only the new and modified users are read and cleaned again.
+    The timestamps are the seconds from midnight of the first day, as time_parsing.time_to_seconds with the day.
+    Parameters
+    ---------
+    path : str
+        Path of the folder containing the users' folders.
+    users : list
+        List of the users to store, in the order of their rows.
+    file_name : str
+        Name of the RR csv file without extension (RR or RR-processed).
+    chunk_size : int
+        Number of rows read at a time from the csv files, if None each file is read whole through the cache of open_data.
+    rules : ArtifactRules
+        Artifact rules of the clean intervals.
+    Returns
+    ---------
+    store : RRStore
+        The new store.
+    """
+
+    store_dir = get_store_dir(file_name)
+    signatures = _signatures(path, users, file_name)
+    previous, reused = _previous_store(store_dir, signatures, rules)
+    # The new store is written next to the previous one, which is replaced only once the new index is written
+    new_dir = store_dir + ".new"
+    shutil.rmtree(new_dir, ignore_errors=True)
+    os.makedirs(new_dir)
+
+    files = {column: open(os.path.join(new_dir, column + ".bin"), "wb") for column in COLUMNS}
+    offsets = {}
+    rows = 0
+    try:
+        for user in users:
+            if user in reused:
+                old_start, old_end = previous.offsets[user]
+                for column in COLUMNS:
+                    numpy.asarray(previous.arrays[column][old_start:old_end]).tofile(files[column])
+                offsets[user] = [rows, rows + old_end - old_start]
+                rows += old_end - old_start
+                continue
+            if chunk_size is None:
+                chunks = [open_data.load_user_file(path, user, file_name, columns=['ibi_s', 'time', 'day'])]
+            else:
+                chunks = open_data.read_chunks(os.path.join(path, user, file_name + ".csv"), chunk_size, columns=['ibi_s', 'time', 'day'])
+            start = rows
+            for df in chunks:
+                values = {"ibi_s": df['ibi_s'].values.astype(numpy.float64),
+                          "timestamp": time_parsing.time_to_seconds(df['time'], df['day']).astype(numpy.float64)}
+                for column in COLUMNS:
+                    values[column].tofile(files[column])
+                rows += len(df)
+            offsets[user] = [start, rows]
+    finally:
+        for f in files.values():
+            f.close()
+
+    counts = _write_clean(new_dir, offsets, rows, rules, chunk_size, previous, reused)
+
+    with open(os.path.join(new_dir, INDEX_NAME), "w") as f:
+        json.dump({"rows": rows, "users": offsets, "signatures": signatures,
+                   "rules": rules._asdict(), "artifacts": counts}, f)
+    # The memory maps of the previous store are closed before its files are removed
+    previous = None
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(new_dir, store_dir)
+    return RRStore(store_dir)
+
+
+def load_store(path, users, file_name="RR", chunk_size=None, rules=artifacts.ECTOPIC_RULES):
+    """
+    Returns the RR store of file_name, building it again if it is missing, if the users or the artifact rules changed
+    or if any of their csv files was modified since it was written (same check as the columnar cache of open_data).
+    Only the new and modified users are read again when it is rebuilt with the same rules, see build_store.
+    """
+
+    store_dir = get_store_dir(file_name)
+    index_path = os.path.join(store_dir, INDEX_NAME)
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if (list(index["users"]) == list(users) and index["signatures"] == _signatures(path, users, file_name)
+                and index.get("rules") == rules._asdict()):
+            return RRStore(store_dir)
+    return build_store(path, users, file_name, chunk_size, rules)
+
+
+def open_store(file_name="RR"):
+    """
+    Returns the RR store of file_name as it is on disk, without checking the csv files.
+    Used by the worker processes once the store has been checked by load_store.
+    """
+
+    return RRStore(get_store_dir(file_name))
@@ -1,9 +1,14 @@
 # This script does feature selection and trains the models with the received data to give back predictions
 
+import numpy as np
+from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.feature_selection import SelectFromModel
 from sklearn.feature_selection import f_regression, r_regression, mutual_info_regression
 
 
+FEATURE_THRESHOLD = 0.1     # Minimum correlation of the features kept by the advanced feature selection
+
+
 def selectFeatures(model, X):
     selector = SelectFromModel(model, prefit=True)
     feature_idx = selector.get_support()
@@ -22,7 +27,11 @@ def doFeatSelection(model, X, Y):
 def featSelectionAdvanced(X, Y, threshold):  # To experiment, change the threshold and function in scores
     # scores = mutual_info_regression(X, Y, random_state=42)     # quite slow
     # scores = f_regression(X, Y)[0] # For f_regression we use f values
-    scores = r_regression(X, Y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = r_regression(X, Y)
+    # A constant feature has no correlation and is never selected, as in looFeatSelection
+    # (r_regression gives inf, or any value when its variance is not exactly 0 because of rounding)
+    scores = np.where(X.max().values == X.min().values, np.nan, scores)
     columns = list(X.columns.values)
     i = 0
     res = []
@@ -32,15 +41,115 @@ def featSelectionAdvanced(X, Y, threshold):  # To experiment, change the thresho
     # Uncomment to see how many features are selected for each user (beware of terminal spam)
     # print("Num. features selected:", len(res))
     return res
-    
 
-def fit_and_predict(model, support_feat_select, train, test):
+
+# Pearson correlation of every feature with Y when each user is left out, as r_regression on the other users
+# Without a user the sums of the values, of their squares and of their products only lose the terms of that user,
+# so the correlations of all the folds come from the sums of all the users in one pass
+# The features that are constant without a user have no correlation (nan) in that fold
+# Returns an array with a row for each left out user (in the order of the rows of X) and a column for each feature
+def looCorrelations(X, Y):
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    n = len(Y) - 1      # Users in each fold
+
+    # Largest and smallest value of each feature without each user: the second one if the user has the first one
+    ordered = np.sort(X, axis=0)
+    fold_max = np.where(X == ordered[-1], ordered[-2], ordered[-1])
+    fold_min = np.where(X == ordered[0], ordered[1], ordered[0])
+    constant = fold_max == fold_min
+
+    # Centered on the means of all the users, the correlation does not change and the sums stay small
+    X = X - X.mean(axis=0)
+    Y = Y - Y.mean()
+    sum_x = X.sum(axis=0) - X
+    sum_y = (Y.sum() - Y)[:, np.newaxis]
+    sum_xx = (X * X).sum(axis=0) - X * X
+    sum_yy = (Y @ Y - Y * Y)[:, np.newaxis]
+    sum_xy = Y @ X - X * Y[:, np.newaxis]
+
+    covariance = sum_xy - sum_x * sum_y / n
+    variance_x = sum_xx - sum_x * sum_x / n
+    variance_y = sum_yy - sum_y * sum_y / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(constant, np.nan, covariance / np.sqrt(variance_x * variance_y))
+
+
+# Features selected by featSelectionAdvanced in every leave-one-out fold, as boolean masks
+# threshold can also be a list of thresholds, the masks of all of them come from the same correlations
+# Returns an array of shape (folds, features), or (thresholds, folds, features) for a list of thresholds
+def looFeatSelection(X, Y, threshold=FEATURE_THRESHOLD):
+    scores = looCorrelations(X, Y)
+    thresholds = np.asarray(threshold, dtype=float)
+    # A constant feature has no correlation (nan) and is never selected
+    with np.errstate(invalid='ignore'):
+        return scores > thresholds.reshape(thresholds.shape + (1, 1))
+
+
+# Whether the leave-one-out predictions of the model can be computed with looLinearPredictions
+# Only least squares with a quadratic penalty qualify, e.g. not Lasso, whose coefficients are not linear in Y
+def supportsLooFastPath(model):
+    if type(model) not in (LinearRegression, Ridge):
+        return False
+    params = model.get_params()
+    if params.get("normalize", False) or params.get("positive", False):
+        return False
+    return np.ndim(params.get("alpha", 0)) == 0
+
+
+# Leave-one-out predictions of a LinearRegression or Ridge model from a single fit on all the rows
+# The fitted values are H @ Y, with H the hat matrix of the penalized least squares (the intercept is not penalized), and the
+# residual of a left out row is its residual in the full fit divided by 1 - H[i, i] (PRESS identity), so no fit is repeated
+# groups gives the subject of each row (one subject per row if None), the rows of a subject are left out together
+# Returns None if the system is singular or a row determines its own fit, in that case the folds must be fitted one by one
+def looLinearPredictions(model, X, Y, groups=None):
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    params = model.get_params()
+
+    Z = np.column_stack([np.ones(len(X)), X]) if params["fit_intercept"] else X
+    penalty = np.full(Z.shape[1], np.sqrt(params.get("alpha", 0)))
+    if params["fit_intercept"]:
+        penalty[0] = 0
+
+    # QR factorization of the design with the penalty as extra rows, then H = Q_z @ Q_z.T where Q_z are the rows of the data
+    # Only the blocks of H on the rows of each subject are needed, the n x n matrix is never built
+    Q, R = np.linalg.qr(np.vstack([Z, np.diag(penalty)]))
+    diagonal = np.abs(np.diag(R))
+    if diagonal.min() <= diagonal.max() * max(Z.shape) * np.finfo(float).eps:
+        return None
+    Q = Q[:len(Z)]
+    residuals = Y - Q @ (Q.T @ Y)
+
+    groups = np.arange(len(Y)) if groups is None else np.asarray(groups)
+    _, groups = np.unique(groups, return_inverse=True)
+    if groups.max() == len(Y) - 1:
+        # One row per subject: (I - H_gg) is the scalar 1 - H[i, i]
+        leverage = 1 - np.einsum("ij,ij->i", Q, Q)
+        if leverage.min() < 1e-8:
+            return None
+        return Y - residuals / leverage
+
+    loo_residuals = np.empty(len(Y))
+    for group in range(groups.max() + 1):
+        rows = np.flatnonzero(groups == group)
+        # Residuals of the rows of the subject when it is left out: (I - H_gg)^-1 times their residuals in the full fit
+        leverage = np.eye(len(rows)) - Q[rows] @ Q[rows].T
+        if np.linalg.cond(leverage) > 1e8:
+            return None
+        loo_residuals[rows] = np.linalg.solve(leverage, residuals[rows])
+    return Y - loo_residuals
+
+
+# features are the features selected for this fold if already known (see looFeatSelection), otherwise they are selected here
+def fit_and_predict(model, support_feat_select, train, test, features=None):
     features_num = len(train["X"].columns)
 
     support_feat_select = True  # The if condition must always be true for advanced feature selection
     if support_feat_select:
         # features = doFeatSelection(model, train["X"], train["Y"])     # Automatic feature selection
-        features = featSelectionAdvanced(train["X"], train["Y"], 0.1)   # Change the threshold to experiment (check the values first)
+        if features is None:
+            features = featSelectionAdvanced(train["X"], train["Y"], FEATURE_THRESHOLD)   # Change the threshold to experiment (check the values first)
         train["X"] = train["X"][features]
         test["X"] = test["X"][features]
         features_num = len(features)
@@ -2,11 +2,153 @@
 # It also cleans the rows where the HR value is under 50 or over 200
 
 import os
+import numpy as np
 import pandas as pd
+import function_code.open_data as open_data
 import utilities.library as lib
+import utilities.parallel as parallel
+
+
+SWEEP_FILE = "Datasets/anomalies_sweep.csv"    # Output of the threshold sweep, relative to the working directory
+
+
+# Vectorized detection of the moments in which the HR is above max_ibi_at_rest while sitting or lying down
+# Returns two boolean arrays: the rows that were checked (above the threshold while sitting or lying) and the anomalies
+# The rows of df must be consecutive in time, with a default index (the previous row is the one before in the array)
+# When the file is read in chunks, state is a dict (empty for the first chunk) with the HR, standing position and skip
+# flag of the last row of the previous chunk, it is updated with the ones of the last row of df for the next chunk
+def detect_anomalies(df, max_ibi_at_rest, state=None):
+    state = {} if state is None else state
+    hr = df['HR'].values.astype(float)
+    standing = (df['Inclinometer Off'].values == 1.0) | (df['Inclinometer Standing'].values == 1.0)
+    sitting_or_lying = (df['Inclinometer Sitting'].values == 1.0) | (df['Inclinometer Lying'].values == 1.0)
+    checked = (hr > max_ibi_at_rest) & sitting_or_lying
+    if len(hr) == 0:
+        return checked, checked.copy()
+
+    # Values of the previous row, the first row of the file has no previous one to compare with and is never an anomaly
+    previous_hr = np.concatenate(([state.get("hr", np.nan)], hr[:-1]))
+    previous_standing = np.concatenate(([state.get("standing", False)], standing[:-1]))
+    candidates = checked.copy()
+    if "hr" not in state:
+        candidates[:1] = False
+
+    # If the user was standing before, it is an anomaly only if the HR increased enough (*0.8 to loosen the condition),
+    # otherwise the high HR was already there and the following rows are skipped until something resets the skip flag
+    after_standing = candidates & previous_standing
+    standing_anomaly = after_standing & (previous_hr < hr * 0.8)
+    # If the user was already sitting or lying down, a previous HR under the threshold resets the skip flag
+    reset = candidates & ~previous_standing & (previous_hr <= max_ibi_at_rest)
+    carried = candidates & ~previous_standing & ~reset
+
+    # Value of the skip flag set by each row (-1 where it is left unchanged), then the value in force before each row
+    skip_set = np.full(len(hr), -1, dtype=np.int8)
+    skip_set[after_standing] = ~standing_anomaly[after_standing]
+    skip_set[reset] = 0
+    last_set = np.maximum.accumulate(np.where(skip_set >= 0, np.arange(len(hr)), -1))
+    last_set_before = np.concatenate(([-1], last_set[:-1]))
+    skip = np.where(last_set_before >= 0, skip_set[last_set_before] == 1, state.get("skip", False))
+
+    anomaly = standing_anomaly | reset | (carried & ~skip)
+    state.update({"hr": hr[-1], "standing": standing[-1],
+                  "skip": skip_set[last_set[-1]] == 1 if last_set[-1] >= 0 else state.get("skip", False)})
+    return checked, anomaly
+
+
+# Reads the actigraph file of a user chunk_size rows at a time (None reads it whole) and removes the rows with
+# impossible HR values (under 50 or over 200)
+# Yields each cleaned chunk, with a default index, and the number of rows it had in the file
+def load_user_data(path, user, chunk_size=None):
+    for df in open_data.read_chunks(path + '%s/%s.csv' %(user, "Actigraph"), chunk_size):    # Without the index column
+        df['day'] = df['day'].replace(-29, 2)  # Fix data for users 8 and 9
 
-
-def preprocessing(path, users, max_ibi_at_rest = 0):
+        row_count = len(df)
+        df = df.drop(df[df['HR'] > 200].index)
+        df = df.drop(df[df['HR'] < 50].index)
+        df = df.reset_index(drop=True)
+        yield df, row_count
+
+
+# Writes the Actigraph-processed file of a user one chunk at a time, chunk_size rows read at a time (None reads
+# the file whole), and returns its log rows for preprocessing
+def preprocess_user(user, path, max_ibi_at_rest, chunk_size=None):
+    result_text = []
+    lib.logger(user, result_text, False)
+
+    row_count = suspicious_rows = rows_while_sitting_or_lying = n_anomalies = written_rows = 0
+    state = {}
+    # Save the processed values to the new file, one chunk at a time
+    user_file_name = path + user + "/Actigraph-processed.csv"
+    with open(user_file_name, "w") as f:
+        # Creating the dataframe and removing rows with impossible HR values
+        for i, (df, chunk_row_count) in enumerate(load_user_data(path, user, chunk_size)):
+            row_count += chunk_row_count
+
+            # We are interested in users with an HR above the threshold when they are sitting or lying down
+            cond_hr = df['HR'] > max_ibi_at_rest
+            cond_incl_1 = df['Inclinometer Sitting'] == 1.0
+            cond_incl_2 = df['Inclinometer Lying'] == 1.0
+            filter_conditions = cond_hr & (cond_incl_1 | cond_incl_2)
+            suspicious_rows += len(df[filter_conditions])
+            rows_while_sitting_or_lying += len(df[cond_incl_1 | cond_incl_2].index)
+
+            checked, anomaly = detect_anomalies(df, max_ibi_at_rest, state)
+            df["Checked"] = np.where(checked, "Yes", "No")
+            df["Anomaly"] = anomaly
+            n_anomalies += int(anomaly.sum())
+
+            df.index += written_rows
+            df.round(3).to_csv(f, header=(i == 0))
+            written_rows += len(df)
+
+    deleted_rows_count = row_count - written_rows
+    lib.logger("Deleted rows: " + str(deleted_rows_count) + " out of " + str(row_count), result_text, False)
+    lib.logger("Rows spent sitting or lying down: " + str(rows_while_sitting_or_lying) + " out of " + str(written_rows), result_text, False)
+
+
+    if n_anomalies > 0:
+        anomalies_percentage = round((n_anomalies / rows_while_sitting_or_lying) * 100, 2)
+        lib.logger("Anomalies found: " + str(n_anomalies) + " out of " + str(suspicious_rows) + " possible", result_text, False)
+        lib.logger("Percentage of time spent sitting or lying down: " + "{}%".format(anomalies_percentage) + "\n", result_text, False)
+    else:
+        lib.logger("No anomalies found out of {} possible\n".format(suspicious_rows), result_text, False)
+
+    return result_text
+
+
+# Percentage of anomalies over the time spent sitting or lying down for every threshold, the file is read only once
+# The percentages are the same that create_datasets.compute_anomalies_percentage computes on Actigraph-processed
+def sweep_user(user, path, thresholds, chunk_size=None):
+    rows_while_sitting_or_lying = 0
+    anomalies = np.zeros(len(thresholds), dtype=np.int64)
+    states = [{} for _ in thresholds]
+    for df, _ in load_user_data(path, user, chunk_size):
+        rows_while_sitting_or_lying += ((df['Inclinometer Sitting'] == 1.0) | (df['Inclinometer Lying'] == 1.0)).sum()
+        for i, threshold in enumerate(thresholds):
+            _, anomaly = detect_anomalies(df, threshold, states[i])
+            anomalies[i] += anomaly.sum()
+    return [round((anomalies[i] / rows_while_sitting_or_lying) * 100, 2) for i in range(len(thresholds))]
+
+
+# Threshold sweep mode: instead of writing the processed files for a single threshold, computes the anomalies
+# percentage of each user for all the thresholds and saves them in a users x thresholds table in the Datasets folder
+def sweep_thresholds(path, users, thresholds, workers = 1, chunk_size = None):
+    print("Computing the anomalies for thresholds", thresholds)
+    percentages = list(parallel.run_per_user(sweep_user, users, (path, thresholds, chunk_size), workers))
+
+    df_sweep = pd.DataFrame(percentages, index=users, columns=[str(threshold) for threshold in thresholds])
+    df_sweep.index.name = "user"
+
+    os.makedirs(os.getcwd() + "/Datasets", exist_ok=True)
+    df_sweep.to_csv(os.getcwd() + "/" + SWEEP_FILE)
+    print("Done! The anomalies percentages have been saved in", SWEEP_FILE)
+    return df_sweep
+
+
+# The users that are not up to date are run on workers processes by parallel.run_pending_users (see done_logs there)
+# chunk_size is the number of rows of the Actigraph files read at a time, see preprocess_user
+# Returns the log rows of every user
+def preprocessing(path, users, max_ibi_at_rest = 0, workers = 1, done_logs = None, chunk_size = None):
     if max_ibi_at_rest == 0:
         print("Enter the maximum heart rate at rest (e.g. 100):")
         max_ibi_at_rest = int(input())
@@ -14,77 +156,11 @@ def preprocessing(path, users, max_ibi_at_rest = 0):
 
     # This list will contain the log rows that will be saved to the file
     result_text = ["Maximum heart rate entered: " + str(max_ibi_at_rest) + "\n\n"]
-    
-    for user in users:
-        lib.logger(user, result_text)
 
-        # Creating the dataframe
-        df = pd.read_csv(path + '%s/%s.csv' %(user, "Actigraph"))
-        df = df.drop(['Unnamed: 0'], axis=1, errors='ignore')  # Removing the index column
-        df['day'] = df['day'].replace(-29, 2)  # Fix data for users 8 and 9
-
-
-        # Removing rows with impossible HR values
-        row_count = len(df)
-        deleted_rows_count = len(df[df['HR'] > 200]) + len(df[df['HR'] < 50])
-        df = df.drop(df[df['HR'] > 200].index)
-        df = df.drop(df[df['HR'] < 50].index)
-        df = df.reset_index(drop=True)
-        lib.logger("Deleted rows: " + str(deleted_rows_count) + " out of " + str(row_count), result_text)
-        
-
-        # We are interested in users with an HR above the threshold when they are sitting or lying down
-        cond_hr = df['HR'] > max_ibi_at_rest
-        cond_incl_1 = df['Inclinometer Sitting'] == 1.0
-        cond_incl_2 = df['Inclinometer Lying'] == 1.0
-        filter_conditions = cond_hr & (cond_incl_1 | cond_incl_2)
-        suspicious_rows = len(df[filter_conditions])
-
-        rows_while_sitting_or_lying = len(df[cond_incl_1 | cond_incl_2].index)
-        lib.logger("Rows spent sitting or lying down: " + str(rows_while_sitting_or_lying) + " out of " + str(len(df)), result_text, False)
-
-
-        # Initializing new columns and cycle variables
-        df["Checked"] = "No"
-        df["Anomaly"] = False
-        skip = False
-        n_anomalies = 0
-
-        # Iterate over the data filtered with the conditions to save only the cases where stress wasn't already present
-        for idx, row in df[filter_conditions].iterrows():
-            df.at[idx, "Checked"] = "Yes"
-            if idx == 0:
-                continue  # The first row has no previous one to compare with
-            
-            # Take data from the previous row, if the user was standing and still had a high HR, do not save:
-            previous_row = df.loc[idx - 1]
-            if (previous_row['Inclinometer Off'] == 1.0 or previous_row['Inclinometer Standing'] == 1.0):
-                if (previous_row['HR'] < row["HR"] * 0.8):  # *0.8 to loosen the condition
-                    df.at[idx, "Anomaly"] = True
-                    n_anomalies += 1
-                    skip = False
-                else:
-                    skip = True
-            else:
-                if (previous_row['HR'] <= max_ibi_at_rest):
-                    skip = False
-                    n_anomalies += 1
-                    df.at[idx, "Anomaly"] = True
-                elif not skip:
-                    n_anomalies += 1
-                    df.at[idx, "Anomaly"] = True
-            
-
-        if n_anomalies > 0:
-            anomalies_percentage = round((n_anomalies / rows_while_sitting_or_lying) * 100, 2)
-            lib.logger("Anomalies found: " + str(n_anomalies) + " out of " + str(suspicious_rows) + " possible", result_text)
-            lib.logger("Percentage of time spent sitting or lying down: " + "{}%".format(anomalies_percentage) + "\n", result_text)
-        else:
-            lib.logger("No anomalies found out of {} possible\n".format(suspicious_rows), result_text)
-        
-        # Save the processed values to the new file
-        user_file_name = path + user + "/Actigraph-processed.csv"
-        df.round(3).to_csv(user_file_name)
+    user_logs = parallel.run_pending_users(preprocess_user, users, (path, max_ibi_at_rest, chunk_size), workers, done_logs,
+                                           lambda user_text: print("".join(user_text), end=""))
+    for user in users:
+        result_text.extend(user_logs[user])
 
 
     # Save the log
@@ -94,6 +170,7 @@ def preprocessing(path, users, max_ibi_at_rest = 0):
             f.write(row)
 
     print("Done! The results have been saved in the output file.")
+    return user_logs
 
 
 
@@ -3,108 +3,215 @@
 import os
 import pandas as pd
 import numpy as np
-from datetime import timedelta
+import function_code.artifacts as artifacts
+import function_code.open_data as open_data
 import utilities.library as lib
-
-
-
-def calc_sec_difference(start, end):
-    difference = end - start
-    return difference.total_seconds()
-    
-
-def add_time(time, ibi):
-    new_time = time + timedelta(milliseconds=(ibi*1000))
-    return new_time
-    
-
-def interpolation(row, time_start, ibi_start):
-    time_end = row["time"]
-    ibi_end = row["ibi_s"]
-    day = row["day"]
-
-    gap = abs(calc_sec_difference(time_start, time_end))
-    
-    ibi_avg = (ibi_start + ibi_end) / 2
-    num_intervals = int(gap / ibi_avg)
-    ibi_interpolated = np.linspace([ibi_start], [ibi_end], num_intervals)
-    # Since the first ibi would be the same as the previous row, interpolate again starting from the second value
-    if len(ibi_interpolated) > 1:  # to prevent crashing if it finds only one value
-        ibi_interpolated = np.linspace(ibi_interpolated[1][0], [ibi_end], num_intervals)
-    
-    ibi_list = []
-    time_list = []
-    day_list = []
-    time_interval = time_start
-    
-    for i in range(num_intervals):
-        time_interval = add_time(time_interval, ibi_interpolated[i][0])
-        ibi_list.append(ibi_interpolated[i][0])
-        time_list.append(time_interval)
-        # Since the day is not marked in the time column, it takes the execution day, so it needs to be checked this way
-        if (time_start.day == time_interval.day):
-            day_list.append(day)
-        else:
-            day_list.append(day + 1)
-    
-    row["ibi_s"] = ibi_list
-    row["day"] = day_list
-    row["time"] = time_list
-
-    return row
-
-def preprocessing(path, users):
+import utilities.parallel as parallel
+import utilities.time_parsing as time_parsing
+
+
+def timedelta_microseconds(milliseconds):
+    # Vectorized version of timedelta(milliseconds=x) expressed in microseconds, including its rounding:
+    # the integer and fractional parts are converted separately and the leftover is rounded half to even
+    fraction, whole = np.modf(milliseconds)
+    microseconds = whole.astype(np.int64) * 1000
+    leftover, whole_us = np.modf(1000.0 * fraction)
+    microseconds += whole_us.astype(np.int64)
+    round_up = (leftover > 0.5) | ((leftover == 0.5) & (microseconds % 2 == 1))
+    return microseconds + round_up
+
+
+def interpolate_gaps(time_us, ibi, day, to_interpolate):
+    """
+    Fills the gaps before the rows marked in to_interpolate with evenly spaced beats.
+    Each marked row is replaced by int(gap / mean ibi) beats whose ibi goes linearly from the previous beat to the
+    marked one, with the times accumulated from the previous beat, as the old row by row interpolation did.
+    Consecutive marked rows start from the last beat created for the previous row, so the rows are processed in
+    levels (first the rows whose previous row is not marked, then the ones after them and so on), each level in a
+    single batch. The times are kept in integer microseconds to reproduce the timedelta arithmetic exactly.
+    Parameters
+    ---------
+    time_us : array
+        Time of each beat in microseconds from midnight.
+    ibi : array
+        Inter-beat intervals in seconds.
+    day : array
+        Day of each beat.
+    to_interpolate : array
+        Boolean mask of the rows preceded by a gap to fill (the first row cannot be marked).
+    Returns
+    ---------
+    time_us, ibi, day, interpolated : array
+        The columns with the interpolated beats in place of the marked rows, interpolated marks the new rows.
+    """
+    n_rows = len(ibi)
+    counts = np.ones(n_rows, dtype=np.int64)
+    last_time = time_us.copy()  # Time and ibi of the last beat written for each row, used by the following row
+    last_ibi = ibi.copy()
+    filled = {}
+
+    rows = np.flatnonzero(to_interpolate)
+    # Level of each marked row: how many marked rows come right before it
+    new_run = np.ones(len(rows), dtype=bool)
+    new_run[1:] = np.diff(rows) != 1
+    positions = np.arange(len(rows))
+    levels = positions - np.maximum.accumulate(np.where(new_run, positions, 0))
+
+    for level in range(levels.max() + 1 if len(rows) > 0 else 0):
+        level_rows = rows[levels == level]
+        time_start = last_time[level_rows - 1]
+        ibi_start = last_ibi[level_rows - 1]
+        ibi_end = ibi[level_rows]
+
+        gap = np.abs(time_us[level_rows] - time_start) / 1e6
+        num_intervals = (gap / ((ibi_start + ibi_end) / 2)).astype(np.int64)
+        # A gap too short to contain a beat leaves the row as it is
+        level_rows, time_start, ibi_start, ibi_end, num_intervals = [
+            values[num_intervals > 0] for values in (level_rows, time_start, ibi_start, ibi_end, num_intervals)]
+        if len(level_rows) == 0:
+            continue
+
+        # The old code took np.linspace(ibi_start, ibi_end, n) and then interpolated again from its second value,
+        # the same floating point operations are done here on all the gaps of the level at once
+        divisor = np.maximum(num_intervals - 1, 1)
+        second_value = np.where(num_intervals == 2, ibi_end, (ibi_end - ibi_start) / divisor + ibi_start)
+        first_value = np.where(num_intervals == 1, ibi_start, second_value)
+        step = (ibi_end - first_value) / divisor
+
+        segment = np.repeat(np.arange(len(level_rows)), num_intervals)
+        segment_start = np.cumsum(num_intervals) - num_intervals
+        k = np.arange(len(segment)) - segment_start[segment]
+        new_ibi = k * step[segment] + first_value[segment]
+        is_last = k == num_intervals[segment] - 1
+        new_ibi[is_last & (num_intervals[segment] > 1)] = ibi_end[segment][is_last & (num_intervals[segment] > 1)]
+
+        # Times are accumulated from the previous beat, one ibi at a time
+        increments = timedelta_microseconds(new_ibi * 1000)
+        cumulative = np.cumsum(increments)
+        cumulative -= np.repeat(cumulative[segment_start] - increments[segment_start], num_intervals)
+        new_time = time_start[segment] + cumulative
+        # Since the day is not marked in the time column, the beats that pass midnight belong to the next day
+        new_day = day[level_rows][segment] + (new_time // time_parsing.DAY_US != time_start[segment] // time_parsing.DAY_US)
+
+        counts[level_rows] = num_intervals
+        last_time[level_rows] = new_time[is_last]
+        last_ibi[level_rows] = new_ibi[is_last]
+        filled[level] = (level_rows, new_time, new_ibi, new_day)
+
+    # Write everything in preallocated arrays, each row takes as many positions as the beats it became
+    offsets = np.cumsum(counts) - counts
+    out_time = np.empty(counts.sum(), dtype=np.int64)
+    out_ibi = np.empty(counts.sum(), dtype=np.float64)
+    out_day = np.empty(counts.sum(), dtype=day.dtype)
+    out_interpolated = np.repeat(np.asarray(to_interpolate, dtype=bool), counts)
+
+    single = counts == 1
+    out_time[offsets[single]] = time_us[single]
+    out_ibi[offsets[single]] = ibi[single]
+    out_day[offsets[single]] = day[single]
+    for level_rows, new_time, new_ibi, new_day in filled.values():
+        target = np.repeat(offsets[level_rows], counts[level_rows])
+        target += np.arange(len(target)) - np.repeat(np.cumsum(counts[level_rows]) - counts[level_rows], counts[level_rows])
+        out_time[target] = new_time
+        out_ibi[target] = new_ibi
+        out_day[target] = new_day
+
+    return out_time, out_ibi, out_day, out_interpolated
+
+
+# Interpolates one chunk of the RR file without its artifacts, previous holds the state carried from the chunk before:
+# the time of its last row (to find the gaps) and the time, ibi and day of the last beat it wrote (where the
+# interpolation of a gap at the start of the chunk begins), None for the first chunk
+# Returns the processed chunk, the state for the next chunk and the number of rows to interpolate for the log
+def preprocess_chunk(df, previous):
+    df['day'] = time_parsing.fix_day(df['day'])  # Fix days for some users
+    columns = list(df.columns) + ["interpolate"]
+    if len(df) == 0:
+        return pd.DataFrame(columns=columns), previous, 0
+
+    # Work on plain arrays, with the time in microseconds from midnight
+    time_us = time_parsing.time_to_us(df["time"])
+    ibi = df["ibi_s"].values.astype(np.float64)
+    day = df["day"].values
+
+
+    # Interpolation of intervals between 2 and 10 seconds
+
+    # Find the indices of rows where interpolation is needed (the first row of the file has no previous one)
+    time_difference = np.diff(time_us, prepend=time_us[:1] if previous is None else previous[0])
+    interpolate_conditions = (time_difference > 2000000) & (time_difference <= 10000000)
+    last_row_time = time_us[-1]
+
+    # The last beat of the previous chunk is put back in front of the rows, so that a gap at the start of the
+    # chunk is filled from it as if the file had been read whole, then it is removed from the output
+    if previous is not None:
+        time_us = np.concatenate(([previous[1]], time_us))
+        ibi = np.concatenate(([previous[2]], ibi))
+        day = np.concatenate(([previous[3]], day)).astype(day.dtype)
+        interpolate_conditions = np.concatenate(([False], interpolate_conditions))
+    interpolate_conditions[:1] = False
+
+    time_us, ibi, day, interpolated = interpolate_gaps(time_us, ibi, day, interpolate_conditions)
+    if previous is not None:
+        time_us, ibi, day, interpolated = time_us[1:], ibi[1:], day[1:], interpolated[1:]
+    previous = (last_row_time, time_us[-1], ibi[-1], day[-1])
+
+    df_processed = pd.DataFrame({"ibi_s": ibi, "day": day, "time": time_us, "interpolate": interpolated}, columns=columns)
+    # Prune decimal places
+    df_processed["time"] = time_parsing.format_time(time_us)
+    df_processed["ibi_s"] = df_processed["ibi_s"].round(3)
+    return df_processed, previous, int(interpolate_conditions.sum())
+
+
+# Writes the RR-processed file of a user and returns its log rows, it runs in the worker processes of preprocessing
+# chunk_size is the number of RR rows read at a time, None reads the file whole
+# The beats rejected by the artifact rules are deleted (the correction of the rules is not used), the gaps
+# they leave are then interpolated as the others
+def preprocess_user(user, path, chunk_size=None, rules=artifacts.PREPROCESS_RULES):
+    result_text = []
+    lib.logger(user, result_text, False)
+
+    row_count = deleted_rows_count = rows_to_interpolate = written_rows = 0
+    previous = None
+    previous_ibi = None     # Last interval of the previous chunk, for the successive change rule
+    # Save the file with processed data, one chunk at a time
+    user_file_name = path + user + "/RR-processed.csv"
+    with open(user_file_name, "w") as f:
+        for i, df in enumerate(open_data.read_chunks(path + '%s/%s.csv' %(user, "RR"), chunk_size)):
+            row_count += len(df)
+            # Filter the artifacts, by default the intervals below 0.3 and above 2 seconds (so-called ectopic beats)
+            flags = artifacts.find_artifacts(df['ibi_s'].values, rules, previous_ibi)
+            previous_ibi = df['ibi_s'].values[-1] if len(df) > 0 else previous_ibi
+            deleted_rows_count += int(np.count_nonzero(flags))
+            df, previous, to_interpolate = preprocess_chunk(df[flags == 0].reset_index(drop=True), previous)
+            rows_to_interpolate += to_interpolate
+            df.index += written_rows
+            df.to_csv(f, header=(i == 0))
+            written_rows += len(df)
+
+    rows_before_interpolation = row_count - deleted_rows_count
+    lib.logger("Deleted {} rows out of {}".format(deleted_rows_count, row_count), result_text, False)
+    lib.logger("Rows to interpolate: {} out of {}".format(rows_to_interpolate, rows_before_interpolation), result_text, False)
+    lib.logger("Added {} rows, now there are {}\n".format(written_rows - rows_before_interpolation, written_rows), result_text, False)
+
+    return result_text
+
+
+# workers and done_logs are passed to parallel.run_pending_users, which returns the log rows of every user
+# chunk_size is the number of rows of the RR files read at a time, see preprocess_user
+# rules are the artifact rules of the deleted beats (see function_code.artifacts)
+def preprocessing(path, users, workers = 1, done_logs = None, chunk_size = None, rules = artifacts.PREPROCESS_RULES):
     result_text = []
     print()  # empty print to separate from the first print
+
+    def print_log(user_text):
+        print("Data cleaning and interpolation for", user_text[0], end="")
+        for row in user_text[1:]:
+            print(row, end="")
+
+    user_logs = parallel.run_pending_users(preprocess_user, users, (path, chunk_size, rules), workers, done_logs, print_log)
     for user in users:
-        print("Data cleaning and interpolation for", user)
-        lib.logger(user, result_text, False)
-
-        print("Creating the dataframe...")
-        df = pd.read_csv(path + '%s/%s.csv' %(user, "RR"))
-        df = df.drop(['Unnamed: 0'], axis=1, errors='ignore')  # Drop the CSV index column if present
-
-        # Convert types to object to be able to replace rows with interpolated ones later
-        df['day'] = df['day'].replace(-29, 2).astype(object)  # Fix days for some users
-        df["time"] = pd.to_datetime(df["time"], infer_datetime_format=True).astype(object)  # infer_datetime_format is not necessary but doesn't hurt
-        df["ibi_s"] = df["ibi_s"].astype(object)
-
-        # Filter intervals below 0.3 and above 2 seconds (so-called ectopic beats)
-        deleted_rows_count = len(df[(df['ibi_s'] < 0.3)]) + len(df[(df['ibi_s'] > 2)])
-        lib.logger("Deleted {} rows out of {}".format(deleted_rows_count, len(df)), result_text)
-        df = df.drop(df[(df['ibi_s'] < 0.3) | (df['ibi_s'] > 2)].index).reset_index(drop=True)
-        
-
-        # Interpolation of intervals between 2 and 10 seconds
-        
-        # Find the indices of rows where interpolation is needed and mark them in a new dataset column
-        condition_1 = (df['time'] - df['time'].shift()).dt.total_seconds() > 2
-        condition_2 = (df['time'] - df['time'].shift()).dt.total_seconds() <= 10
-        interpolate_conditions = condition_1 & condition_2
-        df['interpolate'] = interpolate_conditions
-
-        rows_before_interpolation = len(df)
-        lib.logger("Rows to interpolate: {} out of {}".format(len(df[interpolate_conditions]), rows_before_interpolation), result_text)
-
-        # Perform interpolation for all rows one by one
-        for idx, row in df[interpolate_conditions].iterrows():
-            previous_row = df.loc[idx - 1]
-            # Take time and ibi from the previous row (if it was interpolated in the previous step, it will be in list format)
-            time_start = previous_row["time"][-1] if isinstance(previous_row["time"], list) else previous_row["time"]
-            ibi_start = previous_row["ibi_s"][-1] if isinstance(previous_row["ibi_s"], list) else previous_row["ibi_s"]
-            interpolated_row = interpolation(row, time_start, ibi_start)
-            df.loc[idx] = interpolated_row  # Replace the original row with the interpolated one
-
-        df = df.apply(pd.Series.explode)  # Explode interpolated rows to have one row per list element
-        lib.logger("Added {} rows, now there are {}\n".format(len(df) - rows_before_interpolation, len(df)), result_text)
-
-        # Prune decimal places
-        df["time"] = df["time"].apply(lambda x: x.strftime("%H:%M:%S.%f")[:-3])
-        df["ibi_s"] = df["ibi_s"].astype(float).round(3)
-
-        # Save the file with processed data
-        user_file_name = path + user + "/RR-processed.csv"
-        df.reset_index(drop=True).to_csv(user_file_name)
+        result_text.extend(user_logs[user])
 
 
     # Save the log
@@ -114,6 +221,7 @@ def preprocessing(path, users):
             f.write(row)
 
     print("Done! The results were saved in the output file.")
+    return user_logs
 
 
 
@@ -0,0 +1,77 @@
+# Append-only store of the results of the model tests, in an sqlite database
+# Every row holds the metrics of one model on one questionnaire, identified by the dataset (name and hash of its file),
+# the questionnaire, the model (name and parameters), the feature selection and the version of the test code
+# Rows are written as soon as a model is tested and never overwritten, so an interrupted sweep resumes from the
+# models it did not test yet, and the results tables of 3_Test_models are queried from here
+
+import os
+import hashlib
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+
+
+RESULTS_DB = "Results/results.sqlite"
+
+KEY_COLUMNS = ["dataset", "data_version", "questionnaire", "model", "model_params", "feature_selection", "code_version"]
+# Columns of the results tables, in the order of the files written by 3_Test_models
+METRICS_COLUMNS = ["mean_error", "max_error", "min_error", "std_dev", "correct_labels_total", "wrong_labels_total",
+                   "very_wrong_labels_total", "error_ratio"]
+
+
+# Short hash of the content of some files, to tell apart results computed by different code or on different data
+def files_version(file_paths):
+    sha = hashlib.sha1()
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+# Version of the code files of the Workspace folder
+def code_version(code_files):
+    return files_version([os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name) for file_name in code_files])
+
+
+def connect(db_file=RESULTS_DB):
+    db_path = os.path.join(os.getcwd(), db_file)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    # The metrics columns have no type so that integers and strings are read back as they were written
+    connection.execute("CREATE TABLE IF NOT EXISTS results ({}, {}, num_features, created TEXT, PRIMARY KEY ({}))".format(
+        ", ".join(column + " TEXT" for column in KEY_COLUMNS), ", ".join(METRICS_COLUMNS), ", ".join(KEY_COLUMNS)))
+    return connection
+
+
+# Names of the models already tested with this key (every key column but model and model_params)
+# models maps the name of each model to its parameters, a model whose parameters changed is not considered tested
+def tested_models(connection, key, models):
+    rows = connection.execute("SELECT model, model_params FROM results WHERE " + " AND ".join(column + " = ?" for column in key),
+                              list(key.values())).fetchall()
+    return [model for model, model_params in rows if models.get(model) == model_params]
+
+
+# Saves the results of a model, key has every column of KEY_COLUMNS, df_partial is the row returned by runTest (empty if the model gave no predictions)
+def add_result(connection, key, df_partial, num_features=None):
+    metrics = df_partial.iloc[0].to_dict() if len(df_partial) > 0 else {}
+    values = [metrics.get(column) for column in METRICS_COLUMNS] + [num_features]
+    # numpy numbers are saved as the python ones
+    values = [value.item() if isinstance(value, np.generic) else value for value in values]
+    with connection:
+        connection.execute("INSERT OR IGNORE INTO results VALUES ({})".format(", ".join("?" * (len(KEY_COLUMNS) + len(values) + 1))),
+                           [key[column] for column in KEY_COLUMNS] + values + [datetime.datetime.now().isoformat(timespec="seconds")])
+
+
+# Results table of a questionnaire, with a row for each model in the order of models (a dict from name to parameters)
+# The models without predictions are left out, as in the tables built by main_loop
+def query_results(connection, key, models):
+    rows = connection.execute("SELECT model, model_params, {} FROM results WHERE ".format(", ".join(METRICS_COLUMNS)) +
+                              " AND ".join(column + " = ?" for column in key), list(key.values())).fetchall()
+    # object columns like the tables of main_loop, so that the integer errors of the classifiers stay integers
+    df = pd.DataFrame(rows, columns=["model", "model_params"] + METRICS_COLUMNS, dtype=object)
+    df = df.loc[np.array([models.get(model) == model_params for model, model_params in zip(df["model"], df["model_params"])], dtype=bool)]
+    df = df.dropna(how="all", subset=METRICS_COLUMNS).set_index("model")
+    df = df.reindex([model for model in models if model in df.index])[METRICS_COLUMNS]
+    df.index.name = "MODEL"
+    return df
@@ -2,8 +2,7 @@
 
 import os
 import pandas as pd
-import numpy as np
-import function_code.open_data as open_data
+import function_code.rr_store as rr_store
 import function_code.HRV_analysis as HRV_analysis
 import warnings
 warnings.filterwarnings("ignore")
@@ -12,21 +11,12 @@ warnings.filterwarnings("ignore")
 if __name__=="__main__":
     # Create a list of users
     path = os.getcwd() + "/DataPaper/"
-    users = os.listdir(path)
+    users = [user for user in os.listdir(path) if os.path.isfile(os.path.join(path, user, "RR.csv"))]
 
-    # Retrieve heart rate data
-    df_rr = open_data.create_dataset(path, users, 'RR').reset_index()
-
-    # Time conversion: 0 refers to noon, while positive and negative values refer to pre and post-midnight data
-    df_rr['timestamp'] = [float(x.split(':')[0])*60*60 + float(x.split(':')[1])*60 + float(x.split(':')[2]) if y==1 else 
-                            float(x.split(':')[0])*60*60 + float(x.split(':')[1])*60 + float(x.split(':')[2]) + 24*60*60
-                            for x,y in zip(df_rr['time'],df_rr['day'])]
-
-    # Filter out ectopic beats
-    df_rr['ibi_s'] = [x if x<2 else np.nan for x in df_rr['ibi_s']]
-    df_rr['ibi_s'] = [x if x>0.3 else np.nan for x in df_rr['ibi_s']]
-
-    df_user = df_rr[df_rr['user']=="user_1"].dropna()
+    # Retrieve heart rate data of the user from the RR store, the timestamps are already converted to seconds
+    # and the ectopic beats are already filtered out (see function_code.artifacts)
+    ibi, timestamps = rr_store.load_store(path, users, 'RR').get_clean("user_1")
+    df_user = pd.DataFrame({"ibi_s": ibi, "timestamp": timestamps}).dropna()
 
     # Select a 5-minute time window for HRV analysis
     df_user["window"] = df_user.timestamp.diff().dropna().cumsum().pipe(lambda x: pd.to_timedelta(x, "s")).dt.floor("5min")
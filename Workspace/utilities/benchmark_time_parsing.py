@@ -0,0 +1,68 @@
+# Micro-benchmark of the time parsing: compares utilities.time_parsing with the row by row conversions it replaced
+# The times are random "HH:MM:SS.fff" strings, the results are given in seconds per million timestamps
+# Run from the Workspace folder with: python -m utilities.benchmark_time_parsing [number of timestamps]
+
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import utilities.time_parsing as time_parsing
+
+
+def random_times(n, seed=0):
+    rng = np.random.default_rng(seed)
+    time_us = rng.integers(0, time_parsing.DAY_US, n) // 1000 * 1000
+    return pd.Series(time_parsing.format_time(time_us)), rng.integers(1, 3, n)
+
+
+def split_seconds(times, days):
+    return [float(x.split(':')[0])*60*60 + float(x.split(':')[1])*60 + float(x.split(':')[2]) if y==1 else
+            float(x.split(':')[0])*60*60 + float(x.split(':')[1])*60 + float(x.split(':')[2]) + 24*60*60
+            for x, y in zip(times, days)]
+
+
+def strptime_seconds(times):
+    return [(datetime.strptime(x, "%H:%M:%S.%f") - datetime(1900, 1, 1)).total_seconds() for x in times]
+
+
+def to_datetime_us(times):
+    parsed = pd.to_datetime(times, infer_datetime_format=True)
+    return (parsed - parsed.dt.normalize()).values.astype(np.int64) // 1000
+
+
+def strftime_format(time_us):
+    return [(datetime(1900, 1, 1) + timedelta(microseconds=int(x))).strftime("%H:%M:%S.%f")[:-3] for x in time_us]
+
+
+def measure(function, *args, repeat=3):
+    # Best of the repetitions, to reduce the noise of the other processes
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__=="__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    times, days = random_times(n)
+    time_us = time_parsing.time_to_us(times)
+
+    # The results must be the same before comparing the times
+    assert np.array_equal(time_parsing.time_to_seconds(times, days), np.array(split_seconds(times, days)))
+    assert np.array_equal(time_us, to_datetime_us(times))
+    assert list(time_parsing.format_time(time_us)) == strftime_format(time_us)
+
+    benchmarks = [("Parsing to seconds", "split list comprehension", split_seconds, time_parsing.time_to_seconds, (times, days)),
+                  ("Parsing to seconds", "datetime.strptime", strptime_seconds, time_parsing.time_to_seconds, (times,)),
+                  ("Parsing to microseconds", "pd.to_datetime", to_datetime_us, time_parsing.time_to_us, (times,)),
+                  ("Formatting", "strftime", strftime_format, time_parsing.format_time, (time_us,))]
+
+    print("Seconds per million timestamps, measured on {} timestamps\n".format(n))
+    print("{:<25}{:<28}{:>10}{:>14}{:>10}".format("Operation", "Old method", "Old", "time_parsing", "Speedup"))
+    for operation, name, old_function, new_function, args in benchmarks:
+        old_time = measure(old_function, *args, repeat=1) * 1e6 / n
+        new_time = measure(new_function, *args) * 1e6 / n
+        print("{:<25}{:<28}{:>10.3f}{:>14.3f}{:>9.0f}x".format(operation, name, old_time, new_time, old_time / new_time))
@@ -1,97 +1,104 @@
 # Script that searchs for temporal holes in the RR.csv files
 # Holes are considered when longer than two seconds
+# The statistics can also be computed from other scripts with gap_analysis, which returns them as a dataframe
 
 import os
 import sys
+import numpy as np
 import pandas as pd
-from datetime import datetime
+import utilities.time_parsing as time_parsing
 
 
-def calculate_time_difference(start_time, end_time):
+# Names of the statistics, in the order of the text report
+GAP_COLUMNS = ["gaps", "gaps_10s", "gaps_20s", "gaps_30s", "interpolable_seconds", "interpolable_hours"]
+
+
+def gap_statistics(microseconds):
     """
-    Calculate the difference in seconds between two times in 'hour:minute:second' format.
+    Compute the gap statistics of a recording from the times of its beats.
 
     Args:
-        start_time: string with the start time in 'hour:minute:second' format.
-        end_time: string with the end time in 'hour:minute:second' format.
+        microseconds: integer array with the time of each beat in microseconds from midnight, in the order of the file.
 
     Returns:
-        An integer with the difference in seconds between the two times.
+        A dict with the number of gaps longer than 2 seconds, the number of gaps of at least 10, 20 and 30 seconds
+        and the total length of the interpolable gaps (between 2 and 10 seconds) in seconds and in hours.
+    """
+
+    # Differences between consecutive beats in seconds, a beat before the previous one (e.g. after midnight) counts as a gap too
+    # The differences are taken on the integer microseconds, so they are exact as with datetime.strptime
+    time_gap = np.abs(np.diff(microseconds)) / 1e6
+
+    # Summed in the order of the file so that the total is the same as adding the gaps one by one
+    interpolable = time_gap[(time_gap > 2) & (time_gap < 10)]
+    interpolable_seconds = float(np.cumsum(interpolable)[-1]) if len(interpolable) > 0 else 0
+
+    return {"gaps": int((time_gap > 2).sum()),
+            "gaps_10s": int((time_gap >= 10).sum()),
+            "gaps_20s": int((time_gap >= 20).sum()),
+            "gaps_30s": int((time_gap >= 30).sum()),
+            "interpolable_seconds": interpolable_seconds,
+            "interpolable_hours": interpolable_seconds/60/60}
+
+
+def user_report(user, statistics):
+    """
+    Format the gap statistics of a user as in the RR-analysis.txt file.
     """
 
-    # Convert strings to datetime objects
-    start = datetime.strptime(start_time, "%H:%M:%S.%f")
-    end = datetime.strptime(end_time, "%H:%M:%S.%f")
+    return ("User statistics: " + user +
+            "\nSignificant gaps found: " + str(statistics["gaps"]) +
+            "\nIntervals greater than or equal to 10 seconds: " + str(statistics["gaps_10s"]) +
+            "\nIntervals greater than or equal to 20 seconds: " + str(statistics["gaps_20s"]) +
+            "\nIntervals greater than or equal to 30 seconds: " + str(statistics["gaps_30s"]) +
+            "\nTotal interpolable seconds: " + str(statistics["interpolable_seconds"]) +
+            "\nTotal interpolable seconds in hours: " + str(statistics["interpolable_hours"]) +
+            "\n\n")
 
-    # Calculate the difference between the two times
-    difference = end - start
 
-    # Return the difference in seconds
-    return difference.total_seconds()
+def gap_analysis(path, users, file_name="RR"):
+    """
+    Compute the gap statistics of every user, reading only the time column of their files.
+
+    Args:
+        path: folder with a subfolder for each user.
+        users: list of the users to analyze.
+        file_name: name of the csv file of the users to analyze (without the extension).
+
+    Returns:
+        A dataframe with a row for each user and a column for each statistic, and the text of the report.
+    """
+
+    statistics = []
+    report = ""
+    for user in users:
+        print("Processing user:", user)
+        df = pd.read_csv(os.path.join(path, user, file_name + '.csv'), usecols=["time"])
+        user_statistics = gap_statistics(time_parsing.time_to_us(df["time"]))
+        statistics.append(user_statistics)
+        report += user_report(user, user_statistics)
+
+    df_statistics = pd.DataFrame(statistics, index=users, columns=GAP_COLUMNS)
+    df_statistics.index.name = "user"
+    return df_statistics, report
 
 
 if __name__=="__main__":
     # Get the list of users
     path = os.getcwd() + '/DataPaper/'
     users = os.listdir(path)
-    
+
     if ('.DS_Store') in users:
         users.remove(".DS_Store")
 
-    # Create the txt file to store the analysis results
-    file_txt = open("Outputs/RR-analysis.txt", "w")
-
-    # For each user, retrieve and display the RR file gap statistics
-    for user in users:
-        print("Processing user:", user)
-        # Read RR.csv
-        try:
-            df = pd.read_csv(os.path.join(path, user, 'RR.csv'))
-        except Exception as e:
-            print(e)
-            print("Error reading csv file")
-            sys.exit()
-
-        num_intervals = 0
-        num_intervals_10sec = 0
-        num_intervals_20sec = 0
-        num_intervals_30sec = 0
-        interpolable_interval_seconds = 0
-
-        # Read rows one by one to find gaps
-        i = 0
-        while i < len(df)-1:
-            time1 = df.iloc[i]["time"]
-            time2 = df.iloc[i+1]["time"]
-            
-            # Calculate the time difference in seconds
-            time_gap = calculate_time_difference(time2, time1)
-            
-            # If the difference is greater than two seconds, count it as a gap
-            if abs(time_gap) > 2:
-                num_intervals += 1
-
-            if abs(time_gap) > 2 and abs(time_gap) < 10:
-                interpolable_interval_seconds += abs(time_gap)
-
-            if abs(time_gap) >= 10:
-                num_intervals_10sec += 1
-            if abs(time_gap) >= 20:
-                num_intervals_20sec += 1
-            if abs(time_gap) >= 30:
-                num_intervals_30sec += 1
-
-            i += 1
-
-        # Write these statistics to a txt file
-        file_txt.write("User statistics: " + user)
-        file_txt.write("\nSignificant gaps found: " + str(num_intervals))
-        file_txt.write("\nIntervals greater than or equal to 10 seconds: " + str(num_intervals_10sec))
-        file_txt.write("\nIntervals greater than or equal to 20 seconds: " + str(num_intervals_20sec))
-        file_txt.write("\nIntervals greater than or equal to 30 seconds: " + str(num_intervals_30sec))
-        file_txt.write("\nTotal interpolable seconds: " + str(interpolable_interval_seconds))
-        file_txt.write("\nTotal interpolable seconds in hours: " + str(interpolable_interval_seconds/60/60))
-        file_txt.write("\n\n")
-        
-    # Close the txt file
-    file_txt.close()
+    # For each user, retrieve the RR file gap statistics
+    try:
+        _, report = gap_analysis(path, users)
+    except Exception as e:
+        print(e)
+        print("Error reading csv file")
+        sys.exit()
+
+    # Write these statistics to a txt file
+    with open("Outputs/RR-analysis.txt", "w") as file_txt:
+        file_txt.write(report)
@@ -0,0 +1,43 @@
+# Runs a function once for every user on a pool of processes
+# The results are returned in the same order as the users list, whatever the order in which the workers finish
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def get_workers(workers):
+    # None means one worker per core, values below 1 are treated as a serial run
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def run_per_user(function, users, args=(), workers=1):
+    # function must be defined at module level (it is pickled to be sent to the workers) and take the user as first argument
+    workers = min(get_workers(workers), len(users))
+    if workers <= 1:
+        for user in users:
+            yield function(user, *args)
+        return
+
+    # Every extra argument is repeated for each user, map then keeps the order of the users
+    repeated_args = [[arg] * len(users) for arg in args]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(function, users, *repeated_args):
+            yield result
+
+
+# Runs function only for the users that are not up to date, done_logs maps the users already up to date to their logs
+# Returns the logs of every user, print_log is called with each new log as soon as it is available
+# The logs come back in the order of the users list, so the output files do not depend on the number of workers
+def run_pending_users(function, users, args=(), workers=1, done_logs=None, print_log=None):
+    user_logs = dict(done_logs or {})
+    users_to_process = [user for user in users if user not in user_logs]
+    if len(user_logs) > 0:
+        print("Skipping {} users that are already up to date\n".format(len(users) - len(users_to_process)))
+
+    for user, log in zip(users_to_process, run_per_user(function, users_to_process, args, workers)):
+        if print_log is not None:
+            print_log(log)
+        user_logs[user] = log
+    return user_logs
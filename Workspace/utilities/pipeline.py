@@ -0,0 +1,104 @@
+# Incremental execution of the pipeline: every stage is identified by a name and by the hash of its inputs
+# (the content of the input files, the code files and the parameters), stages whose hash did not change
+# and whose outputs still exist are skipped
+# The hashes of the last run are saved in Outputs/pipeline_state.json, deleting it forces a full rebuild
+
+import os
+import json
+import hashlib
+
+
+STATE_FILE = os.path.join("Outputs", "pipeline_state.json")
+
+
+def load_state():
+    state_path = os.path.join(os.getcwd(), STATE_FILE)
+    if not os.path.isfile(state_path):
+        return {"files": {}, "stages": {}}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(state):
+    state_path = os.path.join(os.getcwd(), STATE_FILE)
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    # Written to a temporary file first, so that an interrupted run cannot leave a truncated state
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(state_path + ".tmp", state_path)
+
+
+# Hash of the content of a file, recomputed only when its modification time or size change
+def file_digest(state, file_path):
+    file_path = os.path.abspath(file_path)
+    if not os.path.isfile(file_path):
+        return "missing"
+    stat = os.stat(file_path)
+    known = state["files"].get(file_path)
+    if known is not None and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+        return known["digest"]
+
+    sha = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    state["files"][file_path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "digest": sha.hexdigest()}
+    return sha.hexdigest()
+
+
+# Hash of a stage: the content of every input file (code files included) and the parameters
+def stage_digest(state, input_files, params):
+    sha = hashlib.sha1()
+    for file_path in input_files:
+        sha.update(os.path.abspath(file_path).encode())
+        sha.update(file_digest(state, file_path).encode())
+    sha.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+def is_up_to_date(state, stage, digest, output_files):
+    known = state["stages"].get(stage)
+    if known is None or known["digest"] != digest:
+        return False
+    return all(os.path.exists(file_path) for file_path in output_files)
+
+
+def mark_done(state, stage, digest, log=None):
+    state["stages"][stage] = {"digest": digest, "log": log}
+
+
+def get_log(state, stage):
+    return state["stages"][stage]["log"]
+
+
+# Runs function(*args) only if the stage is not up to date, then saves the new state
+# Returns True if the stage was executed
+def run_stage(state, stage, input_files, params, output_files, function, *args):
+    digest = stage_digest(state, input_files, params)
+    if is_up_to_date(state, stage, digest, output_files):
+        print("Stage", stage, "is up to date, skipping it")
+        return False
+    function(*args)
+    mark_done(state, stage, digest)
+    save_state(state)
+    return True
+
+
+# For the stages that are run per user: returns the hash of each user and the logs saved
+# for the users that are up to date, which do not need to be processed again
+def check_users(state, stage, users, input_files, params, output_files):
+    # input_files and output_files are functions that give the list of files of a user
+    digests = {}
+    done_logs = {}
+    for user in users:
+        digests[user] = stage_digest(state, input_files(user), params)
+        user_stage = stage + "/" + user
+        if is_up_to_date(state, user_stage, digests[user], output_files(user)):
+            done_logs[user] = get_log(state, user_stage)
+    return digests, done_logs
+
+
+def mark_users_done(state, stage, digests, logs):
+    for user, log in logs.items():
+        mark_done(state, stage + "/" + user, digests[user], log)
+    save_state(state)
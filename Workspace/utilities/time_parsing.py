@@ -0,0 +1,117 @@
+# Vectorized parsing and formatting of the "HH:MM:SS.fff" times of the dataset files
+# The whole column is converted at once: the strings are read as a matrix of bytes and the digits are taken
+# from their fixed positions, without splitting or parsing each string on its own
+# Times that do not follow the fixed format (e.g. "9:05:03") are parsed with a slower but general method
+
+import numpy as np
+import pandas as pd
+
+
+DAY_US = 24 * 60 * 60 * 1000000    # Microseconds in a day
+DAY_SECONDS = 24 * 60 * 60
+
+
+# Corrects the day column of users 8 and 9, whose second day is marked as -29
+def fix_day(day):
+    day = np.asarray(day)
+    return np.where(day == -29, 2, day)
+
+
+def _digits(chars, columns):
+    # Integer value of the digits in the given byte columns
+    value = np.zeros(len(chars), dtype=np.int64)
+    for column in columns:
+        value = value * 10 + (chars[:, column].astype(np.int64) - ord("0"))
+    return value
+
+
+def _parse_fixed(times):
+    # Returns None if the times are not all in the "HH:MM", "HH:MM:SS" or "HH:MM:SS.f..." format
+    try:
+        strings = np.asarray(times, dtype="S")
+    except UnicodeEncodeError:
+        return None
+    width = strings.dtype.itemsize
+    if len(strings) == 0 or width < 5:
+        return None
+    chars = strings.view(np.uint8).reshape(len(strings), width)
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+
+    # The separators must be in their positions and the hours and minutes must be two digits
+    if not (is_digit[:, [0, 1, 3, 4]].all() and (chars[:, 2] == ord(":")).all()):
+        return None
+    us = (_digits(chars, [0, 1]) * 60 + _digits(chars, [3, 4])) * 60000000
+    if width == 5:
+        return us
+    if width < 8:
+        return None
+
+    # The shorter strings are padded with zero bytes, so each row can have seconds or not and any number of decimals
+    has_seconds = chars[:, 5] == ord(":")
+    if not ((has_seconds | (chars[:, 5] == 0)).all() and (is_digit[has_seconds][:, [6, 7]]).all()):
+        return None
+    us += np.where(has_seconds, _digits(chars, [6, 7]) * 1000000, 0)
+    if width > 8:
+        has_decimals = has_seconds & (chars[:, 8] == ord("."))
+        if not (has_decimals | (chars[:, 8] == 0)).all():
+            return None
+        decimals = chars[:, 9:15]
+        if not (is_digit[:, 9:15] | (decimals == 0)).all() or not (is_digit[:, 15:] | (chars[:, 15:] == 0)).all():
+            return None
+        # Missing digits count as zeros, the digits after the microseconds are truncated as in datetime.strptime
+        digits = np.where(decimals == 0, 0, decimals.astype(np.int64) - ord("0"))
+        us += digits @ (10 ** np.arange(5, 5 - digits.shape[1], -1, dtype=np.int64))
+    return us
+
+
+def _parse_general(times):
+    # Slower parsing for the times with a variable number of digits in the hours, minutes or seconds
+    parts = pd.Series(times).astype(str).str.split(":", expand=True)
+    us = (parts[0].astype(np.int64).values * 60 + parts[1].astype(np.int64).values) * 60000000
+    if parts.shape[1] > 2:
+        seconds = parts[2].fillna("0").str.split(".", expand=True)
+        us += seconds[0].astype(np.int64).values * 1000000
+        if seconds.shape[1] > 1:
+            decimals = seconds[1].fillna("").str.slice(0, 6).str.ljust(6, "0")
+            us += decimals.astype(np.int64).values
+    return us
+
+
+# Microseconds from midnight of each time, as integers so that differences and sums are exact
+def time_to_us(times):
+    us = _parse_fixed(times)
+    if us is None:
+        us = _parse_general(times)
+    return us
+
+
+# Seconds from midnight of each time, a day different from 1 adds 24 hours (after the fix of the -29 days)
+# The result is the same float as float(h)*60*60 + float(m)*60 + float(s) computed on the split strings
+def time_to_seconds(times, day=None):
+    us = time_to_us(times)
+    seconds = (us // 60000000 * 60).astype(np.float64) + (us % 60000000) / 1e6
+    if day is not None:
+        seconds += np.where(fix_day(day) != 1, DAY_SECONDS, 0)
+    return seconds
+
+
+# Hour of each time, as pd.to_datetime(times).dt.hour
+def time_to_hour(times):
+    return time_to_us(times) // 3600000000
+
+
+# Formats microseconds from midnight as "HH:MM:SS.fff", like strftime("%H:%M:%S.%f")[:-3] (the milliseconds are truncated)
+# The times after midnight of the next day start again from 00:00:00
+def format_time(time_us):
+    ms = (np.asarray(time_us, dtype=np.int64) // 1000) % (DAY_US // 1000)
+    fields = [ms // 3600000, ms // 60000 % 60, ms // 1000 % 60]
+    chars = np.empty((len(ms), 12), dtype=np.uint8)
+    for i, field in enumerate(fields):
+        chars[:, 3 * i] = field // 10 + ord("0")
+        chars[:, 3 * i + 1] = field % 10 + ord("0")
+    chars[:, [2, 5]] = ord(":")
+    chars[:, 8] = ord(".")
+    chars[:, 9] = ms % 1000 // 100 + ord("0")
+    chars[:, 10] = ms % 100 // 10 + ord("0")
+    chars[:, 11] = ms % 10 + ord("0")
+    return chars.view("S12").ravel().astype(str)